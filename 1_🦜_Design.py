@@ -1,5 +1,8 @@
 import streamlit as st
+import numpy as np
 from lib.validation import sample_size_calc_ttest, sample_size_calc_ztest
+from lib.power import power_grid, mde_for_size
+from lib.profiling import stage, diagnostics_panel
 
 
 st.markdown('# 🦜 Design Module')
@@ -56,5 +59,26 @@ if result is not None:
     col2.metric(label="Control Sample Size", value=result['control_size'])
     col3.metric(label="Total", value=result['total_size'])
 
+    st.markdown('## Power Surface')
+    import plotly.graph_objects as go
+
+    std = std if criteria == 't-test' else None
+    lifts = 1 + (lift - 1) * np.linspace(0.5, 2, 16)
+    sizes = np.unique(np.linspace(max(2, result['test_size'] // 4), result['test_size'] * 2, 40).astype(int))
+    surface = power_grid(lifts, sizes, [alpha], criteria, mean, std, ratio, alternative)[:, :, 0]
+    mde = mde_for_size(sizes, alpha, power, criteria, mean, std, ratio, alternative)
+
+    with stage('render.power_surface'):
+        fig = go.Figure()
+        fig.add_trace(go.Heatmap(x=sizes, y=lifts, z=surface, zmin=0, zmax=1,
+                                 colorbar=dict(title='Power'), name='Power'))
+        fig.add_trace(go.Scatter(x=sizes, y=mde, mode='lines', line=dict(color='white', dash='dash'),
+                                 name=f'MDE at power {power}'))
+        fig.update_layout(xaxis_title='Test Sample Size', yaxis_title='Lift',
+                          yaxis_range=[lifts.min(), lifts.max()])
+        st.plotly_chart(fig, theme="streamlit", use_container_width=True)
+
 else:
     pass
+
+diagnostics_panel()
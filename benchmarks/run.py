@@ -0,0 +1,202 @@
+"""
+Benchmarks of the statistical functions and the power simulation.
+
+Usage:
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --save-baseline
+    python benchmarks/run.py --compare benchmarks/baseline.json --threshold 0.2
+
+Every benchmark reports a throughput (higher is better) and, where it matters, the peak memory
+allocated by Python and numpy during one call. Inputs are seeded, so runs on the same machine are comparable.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from lib.validation import ttest, ztest, bayes, sample_size_calc_ttest, sample_size_calc_ztest
+from lib.simulation import simulate_grid
+
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# (number of lifts, number of sizes, largest size, simulations per cell)
+GRIDS = [(2, 2, 500, 500), (4, 4, 2000, 500), (3, 3, 10000, 200)]
+
+IMPORTS = ['lib.validation', 'lib.simulation', 'lib.power', 'lib.bayesian', 'lib.executor', 'lib.cache']
+
+# cold import budget in seconds checked by --check-imports; heavy dependencies
+# (statsmodels, scipy.stats, pandas in lib.validation and lib.power, joblib, plotting) must stay out of
+# module import time
+IMPORT_BUDGET = {'lib.validation': 0.6, 'lib.bayesian': 0.6, 'lib.cache': 0.3, 'lib.executor': 0.3,
+                 'lib.simulation': 1.0, 'lib.power': 0.6}
+
+
+def throughput(func, min_time=0.5):
+    """
+    Calls func repeatedly for at least min_time seconds.
+
+    :return: Calls per second.
+    """
+    func()
+    calls, start = 0, time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+
+def peak_memory(func):
+    """
+    :return: Peak memory in bytes traced during one call of func.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_functions(min_time):
+    # the validation functions are memoized; __wrapped__ measures the computation, the *_cached entries a cache hit
+    calls = {
+        'ttest': lambda: ttest.__wrapped__(10, 10.2, 2, 2.1, 5000, 5000, 0.05, 'two-sided'),
+        'ztest': lambda: ztest.__wrapped__(5000, 5000, 560, 500, 0.05, 'two-sided'),
+        'bayes': lambda: bayes.__wrapped__(5000, 500, 5000, 560),
+        'bayes_monte_carlo': lambda: bayes.__wrapped__(5000, 500, 5000, 560, method='monte-carlo', random_state=1),
+        'sample_size_calc_ttest': lambda: sample_size_calc_ttest.__wrapped__(0.05, 0.8, 1.02, 1.0, 'two-sided', 10, 2),
+        'sample_size_calc_ztest': lambda: sample_size_calc_ztest.__wrapped__(0.05, 0.8, 1.05, 1.0, 'two-sided', 0.1),
+        'bayes_cached': lambda: bayes(5000, 500, 5000, 560),
+        'sample_size_calc_ttest_cached': lambda: sample_size_calc_ttest(0.05, 0.8, 1.02, 1.0, 'two-sided', 10, 2),
+    }
+    return {name: {'calls_per_second': throughput(func, min_time), 'peak_memory': peak_memory(func)}
+            for name, func in calls.items()}
+
+
+def bench_simulation(n_jobs):
+    data = np.random.default_rng(1).normal(10, 2, size=10000)
+    res = {}
+    for n_lifts, n_sizes, max_size, simulations in GRIDS:
+        lifts = np.linspace(1.01, 1.05, n_lifts)
+        sizes = np.linspace(max_size // n_sizes, max_size, n_sizes).astype(int)
+        run = lambda: simulate_grid(lifts, sizes, data, simulations, n_jobs=n_jobs, random_state=1)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        res[f'grid_{n_lifts}x{n_sizes}_n{max_size}_s{simulations}'] = {
+            'cells_per_second': n_lifts * n_sizes / elapsed,
+            'simulations_per_second': n_lifts * n_sizes * simulations / elapsed,
+            'peak_memory': peak_memory(lambda: simulate_grid(lifts, sizes, data, simulations, n_jobs=1,
+                                                             random_state=1)),
+        }
+    return res
+
+
+def bench_imports(repeat=3):
+    """
+    Measures the cold import time of every lib module in a fresh interpreter; the best of repeat runs is kept.
+    """
+    res = {}
+    for module in IMPORTS:
+        code = f'import time; s = time.perf_counter(); import {module}; print(time.perf_counter() - s)'
+        times = [float(subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                                      check=True).stdout) for _ in range(repeat)]
+        res[module] = {'import_seconds': min(times)}
+    return res
+
+
+def check_imports(budget=IMPORT_BUDGET, scale=1.0):
+    """
+    Measures cold imports and compares them with the budget.
+
+    :param budget: Dictionary {module: seconds}.
+    :param scale: Multiplier of the budget for slower machines.
+    :return: List of (module, seconds, budget, is over budget).
+    """
+    times = bench_imports()
+    return [(module, times[module]['import_seconds'], limit * scale, times[module]['import_seconds'] > limit * scale)
+            for module, limit in budget.items()]
+
+
+def run(min_time=0.5, n_jobs=-1):
+    return {
+        'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                 'cpus': os.cpu_count(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'functions': bench_functions(min_time),
+        'simulation': bench_simulation(n_jobs),
+        'imports': bench_imports(),
+    }
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compares every metric with the baseline.
+
+    Throughputs are regressions when they drop, import times and memory when they grow, by more than threshold.
+
+    :return: List of (benchmark, metric, baseline value, current value, relative change, is regression).
+    """
+    rows = []
+    for group, benchmarks in baseline.items():
+        if group == 'meta':
+            continue
+        for name, metrics in benchmarks.items():
+            for metric, old in metrics.items():
+                new = results.get(group, {}).get(name, {}).get(metric)
+                if new is None or not old:
+                    continue
+                change = new / old - 1
+                higher_is_better = metric.endswith('_per_second')
+                regression = change < -threshold if higher_is_better else change > threshold
+                rows.append((f'{group}.{name}', metric, old, new, change, regression))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark lib.validation and the simulation engine.')
+    parser.add_argument('--output', help='Where to save the results as JSON')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Overwrite {BASELINE} with the results')
+    parser.add_argument('--compare', nargs='?', const=BASELINE, help='Baseline JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative change counted as a regression')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Seconds spent on every function benchmark')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Workers used by the simulation benchmarks')
+    parser.add_argument('--check-imports', action='store_true',
+                        help='Only check cold import times against IMPORT_BUDGET; exits with 1 over budget')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='Multiplier of the import budget')
+    args = parser.parse_args(argv)
+
+    if args.check_imports:
+        rows = check_imports(scale=args.budget_scale)
+        for module, seconds, limit, over in rows:
+            print(f"{'OVER' if over else 'ok':<6} {module:<20} {seconds:8.3f}s  budget {limit:.3f}s")
+        return int(any(row[-1] for row in rows))
+
+    results = run(args.min_time, args.n_jobs)
+    for path in filter(None, [args.output, BASELINE if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is None:
+        print(json.dumps(results, indent=2))
+        return 0
+    with open(args.compare) as f:
+        rows = compare(results, json.load(f), args.threshold)
+    for name, metric, old, new, change, regression in rows:
+        print(f"{'REGRESSION' if regression else 'ok':<10} {name:<45} {metric:<22} {old:>14.4g} {new:>14.4g} "
+              f"{change:+8.1%}")
+    return int(any(row[-1] for row in rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
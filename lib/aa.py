@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, rankdata, kstest
+from lib.executor import SimulationExecutor
+from lib.simulation import MAX_CHUNK_ELEMENTS, proportion_ci
+from lib.rng import make_rng, spawn, uniform_into
+from lib.validation import ttest_batch, ztest_batch
+from lib.profiling import profiled
+
+
+CRITERIA = ['ttest', 'ztest', 'mannwhitney']
+
+
+def aa_prepare(values):
+    """
+    Builds the matrix of per-row quantities every A/A split is summed over.
+
+    Ranks are taken over the whole sample once: whatever the split, the rank of a value in the pooled sample
+    does not change, so the Mann-Whitney rank sum of a group is a plain sum like the t-test moments.
+
+    :param values: Historical per-user metric values.
+    :return: Array of shape (4, n) with the values, their squares, the positive-value indicator and the ranks.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    return np.vstack([values, values**2, (values > 0).astype(float), rankdata(values)])
+
+
+def aa_split_sums(prepared, simulations, random_state=None, chunk_size=None):
+    """
+    Assigns every row to group A or B at random for many simulations and sums the prepared rows per group A.
+
+    Rows are processed in chunks, so the (simulations x rows) assignment matrix never exceeds MAX_CHUNK_ELEMENTS.
+
+    :param prepared: Matrix returned by aa_prepare.
+    :param simulations: Number of splits.
+    :param random_state: Seed or numpy Generator used to draw the splits.
+    :param chunk_size: Number of rows processed at once. By default it is derived from MAX_CHUNK_ELEMENTS.
+    :return: Array of shape (simulations, 5): size, sum, sum of squares, positives and rank sum of group A.
+    """
+    rng = make_rng(random_state)
+    n = prepared.shape[1]
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // max(simulations, 1))
+
+    sums = np.zeros((simulations, 5))
+    uniforms = np.empty((simulations, min(chunk_size, n)))
+    for start in range(0, n, chunk_size):
+        block = np.asarray(prepared[:, start:start + chunk_size], dtype=float)
+        # a column slice of the buffer is not contiguous, so the last short chunk gets its own draw
+        if block.shape[1] == uniforms.shape[1]:
+            draws = uniform_into(rng, uniforms)
+        else:
+            draws = rng.random((simulations, block.shape[1]))
+        in_a = (draws < 0.5).astype(float)
+        sums[:, 0] += in_a.sum(axis=1)
+        sums[:, 1:] += in_a @ block.T
+    return sums
+
+
+def aa_pvalues_from_sums(sums, totals, tie_term):
+    """
+    Runs the t-test, z-test and Mann-Whitney test on every split described by its group A sums.
+
+    :param sums: Array returned by aa_split_sums.
+    :param totals: Sums of the whole sample in the same layout.
+    :param tie_term: Sum of t^3 - t over the groups of tied values of the whole sample.
+    :return: A DataFrame with one column of p-values per criterion.
+    """
+    n = totals[0]
+    n_a, sum_a, sq_a, pos_a, ranks_a = sums.T
+    n_b, sum_b, sq_b, pos_b = (totals[:4] - sums[:, :4]).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_a, mean_b = sum_a / n_a, sum_b / n_b
+        std_a = np.sqrt(np.maximum(sq_a - n_a * mean_a**2, 0) / (n_a - 1))
+        std_b = np.sqrt(np.maximum(sq_b - n_b * mean_b**2, 0) / (n_b - 1))
+
+        u1 = ranks_a - n_a * (n_a + 1) / 2
+        u = np.maximum(u1, n_a * n_b - u1)
+        s = np.sqrt(n_a * n_b / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        mw = np.clip(2 * norm.sf((u - n_a * n_b / 2 - 0.5) / s), 0, 1)
+
+    return pd.DataFrame({
+        'ttest': ttest_batch(mean_a, mean_b, std_a, std_b, n_a, n_b)['p_value'],
+        'ztest': ztest_batch(n_b, n_a, pos_b, pos_a)['p_value'],
+        'mannwhitney': mw,
+    })
+
+
+def _aa_batch(data, simulations, random_state, totals, tie_term):
+    sums = aa_split_sums(data, simulations, random_state)
+    return aa_pvalues_from_sums(sums, totals, tie_term)
+
+
+@profiled
+def simulate_aa(values, simulations=10000, batch_size=500, n_jobs=-1, random_state=None, executor=None):
+    """
+    Simulates A/A tests on historical data: the sample is split into two fake groups many times
+    and every criterion is run on every split.
+
+    Simulations are cut into batches with independent random streams and run in parallel.
+
+    :param values: Historical per-user metric values; the z-test uses the share of positive values.
+    :param simulations: Number of splits.
+    :param batch_size: Number of splits per parallel task.
+    :param n_jobs: Number of workers of the temporary executor used when executor is None.
+    :param random_state: Seed of the simulation.
+    :param executor: Optional lib.executor.SimulationExecutor to run the batches on a persistent worker pool.
+    :return: A DataFrame with one column of p-values per criterion and one row per split.
+    """
+    prepared = aa_prepare(values)
+    _, tie_counts = np.unique(prepared[0], return_counts=True)
+    tie_term = float((tie_counts.astype(float)**3 - tie_counts).sum())
+    totals = np.r_[prepared.shape[1], prepared.sum(axis=1)]
+
+    sizes = [min(batch_size, simulations - start) for start in range(0, simulations, batch_size)]
+    seeds = spawn(random_state, len(sizes))
+    tasks = [dict(simulations=size, random_state=seed, totals=totals, tie_term=tie_term)
+             for size, seed in zip(sizes, seeds)]
+
+    own_executor = executor is None
+    if own_executor:
+        executor = SimulationExecutor(n_jobs=n_jobs)
+    try:
+        batches = executor.map_cells(_aa_batch, tasks, prepared, sizes)
+    finally:
+        if own_executor:
+            executor.close()
+    if not batches:
+        return pd.DataFrame(columns=CRITERIA, dtype=float)
+    return pd.concat(batches, ignore_index=True)
+
+
+def aa_summary(pvalues, alpha=0.05, confidence=0.95):
+    """
+    Empirical false positive rate of every criterion with its confidence interval,
+    and the Kolmogorov-Smirnov p-value of the hypothesis that the p-values are uniform.
+
+    :param pvalues: DataFrame returned by simulate_aa.
+    :param alpha: Significance level.
+    :param confidence: Confidence level of the interval around the false positive rate.
+    :return: A DataFrame indexed by criterion with the columns fpr, simulations, ci_left, ci_right and ks_p_value.
+    """
+    rows = []
+    for criterion in pvalues.columns:
+        p = pvalues[criterion].dropna().to_numpy()
+        positives = (p < alpha).sum()
+        ci_left, ci_right = proportion_ci(positives, len(p), confidence)
+        rows.append({'criterion': criterion, 'fpr': positives / len(p) if len(p) else np.nan,
+                     'simulations': len(p), 'ci_left': float(ci_left), 'ci_right': float(ci_right),
+                     'ks_p_value': kstest(p, 'uniform').pvalue if len(p) else np.nan})
+    return pd.DataFrame(rows).set_index('criterion')
+
+
+def pvalue_histogram(pvalues, bins=20):
+    """
+    Distribution of the p-values of every criterion; under a correct criterion every bin holds about the same share.
+
+    :param pvalues: DataFrame returned by simulate_aa.
+    :param bins: Number of equal-width bins on [0, 1].
+    :return: A DataFrame with the columns bin_left, bin_right and the share of p-values per criterion.
+    """
+    edges = np.linspace(0, 1, bins + 1)
+    res = pd.DataFrame({'bin_left': edges[:-1], 'bin_right': edges[1:]})
+    for criterion in pvalues.columns:
+        p = pvalues[criterion].dropna().to_numpy()
+        res[criterion] = np.histogram(p, bins=edges)[0] / max(len(p), 1)
+    return res
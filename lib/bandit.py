@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+from lib.executor import SimulationExecutor
+from lib.simulation import MAX_CHUNK_ELEMENTS
+from lib.rng import make_rng, seed_sequence
+from lib.profiling import profiled
+
+
+POLICIES = ['thompson', 'epsilon-greedy', 'fixed']
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# trajectories per parallel task; a fixed split keeps the random streams independent of the number of workers
+TRAJECTORIES_PER_TASK = 100
+
+
+def prob_best(alpha, beta, draws, rng):
+    """
+    Monte Carlo probability that every arm has the highest success rate, for many trajectories at once.
+
+    :param alpha: Array of shape (trajectories, k) with the alpha parameters of the Beta posteriors.
+    :param beta: Array of shape (trajectories, k) with the beta parameters.
+    :param draws: Number of posterior draws per trajectory.
+    :param rng: numpy Generator.
+    :return: Array of shape (trajectories, k).
+    """
+    k = alpha.shape[1]
+    samples = rng.beta(alpha[:, None, :], beta[:, None, :], size=(alpha.shape[0], draws, k))
+    winners = samples.argmax(axis=2)
+    return (winners[:, :, None] == np.arange(k)).mean(axis=1)
+
+
+def allocate(policy, alpha, beta, batch_size, rng, epsilon=0.1, weights=None):
+    """
+    Splits the next batch of users between the arms of every trajectory.
+
+    'thompson' assigns every user to the arm with the highest draw from the posteriors, 'epsilon-greedy'
+    sends a share epsilon of the users to random arms and the rest to the arm with the highest posterior mean,
+    and 'fixed' splits the users in the proportions weights.
+
+    :param policy: One of POLICIES.
+    :param alpha: Array of shape (trajectories, k) with the alpha parameters of the Beta posteriors.
+    :param beta: Array of shape (trajectories, k) with the beta parameters.
+    :param batch_size: Number of users per round.
+    :param rng: numpy Generator.
+    :param epsilon: Exploration share of 'epsilon-greedy'.
+    :param weights: Allocation proportions of 'fixed'. Equal by default.
+    :return: Integer array of shape (trajectories, k) with the users per arm.
+    """
+    trajectories, k = alpha.shape
+    if policy == 'thompson':
+        samples = rng.beta(alpha[:, None, :], beta[:, None, :], size=(trajectories, batch_size, k))
+        winners = samples.argmax(axis=2)
+        return (winners[:, :, None] == np.arange(k)).sum(axis=1)
+    elif policy == 'epsilon-greedy':
+        explore = rng.binomial(batch_size, epsilon, size=trajectories)
+        counts = rng.multinomial(explore, np.full(k, 1 / k))
+        greedy = (alpha / (alpha + beta)).argmax(axis=1)
+        counts[np.arange(trajectories), greedy] += batch_size - explore
+        return counts
+    elif policy == 'fixed':
+        weights = np.full(k, 1 / k) if weights is None else np.asarray(weights, dtype=float) / np.sum(weights)
+        return rng.multinomial(batch_size, weights, size=trajectories)
+    raise ValueError(f'policy must be one of {POLICIES}')
+
+
+def simulate_bandit(rates, policy='thompson', trajectories=1000, rounds=50, batch_size=100, epsilon=0.1,
+                    weights=None, threshold=0.95, prob_draws=256, random_state=None):
+    """
+    Simulates Beta-Bernoulli bandit trajectories as array operations over batched rounds.
+
+    All trajectories start from uniform Beta(1, 1) priors, as in lib.validation.bayes. After every round
+    the posteriors are updated and the probability that each arm is the best is estimated.
+
+    :param rates: True success rates of the k arms.
+    :param policy: One of POLICIES.
+    :param trajectories: Number of simulated experiments.
+    :param rounds: Number of rounds per experiment.
+    :param batch_size: Number of users per round.
+    :param epsilon: Exploration share of 'epsilon-greedy'.
+    :param weights: Allocation proportions of 'fixed'. Equal by default.
+    :param threshold: An experiment is decided in the first round where some arm is the best with at least
+    this probability.
+    :param prob_draws: Number of posterior draws used to estimate the probabilities of being the best.
+    :param random_state: Seed, SeedSequence or numpy Generator.
+    :return: A dictionary with the arrays regret (expected cumulative regret, shape (trajectories, rounds)),
+    prob_best (probability of the truly best arm, shape (trajectories, rounds)), decision_round
+    (first decided round counting from 1, NaN if none) and decided_arm (-1 if none).
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'policy must be one of {POLICIES}')
+    if not 0 <= epsilon <= 1:
+        raise ValueError('epsilon must be between 0 and 1')
+    rng = make_rng(random_state)
+    rates = np.asarray(rates, dtype=float)
+    k, best = len(rates), int(np.argmax(rates))
+    gaps = rates.max() - rates
+
+    # the posterior draws dominate memory, so the trajectories are processed in blocks
+    block = max(1, MAX_CHUNK_ELEMENTS // (max(batch_size, prob_draws) * k))
+    regret = np.empty((trajectories, rounds))
+    best_prob = np.empty((trajectories, rounds))
+    decision_round = np.full(trajectories, np.nan)
+    decided_arm = np.full(trajectories, -1)
+
+    for start in range(0, trajectories, block):
+        stop = min(start + block, trajectories)
+        alpha = np.ones((stop - start, k))
+        beta = np.ones((stop - start, k))
+        total_regret = np.zeros(stop - start)
+        for r in range(rounds):
+            counts = allocate(policy, alpha, beta, batch_size, rng, epsilon, weights)
+            successes = rng.binomial(counts, rates)
+            alpha += successes
+            beta += counts - successes
+            total_regret += counts @ gaps
+            regret[start:stop, r] = total_regret
+
+            probs = prob_best(alpha, beta, prob_draws, rng)
+            best_prob[start:stop, r] = probs[:, best]
+            new = np.isnan(decision_round[start:stop]) & (probs.max(axis=1) >= threshold)
+            decision_round[start:stop][new] = r + 1
+            decided_arm[start:stop][new] = probs[new].argmax(axis=1)
+
+    return {'regret': regret, 'prob_best': best_prob, 'decision_round': decision_round,
+            'decided_arm': decided_arm}
+
+
+def _bandit_batch(data, **kwargs):
+    return simulate_bandit(data, **kwargs)
+
+
+@profiled
+def simulate_bandits(rates, policies=tuple(POLICIES), trajectories=1000, rounds=50, batch_size=100, epsilon=0.1,
+                     weights=None, threshold=0.95, prob_draws=256, n_jobs=-1, random_state=1, executor=None):
+    """
+    Runs simulate_bandit for several policies with the trajectories split between parallel workers.
+
+    The trajectories are split into tasks of TRAJECTORIES_PER_TASK, and every policy and every task gets
+    its own random stream, so the results do not depend on the number of workers.
+
+    :param rates: True success rates of the k arms.
+    :param policies: Policies to compare.
+    :param trajectories: Number of simulated experiments per policy.
+    :param n_jobs: Number of workers of the temporary executor used when executor is None.
+    :param random_state: Integer seed.
+    :param executor: Optional lib.executor.SimulationExecutor to run the simulations on a persistent worker pool.
+    :return: A dictionary {policy: result of simulate_bandit}.
+
+    The other arguments are those of simulate_bandit.
+    """
+    rates = np.asarray(rates, dtype=float)
+    if rates.ndim != 1 or len(rates) < 2:
+        raise ValueError('rates must contain at least two arms')
+    if np.any((rates < 0) | (rates > 1)):
+        raise ValueError('rates must be between 0 and 1')
+
+    own_executor = executor is None
+    if own_executor:
+        executor = SimulationExecutor(n_jobs=n_jobs)
+    try:
+        sizes = [min(TRAJECTORIES_PER_TASK, trajectories - start)
+                 for start in range(0, trajectories, TRAJECTORIES_PER_TASK)]
+        tasks, owners = [], []
+        for policy in policies:
+            for i, size in enumerate(sizes):
+                tasks.append(dict(policy=policy, trajectories=size, rounds=rounds, batch_size=batch_size,
+                                  epsilon=epsilon, weights=weights, threshold=threshold, prob_draws=prob_draws,
+                                  random_state=seed_sequence(random_state, policy, i)))
+                owners.append(policy)
+        parts = executor.map_cells(_bandit_batch, tasks, rates, [task['trajectories'] for task in tasks])
+    finally:
+        if own_executor:
+            executor.close()
+
+    res = {}
+    for policy in policies:
+        mine = [part for owner, part in zip(owners, parts) if owner == policy]
+        res[policy] = {key: np.concatenate([part[key] for part in mine]) for key in mine[0]}
+    return res
+
+
+def bandit_frames(results, rates, batch_size):
+    """
+    Summarizes simulate_bandits results.
+
+    :param results: Result of simulate_bandits.
+    :param rates: True success rates of the arms.
+    :param batch_size: Number of users per round.
+    :return: Two DataFrames. The first has one row per policy and round with the number of users, the mean
+    cumulative regret, the share of decided experiments and quantiles of the probability of the best arm
+    across experiments. The second has one row per policy with the share of decided experiments, the share of
+    decisions for the best arm and the mean and median number of users until the decision.
+    """
+    best = int(np.argmax(rates))
+    over_time, decisions = [], []
+    for policy, res in results.items():
+        rounds = res['regret'].shape[1]
+        decision_round = res['decision_round']
+        decided = ~np.isnan(decision_round)
+        frame = pd.DataFrame({
+            'policy': policy,
+            'round': np.arange(1, rounds + 1),
+            'users': np.arange(1, rounds + 1) * batch_size,
+            'regret': res['regret'].mean(axis=0),
+            'decided': (decision_round[:, None] <= np.arange(1, rounds + 1)).mean(axis=0),
+        })
+        for q, values in zip(QUANTILES, np.quantile(res['prob_best'], QUANTILES, axis=0)):
+            frame[f'prob_best_q{round(q * 100)}'] = values
+        over_time.append(frame)
+        users = decision_round[decided] * batch_size
+        decisions.append({
+            'policy': policy,
+            'decided': decided.mean(),
+            'correct': (res['decided_arm'][decided] == best).mean() if decided.any() else np.nan,
+            'mean_users_to_decision': users.mean() if decided.any() else np.nan,
+            'median_users_to_decision': np.median(users) if decided.any() else np.nan,
+            'final_regret': res['regret'][:, -1].mean(),
+        })
+    return pd.concat(over_time, ignore_index=True), pd.DataFrame(decisions).set_index('policy')
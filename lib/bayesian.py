@@ -0,0 +1,231 @@
+import warnings
+import numpy as np
+from scipy.special import betainc, betaincinv, betaln, ndtri, roots_legendre
+from lib.memo import memoize
+
+
+# number of Gauss-Legendre nodes per panel and the tail mass cut from the integration window
+QUADRATURE_NODES = 10
+TAIL_EPS = 1e-13
+# the window is split into panels at these quantiles, so skewed posteriors such as Beta(1, 10000)
+# get nodes where their mass is and not only spread evenly up to the far tail
+PANEL_QUANTILES = np.array([TAIL_EPS, 1e-10, 1e-7, 1e-5, 1e-3, 0.01, 0.05, 0.15, 0.3, 0.5, 0.7, 0.85, 0.95,
+                            0.99, 1 - 1e-3, 1 - 1e-5, 1 - 1e-7, 1 - 1e-10, 1 - TAIL_EPS])
+# panel edges are refined until the log of their tail probability is this close to the target
+QUANTILE_TOLERANCE = 1e-10
+QUANTILE_MAX_ITERATIONS = 100
+# credible interval bounds are refined until their CDF is this close to the target tail
+CI_TOLERANCE = 1e-8
+CI_MAX_ITERATIONS = 60
+
+_nodes, _weights = roots_legendre(QUADRATURE_NODES)
+
+
+def _beta_pdf(x, a, b):
+    """
+    Beta density without the argument checks of scipy.stats.beta; zero outside (0, 1).
+    """
+    inside = (x > 0) & (x < 1)
+    x = np.where(inside, x, 0.5)
+    return np.where(inside, np.exp((a - 1) * np.log(x) + (b - 1) * np.log1p(-x) - betaln(a, b)), 0)
+
+
+@memoize(maxsize=32)
+def beta_curve(a, b, points=1000):
+    """
+    Beta density on an even grid over [0, 1] for plotting.
+
+    :param a: Alpha parameter.
+    :param b: Beta parameter.
+    :param points: Number of grid points.
+    :return: Arrays of the grid and the density.
+    """
+    x = np.linspace(0, 1, points)
+    return x, _beta_pdf(x, a, b)
+
+
+def _beta_sf(x, a, b):
+    """
+    Survival function of Beta(a, b) through the symmetry I_x(a, b) = 1 - I_{1-x}(b, a);
+    scipy.special.betaincc is only available from scipy 1.12.
+    """
+    return betainc(b, a, 1 - x)
+
+
+def _tail_quantile(a, b, p):
+    """
+    Lower-tail quantile x with I_x(a, b) = p for p <= 0.5, accurate in relative terms far in the tail.
+
+    scipy.special.betaincinv only gives the starting point: for large a and tiny p it can be off by orders of
+    magnitude. The guess is refined with Newton steps on log I_x against log x, falling back to bisection
+    when a step leaves the bracket of the root.
+    """
+    a, b, p = np.broadcast_arrays(a, b, p)
+    t = np.log(np.clip(betaincinv(a, b, p), 1e-300, 1))
+    lower, upper = np.full(t.shape, np.log(1e-300)), np.zeros(t.shape)
+    for _ in range(QUANTILE_MAX_ITERATIONS):
+        x = np.exp(t)
+        cdf = betainc(a, b, x)
+        with np.errstate(divide='ignore'):
+            error = np.log(cdf) - np.log(p)
+        lower = np.where(error < 0, t, lower)
+        upper = np.where(error > 0, t, upper)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proposal = t - error * cdf / (x * _beta_pdf(x, a, b))
+        outside = ~np.isfinite(proposal) | (proposal <= lower) | (proposal >= upper)
+        proposal = np.where(np.abs(error) < QUANTILE_TOLERANCE, t, np.where(outside, (lower + upper) / 2, proposal))
+        # a root that betainc cannot resolve any finer stops moving
+        if np.all(proposal == t):
+            break
+        t = proposal
+    return np.exp(t)
+
+
+def _panel_edges(a, b):
+    """
+    Quantiles of Beta(a, b) at PANEL_QUANTILES, row-wise.
+
+    Upper quantiles are taken from the lower tail of Beta(b, a), so both tails are resolved in relative terms.
+
+    :return: Array of shape (rows, len(PANEL_QUANTILES)).
+    """
+    lower = PANEL_QUANTILES <= 0.5
+    a, b = a[:, None], b[:, None]
+    return np.hstack([_tail_quantile(a, b, PANEL_QUANTILES[lower]),
+                      1 - _tail_quantile(b, a, 1 - PANEL_QUANTILES[~lower])])
+
+
+def _integrate(a, b, func, edges=None, breaks=None):
+    """
+    Calculates E[func(X)] for X ~ Beta(a, b) row-wise with composite Gauss-Legendre quadrature over the bulk of X.
+
+    :param a: Array of alpha parameters.
+    :param b: Array of beta parameters.
+    :param func: Function of the node matrix of shape (rows, nodes).
+    :param edges: Panel edges from _panel_edges, passed to avoid recomputing them in iterations.
+    :param breaks: Optional array with one more panel edge per row, where func has a kink or a jump.
+    :return: Array with one expectation per row.
+    """
+    edges = _panel_edges(a, b) if edges is None else edges
+    if breaks is not None:
+        breaks = np.clip(breaks[:, None], edges[:, :1], edges[:, -1:])
+        edges = np.sort(np.hstack([edges, breaks]), axis=1)
+    lo, hi = edges[:, :-1, None], edges[:, 1:, None]
+    x = ((hi - lo) / 2 * _nodes + (hi + lo) / 2).reshape(len(edges), -1)
+    w = ((hi - lo) / 2 * _weights).reshape(len(edges), -1)
+    return (w * _beta_pdf(x, a[:, None], b[:, None]) * func(x)).sum(axis=1)
+
+
+def _narrow_first(alpha_a, beta_a, alpha_b, beta_b):
+    """
+    Reorders every pair of Beta distributions so that the narrower one is integrated over
+    and the wider one only enters through its smooth CDF.
+
+    :return: Parameters of the narrow and the wide distribution and a mask of rows where A is the narrow one.
+    """
+    alpha_a, beta_a, alpha_b, beta_b = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(v, dtype=float)) for v in (alpha_a, beta_a, alpha_b, beta_b)))
+    var_a = alpha_a * beta_a / ((alpha_a + beta_a)**2 * (alpha_a + beta_a + 1))
+    var_b = alpha_b * beta_b / ((alpha_b + beta_b)**2 * (alpha_b + beta_b + 1))
+    a_is_narrow = var_a <= var_b
+    alpha_n = np.where(a_is_narrow, alpha_a, alpha_b)
+    beta_n = np.where(a_is_narrow, beta_a, beta_b)
+    alpha_w = np.where(a_is_narrow, alpha_b, alpha_a)
+    beta_w = np.where(a_is_narrow, beta_b, beta_a)
+    return alpha_n, beta_n, alpha_w, beta_w, a_is_narrow
+
+
+def prob_greater(alpha_a, beta_a, alpha_b, beta_b):
+    """
+    Exact P(B > A) for independent A ~ Beta(alpha_a, beta_a) and B ~ Beta(alpha_b, beta_b).
+
+    :return: Array of probabilities, one per row of the broadcast parameters.
+    """
+    alpha_n, beta_n, alpha_w, beta_w, a_is_narrow = _narrow_first(alpha_a, beta_a, alpha_b, beta_b)
+    wide_higher = _integrate(alpha_n, beta_n, lambda x: _beta_sf(x, alpha_w[:, None], beta_w[:, None]))
+    return np.clip(np.where(a_is_narrow, wide_higher, 1 - wide_higher), 0, 1)
+
+
+def expected_loss(alpha_a, beta_a, alpha_b, beta_b):
+    """
+    Exact expected losses E[max(B - A, 0)] of choosing A and E[max(A - B, 0)] of choosing B.
+
+    Uses E[W * 1{W > x}] = E[W] * P(W' > x) with W' ~ Beta(alpha + 1, beta), and
+    E[max(N - W, 0)] = E[max(W - N, 0)] + E[N] - E[W], so one integral covers both losses.
+
+    :return: A tuple of arrays (loss of choosing A, loss of choosing B).
+    """
+    alpha_n, beta_n, alpha_w, beta_w, a_is_narrow = _narrow_first(alpha_a, beta_a, alpha_b, beta_b)
+    mean_n = alpha_n / (alpha_n + beta_n)
+    mean_w = alpha_w / (alpha_w + beta_w)
+    a_w, b_w = alpha_w[:, None], beta_w[:, None]
+
+    wide_excess = _integrate(alpha_n, beta_n,
+                             lambda x: mean_w[:, None] * _beta_sf(x, a_w + 1, b_w) - x * _beta_sf(x, a_w, b_w))
+    wide_excess = np.maximum(wide_excess, 0)
+    narrow_excess = np.maximum(wide_excess + mean_n - mean_w, 0)
+
+    loss_a = np.where(a_is_narrow, wide_excess, narrow_excess)
+    loss_b = np.where(a_is_narrow, narrow_excess, wide_excess)
+    return loss_a, loss_b
+
+
+def uplift_credible_interval(alpha_a, beta_a, alpha_b, beta_b, credible_level=0.95):
+    """
+    Equal-tailed credible interval of the relative uplift B / A - 1.
+
+    Starts from the delta-method normal approximation of log(B / A) and refines both bounds
+    of every row with Newton steps, evaluating the CDF and density of the ratio by quadrature.
+    Steps leaving the bracket of the root fall back to bisection; a RuntimeWarning is issued when
+    some bound does not reach CI_TOLERANCE within CI_MAX_ITERATIONS.
+
+    :return: A tuple of arrays (left bound, right bound).
+    """
+    alpha_n, beta_n, alpha_w, beta_w, a_is_narrow = _narrow_first(alpha_a, beta_a, alpha_b, beta_b)
+    rows = len(alpha_n)
+    tail = (1 - credible_level) / 2
+    target = np.repeat([tail, 1 - tail], rows)
+    alpha_n, beta_n, alpha_w, beta_w = (np.tile(v, 2) for v in (alpha_n, beta_n, alpha_w, beta_w))
+    a_is_narrow = np.tile(a_is_narrow, 2)
+
+    # delta-method moments of log(W / N) are close enough for a starting point
+    mean_log = (np.log(alpha_w / (alpha_w + beta_w)) - np.log(alpha_n / (alpha_n + beta_n)))
+    var_log = beta_w / (alpha_w * (alpha_w + beta_w + 1)) + beta_n / (alpha_n * (alpha_n + beta_n + 1))
+    sign = np.where(a_is_narrow, 1, -1)
+    log_ratio = sign * mean_log + np.sqrt(var_log) * ndtri(target)
+
+    edges = _panel_edges(alpha_n, beta_n)
+    lower, upper = np.full(2 * rows, -np.inf), np.full(2 * rows, np.inf)
+    # only the bounds that have not converged yet are evaluated again
+    active = np.arange(2 * rows)
+    for _ in range(CI_MAX_ITERATIONS):
+        # P(B / A <= r) = P(W <= r * N) when A is narrow and 1 - P(W <= N / r) otherwise;
+        # both integrands have a kink at N = 1 / scale, where scale * N reaches 1
+        current = log_ratio[active]
+        scale = np.exp(sign[active] * current)
+        c, a_w, b_w = scale[:, None], alpha_w[active, None], beta_w[active, None]
+        a_n, b_n, e = alpha_n[active], beta_n[active], edges[active]
+        wide_below = _integrate(a_n, b_n, lambda x: betainc(a_w, b_w, np.minimum(c * x, 1)), e, 1 / scale)
+        wide_density = _integrate(a_n, b_n, lambda x: c * x * _beta_pdf(c * x, a_w, b_w), e, 1 / scale)
+        error = np.where(a_is_narrow[active], wide_below, 1 - wide_below) - target[active]
+
+        converged = np.abs(error) < CI_TOLERANCE
+        # the CDF increases with log_ratio, so every evaluation narrows the bracket of the root
+        low = np.where(error < 0, np.maximum(lower[active], current), lower[active])
+        high = np.where(error > 0, np.minimum(upper[active], current), upper[active])
+        proposal = current - np.clip(error / np.maximum(wide_density, 1e-300), -1, 1)
+        outside = ((proposal <= low) | (proposal >= high)) & np.isfinite(low) & np.isfinite(high)
+        proposal = np.where(outside, (low + high) / 2, proposal)
+
+        lower[active], upper[active] = low, high
+        log_ratio[active] = np.where(converged, current, proposal)
+        active = active[~converged]
+        if not len(active):
+            break
+    else:
+        warnings.warn(f'{len(active)} uplift credible interval bounds did not converge to {CI_TOLERANCE} '
+                      f'in {CI_MAX_ITERATIONS} iterations', RuntimeWarning)
+
+    bounds = np.exp(log_ratio) - 1
+    return bounds[:rows], bounds[rows:]
+
@@ -0,0 +1,186 @@
+import numpy as np
+from lib.executor import SimulationExecutor
+from lib.simulation import MAX_CHUNK_ELEMENTS
+from lib.rng import make_rng, spawn
+from lib.profiling import profiled
+
+
+STATISTICS = ['mean', 'ratio', 'quantile']
+
+
+def poisson_bootstrap_sums(columns, replicates, random_state=None, chunk_size=None):
+    """
+    Poisson bootstrap of sums: every row gets an independent Poisson(1) weight in every replicate.
+
+    Since the weights of different rows are independent, the sums of separate chunks, files or processes
+    are merged by adding them, and resamples are never materialized.
+
+    :param columns: Array of shape (k, n) with the summed columns, e.g. the values or a numerator and a denominator.
+    :param replicates: Number of bootstrap replicates.
+    :param random_state: Seed or numpy Generator used to draw the weights.
+    :param chunk_size: Number of rows processed at once. By default it is derived from MAX_CHUNK_ELEMENTS.
+    :return: Array of shape (replicates, k + 1): the sum of the weights followed by the weighted sum of every column.
+    """
+    rng = make_rng(random_state)
+    columns = np.atleast_2d(columns)
+    n = columns.shape[1]
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // max(replicates, 1))
+
+    sums = np.zeros((replicates, columns.shape[0] + 1))
+    for start in range(0, n, chunk_size):
+        block = np.asarray(columns[:, start:start + chunk_size], dtype=float)
+        weights = rng.poisson(1.0, (replicates, block.shape[1])).astype(float)
+        sums[:, 0] += weights.sum(axis=1)
+        sums[:, 1:] += weights @ block.T
+    return sums
+
+
+def poisson_bootstrap_quantile(values, counts, q, replicates, random_state=None):
+    """
+    Poisson bootstrap of a quantile from the counts of sorted distinct values (or bin centers).
+
+    The total Poisson(1) weight of c equal rows is Poisson(c), so a replicate only needs one draw per distinct value.
+    Every replicate takes the smallest value whose weighted cumulative share reaches q, the definition of
+    np.quantile(..., method='inverted_cdf').
+
+    :param values: Sorted distinct values.
+    :param counts: Number of rows equal to every value.
+    :param q: Quantile level between 0 and 1.
+    :param replicates: Number of bootstrap replicates.
+    :param random_state: Seed or numpy Generator used to draw the weights.
+    :return: Array of the quantile in every replicate.
+    """
+    rng = make_rng(random_state)
+    values, counts = np.asarray(values, dtype=float), np.asarray(counts, dtype=float)
+    chunk_size = max(1, MAX_CHUNK_ELEMENTS // max(len(values), 1))
+
+    res = np.empty(replicates)
+    for start in range(0, replicates, chunk_size):
+        stop = min(start + chunk_size, replicates)
+        cumulative = np.cumsum(rng.poisson(counts, (stop - start, len(counts))), axis=1)
+        index = (cumulative < q * cumulative[:, -1:]).sum(axis=1)
+        res[start:stop] = values[np.minimum(index, len(values) - 1)]
+    return res
+
+
+def _bootstrap_batch(data, statistic, replicates, random_state, q=0.5):
+    if statistic == 'quantile':
+        return poisson_bootstrap_quantile(data[0], data[1], q, replicates, random_state)
+    sums = poisson_bootstrap_sums(data, replicates, random_state)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums[:, 1] / sums[:, 0] if statistic == 'mean' else sums[:, 1] / sums[:, 2]
+
+
+def _prepare(values, statistic, denominator=None):
+    """
+    Builds the array the replicates of a group are computed from, and the point estimate of the statistic.
+    """
+    values = np.asarray(values, dtype=float)
+    if statistic == 'mean':
+        return values, values.mean()
+    elif statistic == 'ratio':
+        if denominator is None:
+            raise ValueError("the 'ratio' statistic requires denominators")
+        return np.vstack([values, np.asarray(denominator, dtype=float)]), values.sum() / np.sum(denominator)
+    elif statistic == 'quantile':
+        distinct, counts = np.unique(values, return_counts=True)
+        return np.vstack([distinct, counts]), None
+    raise ValueError(f'statistic must be one of {STATISTICS}')
+
+
+def bootstrap_replicates(values, statistic='mean', denominator=None, q=0.5, replicates=2000, batch_size=500,
+                         random_state=None, executor=None):
+    """
+    Bootstrap replicates of a statistic of one group, split into batches with independent random streams.
+
+    :param values: Values of the group (the numerators for the 'ratio' statistic).
+    :param statistic: 'mean', 'ratio' (ratio of sums) or 'quantile'.
+    :param denominator: Denominators for the 'ratio' statistic.
+    :param q: Quantile level for the 'quantile' statistic.
+    :param replicates: Number of bootstrap replicates.
+    :param batch_size: Number of replicates per parallel task.
+    :param random_state: Seed or numpy SeedSequence of the group.
+    :param executor: lib.executor.SimulationExecutor running the batches.
+    :return: Array of the statistic in every replicate.
+    """
+    data, _ = _prepare(values, statistic, denominator)
+    sizes = [min(batch_size, replicates - start) for start in range(0, replicates, batch_size)]
+    tasks = [dict(statistic=statistic, replicates=size, random_state=child, q=q)
+             for size, child in zip(sizes, spawn(random_state, len(sizes)))]
+    return np.concatenate(executor.map_cells(_bootstrap_batch, tasks, data, sizes)) if tasks else np.empty(0)
+
+
+@profiled
+def bootstrap_test(control, test, statistic='mean', denominator_control=None, denominator_test=None, q=0.5,
+                   replicates=2000, alpha=0.05, alternative='two-sided', batch_size=500, n_jobs=-1,
+                   random_state=None, executor=None):
+    """
+    Compares a statistic of two groups with the Poisson bootstrap.
+
+    Confidence intervals are percentile intervals of the replicated absolute and relative differences;
+    the p-value is the share of replicates on the other side of zero.
+
+    :param control: Values of the control group (the numerators for the 'ratio' statistic).
+    :param test: Values of the test group (the numerators for the 'ratio' statistic).
+    :param statistic: 'mean', 'ratio' (ratio of sums) or 'quantile'.
+    :param denominator_control: Denominators of the control group for the 'ratio' statistic.
+    :param denominator_test: Denominators of the test group for the 'ratio' statistic.
+    :param q: Quantile level for the 'quantile' statistic.
+    :param replicates: Number of bootstrap replicates.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less',
+    with the same meaning as in ttest.
+    :param batch_size: Number of replicates per parallel task.
+    :param n_jobs: Number of workers of the temporary executor used when executor is None.
+    :param random_state: Seed of the bootstrap.
+    :param executor: Optional lib.executor.SimulationExecutor to run the batches on a persistent worker pool.
+    :return: A dictionary with the same keys as ttest.
+    """
+    if alternative not in ('two-sided', 'greater', 'less'):
+        raise ValueError("alternative must be 'less', 'greater' or 'two-sided'")
+    seed_control, seed_test = spawn(random_state, 2)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = SimulationExecutor(n_jobs=n_jobs)
+    try:
+        boot_control = bootstrap_replicates(control, statistic, denominator_control, q, replicates, batch_size,
+                                            seed_control, executor)
+        boot_test = bootstrap_replicates(test, statistic, denominator_test, q, replicates, batch_size,
+                                         seed_test, executor)
+    finally:
+        if own_executor:
+            executor.close()
+
+    if statistic == 'quantile':
+        # the same quantile definition as the replicates, so the interval is centred on the estimate
+        point_control = np.quantile(control, q, method='inverted_cdf')
+        point_test = np.quantile(test, q, method='inverted_cdf')
+    else:
+        point_control = _prepare(control, statistic, denominator_control)[1]
+        point_test = _prepare(test, statistic, denominator_test)[1]
+
+    difference = boot_test - boot_control
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = boot_test / boot_control - 1
+    below, above = (difference <= 0).mean(), (difference >= 0).mean()
+    if alternative == 'two-sided':
+        p_value = min(1.0, 2 * min(below, above))
+    elif alternative == 'greater':
+        p_value = above
+    else:
+        p_value = below
+
+    ci_left_abs, ci_right_abs = np.quantile(difference, [alpha / 2, 1 - alpha / 2])
+    ci_left_rel, ci_right_rel = np.nanquantile(relative, [alpha / 2, 1 - alpha / 2])
+    return {
+        'p_value': round(float(p_value), 4),
+        'significance_level': 1 - alpha,
+        'relative_effect': round(float(point_test / point_control - 1), 4),
+        'ci_left_rel': round(float(ci_left_rel), 4),
+        'ci_right_rel': round(float(ci_right_rel), 4),
+        'absolute_effect': round(float(point_test - point_control), 4),
+        'ci_left_abs': round(float(ci_left_abs), 4),
+        'ci_right_abs': round(float(ci_right_abs), 4),
+    }
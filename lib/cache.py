@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import weakref
+import numpy as np
+from contextlib import contextmanager
+
+
+DEFAULT_CACHE_DIR = os.environ.get('EXPERIMENT_TOOLS_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'experiment_tools'))
+DEFAULT_MAX_BYTES = 256 * 1024**2
+
+
+def params_key(**params):
+    """
+    Builds a stable key from simulation parameters; numpy arrays are replaced by a hash of their contents.
+
+    :param params: Parameters that define the simulated distribution and test, e.g. data, test, seed, simulations.
+    :return: Hex digest identifying the parameter set.
+    """
+    normalized = {}
+    for name, value in params.items():
+        if isinstance(value, np.ndarray):
+            value = hashlib.sha1(np.ascontiguousarray(value).view(np.uint8)).hexdigest()
+        elif isinstance(value, (float, np.floating)):
+            value = float(f'{value:.12g}')
+        elif isinstance(value, np.integer):
+            value = int(value)
+        normalized[name] = value
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+# digests of in-memory arrays by id(), dropped when the array is garbage collected
+_digests = {}
+
+
+def data_key(data):
+    """
+    Cheap identity of a source sample for params_key.
+
+    A whole .npy file opened as a memmap is identified by its path, modification time, dtype and shape,
+    so a large historical sample is neither read nor copied. Other arrays are hashed once and the digest
+    is reused while the array is alive; arrays are assumed not to be modified in place afterwards.
+
+    :param data: numpy array or memmap.
+    :return: String identifying the data.
+    """
+    from lib.executor import _is_npy_memmap
+
+    if _is_npy_memmap(data):
+        path = os.path.abspath(data.filename)
+        return f'memmap:{path}:{os.path.getmtime(path)}:{data.dtype.str}:{data.shape}'
+    if isinstance(data, np.ndarray):
+        entry = _digests.get(id(data))
+        if entry is not None and entry[0]() is data:
+            return entry[1]
+    array = np.ascontiguousarray(data)
+    digest = f'array:{array.dtype.str}:{array.shape}:{hashlib.sha1(array.view(np.uint8)).hexdigest()}'
+    if isinstance(data, np.ndarray):
+        key = id(data)
+        _digests[key] = (weakref.ref(data, lambda _, key=key: _digests.pop(key, None)), digest)
+    return digest
+
+
+def cell_key(lift, n):
+    """
+    Normalizes a (lift, n) cell so that float noise from np.arange does not create new keys.
+    """
+    return f'{float(lift):.10g}', int(n)
+
+
+class SimulationCache:
+    """
+    On-disk SQLite store of simulated p-values, one row per grid cell.
+
+    Cells are keyed by the parameter key from params_key and the normalized (lift, n) pair.
+    The total size of the stored p-values is kept under max_bytes by evicting the least recently used cells.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'simulations.sqlite')
+        self.max_bytes = max_bytes
+        with self._connect() as con:
+            con.execute('''CREATE TABLE IF NOT EXISTS cells (
+                               params TEXT NOT NULL,
+                               lift TEXT NOT NULL,
+                               n INTEGER NOT NULL,
+                               pvalues BLOB NOT NULL,
+                               size INTEGER NOT NULL,
+                               accessed REAL NOT NULL,
+                               PRIMARY KEY (params, lift, n))''')
+            con.execute('CREATE INDEX IF NOT EXISTS cells_accessed ON cells (accessed)')
+
+    @contextmanager
+    def _connect(self):
+        # a connection per operation keeps the cache usable from Streamlit's script threads
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def get_many(self, params, cells):
+        """
+        Loads the cached cells of a parameter set.
+
+        :param params: Parameter key.
+        :param cells: Iterable of (lift, n) pairs.
+        :return: A dictionary {(lift, n): p-values} with the cells found in the cache.
+        """
+        found = {}
+        now = time.time()
+        with self._connect() as con:
+            for lift, n in cells:
+                key = cell_key(lift, n)
+                row = con.execute('SELECT pvalues FROM cells WHERE params = ? AND lift = ? AND n = ?',
+                                  (params, *key)).fetchone()
+                if row is not None:
+                    found[(lift, n)] = np.frombuffer(row[0], dtype=np.float64).copy()
+                    con.execute('UPDATE cells SET accessed = ? WHERE params = ? AND lift = ? AND n = ?',
+                                (now, params, *key))
+        return found
+
+    def put_many(self, params, results):
+        """
+        Stores simulated cells and evicts old cells if the cache grows over max_bytes.
+
+        :param params: Parameter key.
+        :param results: A dictionary {(lift, n): p-values}.
+        """
+        now = time.time()
+        with self._connect() as con:
+            con.executemany('INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?)',
+                            [(params, *cell_key(lift, n), blob, len(blob), now)
+                             for (lift, n), blob in ((cell, np.asarray(p, dtype=np.float64).tobytes())
+                                                     for cell, p in results.items())])
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used cells until the stored p-values take at most max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._connect() as con:
+            total = con.execute('SELECT COALESCE(SUM(size), 0) FROM cells').fetchone()[0]
+            if total <= max_bytes:
+                return
+            rows = con.execute('SELECT rowid, size FROM cells ORDER BY accessed').fetchall()
+            stale = []
+            for rowid, size in rows:
+                if total <= max_bytes:
+                    break
+                stale.append((rowid,))
+                total -= size
+            con.executemany('DELETE FROM cells WHERE rowid = ?', stale)
+
+    def invalidate(self, params=None):
+        """
+        Drops the cells of one parameter set, or every cell when params is None.
+
+        :param params: Parameter key.
+        """
+        with self._connect() as con:
+            if params is None:
+                con.execute('DELETE FROM cells')
+            else:
+                con.execute('DELETE FROM cells WHERE params = ?', (params,))
+        with self._connect() as con:
+            con.execute('VACUUM')
+
+    def size(self):
+        """
+        :return: Total size of the stored p-values in bytes.
+        """
+        with self._connect() as con:
+            return con.execute('SELECT COALESCE(SUM(size), 0) FROM cells').fetchone()[0]
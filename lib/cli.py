@@ -0,0 +1,182 @@
+"""
+Headless batch runner for the design, validation and simulation calculations.
+
+Usage:
+    python -m lib.cli jobs.json --output results.jsonl --n-jobs -1
+
+The input is a JSON or YAML file with a list of jobs (or {"jobs": [...]}), or a CSV file with one job per row.
+Every job has a "job" field naming the calculation and the keyword arguments of that calculation;
+an optional "id" field is copied to the result. Streamlit is never imported on this path.
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def _sample_size(criteria='t-test', alpha=0.05, power=0.8, lift=1.1, ratio=1.0, alternative='two-sided',
+                 mean=None, std=None):
+    from lib.validation import sample_size_calc_ttest, sample_size_calc_ztest
+    if criteria == 't-test':
+        return sample_size_calc_ttest(alpha, power, lift, ratio, alternative, mean, std)
+    elif criteria == 'z-test':
+        return sample_size_calc_ztest(alpha, power, lift, ratio, alternative, mean)
+    raise ValueError("criteria must be 't-test' or 'z-test'")
+
+
+def _srm(control_fact, test_fact, ratio_plan=0.5):
+    from lib.validation import check_sample_ratio
+    return {'p_value': check_sample_ratio(control_fact, test_fact, ratio_plan)}
+
+
+def _ttest(mean_control, mean_test, std_control, std_test, size_control, size_test, alpha=0.05,
+           alternative='two-sided'):
+    from lib.validation import ttest_batch
+    return ttest_batch(mean_control, mean_test, std_control, std_test, size_control, size_test, alpha, alternative)
+
+
+def _ztest(z_size_test, z_size_control, success_test, success_control, alpha=0.05, alternative='two-sided'):
+    from lib.validation import ztest_batch
+    return ztest_batch(z_size_test, z_size_control, success_test, success_control, alpha, alternative)
+
+
+def _bayes(trials_control, successes_control, trials_test, successes_test, credible_level=0.95):
+    from lib.validation import bayes_batch
+    return bayes_batch(trials_control, successes_control, trials_test, successes_test, credible_level)
+
+
+def _mde(lifts, sizes, mean=None, std=None, data=None, alpha=0.05, simulations=1000, random_state=1,
+         tolerance=None):
+    from lib.simulation import simulate_grid, calculate_tpr
+    from lib.rng import make_rng
+    if data is not None:
+        data = np.load(data, mmap_mode='r') if isinstance(data, str) else np.asarray(data, dtype=float)
+    else:
+        data = make_rng(random_state).normal(mean, std, size=10000)
+    # jobs already run in parallel, so every grid is simulated in its own worker
+    sim_res = simulate_grid(lifts, sizes, data, simulations, n_jobs=1, random_state=random_state,
+                            tolerance=tolerance, alpha=alpha)
+    return calculate_tpr(sim_res, alpha).to_dict(orient='list')
+
+
+JOBS = {
+    'sample_size': _sample_size,
+    'srm': _srm,
+    'ttest': _ttest,
+    'ztest': _ztest,
+    'bayes': _bayes,
+    'mde': _mde,
+}
+
+
+def load_jobs(path):
+    """
+    Reads a job list from a JSON, YAML or CSV file.
+
+    :param path: Path to a .json, .yaml/.yml or .csv file.
+    :return: List of job dictionaries.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        frame = pd.read_csv(path)
+        return [{k: v for k, v in row.items() if not pd.isna(v)} for row in frame.to_dict(orient='records')]
+    with open(path) as f:
+        if extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError as e:
+                raise ImportError('Reading YAML configs requires PyYAML') from e
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    return config['jobs'] if isinstance(config, dict) else config
+
+
+def run_job(job):
+    """
+    Runs one job; an error is reported in the result instead of stopping the batch.
+
+    :param job: Dictionary with the "job" name, an optional "id" and the arguments of the calculation.
+    :return: A dictionary with the id, the job name and either the result or the error message.
+    """
+    params = dict(job)
+    name = params.pop('job', None)
+    res = {'id': params.pop('id', None), 'job': name}
+    if name not in JOBS:
+        res['error'] = f'job must be one of {list(JOBS)}'
+        return res
+    try:
+        res['result'] = _to_builtin(JOBS[name](**params))
+    except Exception as e:
+        res['error'] = f'{type(e).__name__}: {e}'
+    return res
+
+
+def run_jobs(jobs, n_jobs=-1):
+    """
+    Runs the jobs in parallel across cores.
+
+    :param jobs: List of job dictionaries.
+    :param n_jobs: Number of joblib workers.
+    :return: List of results in job order.
+    """
+    from joblib import Parallel, delayed
+
+    return Parallel(n_jobs=n_jobs)(delayed(run_job)(job) for job in jobs)
+
+
+def write_results(results, path=None):
+    """
+    Writes results as JSON lines, a JSON list (.json) or a flat table (.csv). Writes JSON lines to stdout by default.
+
+    :param results: List of results returned by run_jobs.
+    :param path: Output path or None.
+    """
+    extension = os.path.splitext(path)[1].lower() if path else '.jsonl'
+    if extension == '.csv':
+        pd.json_normalize(results).to_csv(path, index=False)
+        return
+    if extension == '.json':
+        text = json.dumps(results, indent=2)
+    else:
+        text = '\n'.join(json.dumps(res) for res in results) + '\n'
+    if path is None:
+        sys.stdout.write(text)
+    else:
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+def _to_builtin(value):
+    """
+    Converts numpy scalars and arrays inside a result to JSON-serializable Python values.
+    """
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _to_builtin(value.item() if value.ndim == 0 else value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run experiment design, validation and simulation jobs.')
+    parser.add_argument('config', help='JSON/YAML job list or CSV with one job per row')
+    parser.add_argument('-o', '--output', help='Output file (.jsonl, .json or .csv); stdout by default')
+    parser.add_argument('-j', '--n-jobs', type=int, default=-1, help='Number of parallel workers')
+    args = parser.parse_args(argv)
+
+    results = run_jobs(load_jobs(args.config), args.n_jobs)
+    write_results(results, args.output)
+    return int(any('error' in res for res in results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
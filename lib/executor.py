@@ -0,0 +1,174 @@
+import os
+import heapq
+import shutil
+import hashlib
+import weakref
+import tempfile
+import threading
+import numpy as np
+from lib.cache import data_key
+from lib.profiling import stage
+
+
+BACKENDS = ['loky', 'multiprocessing', 'threading', 'sequential']
+
+# memmaps opened by the current worker process, keyed by file path
+_opened = {}
+
+
+def _load(data):
+    """
+    Resolves a shared array reference inside a worker: paths are opened as read-only memmaps once per process.
+    """
+    if isinstance(data, str):
+        if data not in _opened:
+            _opened[data] = np.load(data, mmap_mode='r')
+        return _opened[data]
+    return data
+
+
+def _is_npy_memmap(data):
+    """
+    Whether data is a whole .npy file opened with np.load(mmap_mode=...), so workers can open the file itself.
+    """
+    filename = getattr(data, 'filename', None)
+    if not isinstance(data, np.memmap) or filename is None or not str(filename).endswith('.npy'):
+        return False
+    whole = np.load(filename, mmap_mode='r')
+    return whole.shape == data.shape and whole.dtype == data.dtype and whole.strides == data.strides
+
+
+def _run_chunk(func, chunk, data):
+    data = _load(data)
+    return [func(data=data, **task) for task in chunk]
+
+
+def balanced_chunks(costs, n_chunks):
+    """
+    Splits task indices into n_chunks groups of similar total cost (longest processing time first).
+
+    :param costs: Estimated cost of every task.
+    :param n_chunks: Number of groups.
+    :return: List of lists of task indices.
+    """
+    n_chunks = max(1, min(n_chunks, len(costs)))
+    heap = [(0.0, i) for i in range(n_chunks)]
+    chunks = [[] for _ in range(n_chunks)]
+    for index in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        load, chunk = heapq.heappop(heap)
+        chunks[chunk].append(index)
+        heapq.heappush(heap, (load + costs[index], chunk))
+    return [chunk for chunk in chunks if chunk]
+
+
+class SimulationExecutor:
+    """
+    Reusable parallel executor for simulation cells.
+
+    The source data is written once to a .npy file and opened as a read-only memmap by every worker,
+    instead of being pickled into each task. Cells are grouped into cost-balanced chunks, a few per worker,
+    and the worker pool stays alive between calls until close() is called. configure() swaps the pool
+    for other settings, so one long-lived executor can follow the settings of a page.
+    """
+
+    def __init__(self, n_jobs=-1, backend='loky', chunks_per_worker=4, temp_folder=None):
+        if backend not in BACKENDS:
+            raise ValueError(f'backend must be one of {BACKENDS}')
+        self.n_jobs = 1 if backend == 'sequential' else n_jobs
+        self.backend = backend
+        self.chunks_per_worker = chunks_per_worker
+        self.temp_folder = tempfile.mkdtemp(prefix='experiment_tools_', dir=temp_folder)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.temp_folder, True)
+        # one Parallel instance must not be used by two threads at once, e.g. two background jobs
+        self._lock = threading.Lock()
+        self._parallel = self._start()
+
+    def _start(self):
+        from joblib import Parallel
+
+        parallel = Parallel(n_jobs=self.n_jobs, backend=self.backend if self.backend != 'sequential' else None,
+                            max_nbytes=None)
+        # entering the context keeps the worker pool alive across map_cells calls
+        parallel.__enter__()
+        return parallel
+
+    def configure(self, n_jobs=-1, backend='loky'):
+        """
+        Switches to other settings. The worker pool is shut down and restarted only when they change,
+        after the call that is using it finishes; the shared files are kept.
+
+        :param n_jobs: Number of workers, -1 for all cores.
+        :param backend: One of BACKENDS.
+        :return: The executor itself.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f'backend must be one of {BACKENDS}')
+        n_jobs = 1 if backend == 'sequential' else n_jobs
+        with self._lock:
+            if (n_jobs, backend) != (self.n_jobs, self.backend):
+                self._parallel.__exit__(None, None, None)
+                self.n_jobs, self.backend = n_jobs, backend
+                self._parallel = self._start()
+        return self
+
+    def share(self, data):
+        """
+        Places an array in a memmapped file shared by the workers; the same content is written only once,
+        and an array that was shared before is not hashed again (see lib.cache.data_key).
+
+        :param data: numpy array.
+        :return: Reference to pass to the workers (the array itself for in-process backends).
+        """
+        if self.backend in ('threading', 'sequential'):
+            return data
+        if _is_npy_memmap(data):
+            # the workers open the original file, nothing is copied
+            return data.filename
+        digest = hashlib.sha1(data_key(data).encode()).hexdigest()
+        path = os.path.join(self.temp_folder, f'{digest}.npy')
+        if not os.path.exists(path):
+            np.save(path, np.ascontiguousarray(data))
+        return path
+
+    def map_cells(self, func, tasks, data, costs=None):
+        """
+        Calls func(data=data, **task) for every task and returns the results in task order.
+
+        :param func: Module-level function accepting a data keyword.
+        :param tasks: List of keyword dictionaries, one per cell.
+        :param data: Source array shared by all tasks.
+        :param costs: Estimated relative cost of every task used to balance the chunks. Equal by default.
+        :return: List of results.
+        """
+        if not tasks:
+            return []
+        from joblib import delayed
+
+        costs = [1.0] * len(tasks) if costs is None else list(costs)
+        n_chunks = self.n_workers() * self.chunks_per_worker
+        chunks = balanced_chunks(costs, n_chunks)
+        with stage('executor.share'):
+            shared = self.share(data)
+
+        with self._lock, stage('executor.dispatch'):
+            chunk_results = self._parallel(delayed(_run_chunk)(func, [tasks[i] for i in chunk], shared)
+                                           for chunk in chunks)
+        results = [None] * len(tasks)
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            for index, result in zip(chunk, chunk_result):
+                results[index] = result
+        return results
+
+    def n_workers(self):
+        """
+        :return: Actual number of workers, with n_jobs=-1 resolved to the number of cores.
+        """
+        from joblib import effective_n_jobs
+        return effective_n_jobs(self.n_jobs)
+
+    def close(self):
+        """
+        Shuts the worker pool down and removes the shared files.
+        """
+        self._parallel.__exit__(None, None, None)
+        self._finalizer()
@@ -0,0 +1,293 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from lib.validation import ttest_frame, ztest_frame, check_sample_ratio, histogram_counts
+from lib.profiling import profiled
+
+
+STATS_COLUMNS = ['count', 'mean', 'm2', 'successes']
+KEYS = ['experiment', 'variant', 'metric']
+
+
+def empty_stats():
+    """
+    Creates an empty accumulator table.
+
+    :return: A DataFrame indexed by (experiment, variant, metric) with the columns count, mean, m2 and successes.
+    """
+    index = pd.MultiIndex.from_arrays([[], [], []], names=KEYS)
+    return pd.DataFrame({'count': pd.Series(dtype=float), 'mean': pd.Series(dtype=float),
+                         'm2': pd.Series(dtype=float), 'successes': pd.Series(dtype=float)}, index=index)
+
+
+def chunk_stats(chunk, value_cols=None, experiment_col='experiment', variant_col='variant',
+                metric_col='metric', value_col='value'):
+    """
+    Calculates count, mean, sum of squared deviations (m2) and number of positive values for one chunk of rows.
+
+    The chunk is either in long format (one metric_col and one value_col) or, when value_cols is given,
+    in wide format with one column per metric.
+
+    :param chunk: DataFrame with per-user rows.
+    :param value_cols: Metric columns of a wide chunk. None for long format.
+    :param experiment_col: Column with the experiment id.
+    :param variant_col: Column with the variant name.
+    :param metric_col: Column with the metric name in long format.
+    :param value_col: Column with the metric value in long format.
+    :return: Accumulator table of the chunk.
+    """
+    if value_cols is not None:
+        chunk = chunk.melt(id_vars=[experiment_col, variant_col], value_vars=list(value_cols),
+                           var_name=metric_col, value_name=value_col)
+    chunk = chunk[[experiment_col, variant_col, metric_col, value_col]].dropna(subset=[value_col])
+    chunk = chunk.rename(columns={experiment_col: 'experiment', variant_col: 'variant',
+                                  metric_col: 'metric', value_col: 'value'})
+    chunk['successes'] = (chunk['value'] > 0).astype(float)
+
+    grouped = chunk.groupby(KEYS, sort=False)
+    stats = grouped['value'].agg(['count', 'mean', 'var'])
+    stats['m2'] = stats.pop('var').fillna(0) * (stats['count'] - 1)
+    stats['successes'] = grouped['successes'].sum()
+    return stats[STATS_COLUMNS].astype(float)
+
+
+def merge_stats(left, right):
+    """
+    Merges two accumulator tables with Chan's parallel update of the Welford statistics.
+
+    The operation is associative, so partial results of separate files or processes can be combined in any order.
+
+    :param left: Accumulator table.
+    :param right: Accumulator table.
+    :return: Combined accumulator table.
+    """
+    left, right = left.align(right, join='outer', fill_value=0)
+    count = left['count'] + right['count']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = right['mean'] - left['mean']
+        share = (right['count'] / count).fillna(0)
+    return pd.DataFrame({
+        'count': count,
+        'mean': left['mean'] + delta * share,
+        'm2': left['m2'] + right['m2'] + delta**2 * left['count'] * share,
+        'successes': left['successes'] + right['successes'],
+    })
+
+
+def iter_chunks(path, chunksize=1_000_000, columns=None):
+    """
+    Reads a CSV or Parquet file in chunks of rows.
+
+    :param path: Path to a .csv or .parquet file, or an open file object with such a name.
+    :param chunksize: Number of rows per chunk.
+    :param columns: Columns to read. None reads all columns.
+    :return: Iterator over DataFrames.
+    """
+    if str(getattr(path, 'name', path)).endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError('Reading Parquet files requires pyarrow') from e
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns)
+
+
+def load_sample(path, column=None, cache_dir=None, chunksize=1_000_000):
+    """
+    Opens a large one-dimensional sample as a read-only memory map, e.g. for the power simulation.
+
+    A .npy file is mapped directly. A Parquet column is converted once into a .npy file in cache_dir
+    (keyed by the file, its modification time and the column) and mapped from there; null values are dropped.
+
+    :param path: Path to a .npy or .parquet file.
+    :param column: Column of a Parquet file.
+    :param cache_dir: Directory for converted Parquet columns; lib.cache.DEFAULT_CACHE_DIR by default.
+    :param chunksize: Number of rows converted at once.
+    :return: numpy memmap.
+    """
+    if str(path).endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    if not str(path).endswith('.parquet'):
+        raise ValueError('sample must be a .npy or .parquet file')
+    if column is None:
+        raise ValueError('column is required for Parquet files')
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('Reading Parquet files requires pyarrow') from e
+    if cache_dir is None:
+        from lib.cache import DEFAULT_CACHE_DIR
+        cache_dir = DEFAULT_CACHE_DIR
+
+    os.makedirs(cache_dir, exist_ok=True)
+    source = os.path.abspath(path)
+    digest = hashlib.sha1(f'{source}:{os.path.getmtime(source)}:{column}'.encode()).hexdigest()
+    target = os.path.join(cache_dir, f'sample_{digest}.npy')
+    if not os.path.exists(target):
+        parquet = pq.ParquetFile(source)
+        values = np.empty(parquet.metadata.num_rows)
+        size = 0
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=[column]):
+            chunk = batch.column(0).to_numpy(zero_copy_only=False).astype(float)
+            chunk = chunk[~np.isnan(chunk)]
+            values[size:size + len(chunk)] = chunk
+            size += len(chunk)
+        # written under a temporary name, so a concurrent reader never sees a partial file
+        partial = f'{target}.{os.getpid()}.npy'
+        np.save(partial, values[:size])
+        os.replace(partial, target)
+    return np.load(target, mmap_mode='r')
+
+
+@profiled
+def read_stats(path, value_cols=None, experiment_col='experiment', variant_col='variant',
+               metric_col='metric', value_col='value', chunksize=1_000_000):
+    """
+    Streams a raw per-user export and accumulates its statistics in memory proportional to the number of groups.
+
+    :param path: Path to a .csv or .parquet file, or an open file object with such a name.
+    :param value_cols: Metric columns of a wide file. None for long format.
+    :param experiment_col: Column with the experiment id.
+    :param variant_col: Column with the variant name.
+    :param metric_col: Column with the metric name in long format.
+    :param value_col: Column with the metric value in long format.
+    :param chunksize: Number of rows per chunk.
+    :return: Accumulator table.
+    """
+    if value_cols is not None:
+        columns = [experiment_col, variant_col] + list(value_cols)
+    else:
+        columns = [experiment_col, variant_col, metric_col, value_col]
+
+    stats = empty_stats()
+    for chunk in iter_chunks(path, chunksize, columns):
+        stats = merge_stats(stats, chunk_stats(chunk, value_cols, experiment_col, variant_col,
+                                               metric_col, value_col))
+    return stats
+
+
+def read_stats_parallel(paths, n_jobs=-1, **kwargs):
+    """
+    Runs read_stats for several files in parallel and merges the partial accumulators.
+
+    :param paths: Paths to .csv or .parquet files.
+    :param n_jobs: Number of joblib workers.
+    :param kwargs: Arguments passed to read_stats.
+    :return: Accumulator table.
+    """
+    from joblib import Parallel, delayed
+
+    partial = Parallel(n_jobs=n_jobs)(delayed(read_stats)(path, **kwargs) for path in paths)
+    stats = empty_stats()
+    for part in partial:
+        stats = merge_stats(stats, part)
+    return stats
+
+
+def value_range(path, value_col='value', chunksize=1_000_000):
+    """
+    Finds the smallest and the largest value of a column in one streaming pass.
+
+    :param path: Path to a .csv or .parquet file, or an open file object with such a name.
+    :param value_col: Column with the values.
+    :param chunksize: Number of rows per chunk.
+    :return: A tuple (min, max).
+    """
+    low, high = np.inf, -np.inf
+    for chunk in iter_chunks(path, chunksize, [value_col]):
+        low, high = min(low, chunk[value_col].min()), max(high, chunk[value_col].max())
+    return low, high
+
+
+def read_histograms(path, edges, variant_col='variant', value_col='value', chunksize=1_000_000):
+    """
+    Streams a raw per-user file into histogram counts per variant for lib.validation.mannwhitney_histogram.
+
+    Counts of separate files are merged by adding them.
+
+    :param path: Path to a .csv or .parquet file, or an open file object with such a name.
+    :param edges: Bin edges.
+    :param variant_col: Column with the variant name.
+    :param value_col: Column with the values.
+    :param chunksize: Number of rows per chunk.
+    :return: A dictionary {variant: counts per bin}.
+    """
+    counts = {}
+    for chunk in iter_chunks(path, chunksize, [variant_col, value_col]):
+        chunk = chunk.dropna(subset=[value_col])
+        for variant, values in chunk.groupby(variant_col, sort=False)[value_col]:
+            counts[variant] = counts.get(variant, 0) + histogram_counts(values.to_numpy(), edges)
+    return counts
+
+
+def _pair(stats, control, test):
+    """
+    Puts the control and test accumulators of every (experiment, metric) side by side.
+    """
+    wide = stats.unstack('variant')
+    pair = pd.DataFrame(index=wide.index)
+    for name, variant in (('control', control), ('test', test)):
+        count = wide[('count', variant)]
+        pair[f'count_{name}'] = count
+        pair[f'mean_{name}'] = wide[('mean', variant)]
+        pair[f'std_{name}'] = np.sqrt(wide[('m2', variant)] / (count - 1))
+        pair[f'successes_{name}'] = wide[('successes', variant)]
+    return pair.dropna(subset=['count_control', 'count_test']).sort_index()
+
+
+def ttest_stats(stats, control='control', test='test', alpha=0.05, alternative='two-sided'):
+    """
+    Runs the t-test for every (experiment, metric) of an accumulator table.
+
+    :param stats: Accumulator table.
+    :param control: Name of the control variant.
+    :param test: Name of the test variant.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :return: A DataFrame of ttest results indexed by (experiment, metric).
+    """
+    pair = _pair(stats, control, test)
+    return ttest_frame(pd.DataFrame({
+        'mean_control': pair['mean_control'], 'mean_test': pair['mean_test'],
+        'std_control': pair['std_control'], 'std_test': pair['std_test'],
+        'size_control': pair['count_control'], 'size_test': pair['count_test'],
+    }), alpha, alternative)
+
+
+def ztest_stats(stats, control='control', test='test', alpha=0.05, alternative='two-sided'):
+    """
+    Runs the z-test on the share of positive values for every (experiment, metric) of an accumulator table.
+
+    :param stats: Accumulator table.
+    :param control: Name of the control variant.
+    :param test: Name of the test variant.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater', or 'less'.
+    :return: A DataFrame of ztest results indexed by (experiment, metric).
+    """
+    pair = _pair(stats, control, test)
+    return ztest_frame(pd.DataFrame({
+        'z_size_test': pair['count_test'], 'z_size_control': pair['count_control'],
+        'success_test': pair['successes_test'], 'success_control': pair['successes_control'],
+    }), alpha, alternative)
+
+
+def sample_ratio_stats(stats, ratio_plan, control='control', test='test'):
+    """
+    Runs check_sample_ratio for every experiment of an accumulator table.
+
+    The group size of an experiment is the largest count over its metrics.
+
+    :param stats: Accumulator table.
+    :param ratio_plan: The planned ratio of the test group size to the total sample size.
+    :param control: Name of the control variant.
+    :param test: Name of the test variant.
+    :return: A DataFrame indexed by experiment with the group sizes and the p-value.
+    """
+    sizes = stats['count'].groupby(level=['experiment', 'variant']).max().unstack('variant')
+    res = pd.DataFrame({'control_fact': sizes[control], 'test_fact': sizes[test]}).dropna()
+    res['p_value'] = check_sample_ratio(res['control_fact'].to_numpy(), res['test_fact'].to_numpy(), ratio_plan)
+    return res
@@ -0,0 +1,155 @@
+import time
+import threading
+from itertools import product
+from lib.simulation import iter_simulate_grid, grid_frame
+
+
+STATUSES = ['running', 'done', 'cancelled', 'failed']
+
+
+class SimulationJob:
+    """
+    Runs a simulation grid in a background thread and keeps the finished cells available while it runs.
+
+    Cells are simulated in small groups, so partial results appear group by group and a cancellation
+    takes effect at the next group boundary. The worker pool belongs to the executor, which is either
+    shared (and stays alive) or owned by the grid run and closed when the thread exits, so no worker
+    process is left behind.
+    """
+
+    def __init__(self, lifts, sizes, data, group_size=None, **grid_kwargs):
+        self.cells = list(product(lifts, sizes))
+        self.results = {}
+        self.status = 'running'
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self._costs = {cell: cell[1] for cell in self.cells}
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        executor = grid_kwargs.get('executor')
+        if group_size is None:
+            # a couple of cells per worker keeps the pool busy and the updates frequent
+            group_size = 2 * executor.n_workers() if executor is not None else 8
+        self._thread = threading.Thread(target=self._run, args=(lifts, sizes, data, group_size, grid_kwargs),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, lifts, sizes, data, group_size, grid_kwargs):
+        groups = iter_simulate_grid(lifts, sizes, data, group_size=group_size, **grid_kwargs)
+        status = 'done'
+        try:
+            for finished in groups:
+                with self._lock:
+                    self.results.update(finished)
+                if self._cancel.is_set():
+                    status = 'cancelled'
+                    break
+        except Exception as e:
+            self.error = e
+            status = 'failed'
+        finally:
+            # closes the generator, and with it an executor owned by the grid run
+            groups.close()
+            # readers see a stopped job only with its finish time set
+            with self._lock:
+                self.finished = time.time()
+                self.status = status
+
+    def cancel(self):
+        """
+        Asks the job to stop after the group of cells that is being simulated.
+        """
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the job stops.
+
+        :return: True if the job has stopped.
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    def progress(self):
+        """
+        :return: Share of the estimated work that is done, between 0 and 1.
+        """
+        with self._lock:
+            done = sum(self._costs[cell] for cell in self.results)
+        total = sum(self._costs.values())
+        return done / total if total else 1.0
+
+    def eta(self):
+        """
+        Estimated seconds left, extrapolated from the pace so far; None before the first cells finish.
+        """
+        progress = self.progress()
+        if not self.running:
+            return 0.0
+        if progress == 0:
+            return None
+        return (time.time() - self.started) * (1 - progress) / progress
+
+    def frame(self):
+        """
+        :return: The finished cells in the format of simulate_grid.
+        """
+        with self._lock:
+            results = dict(self.results)
+        return grid_frame(self.cells, results)
+
+
+class JobRegistry:
+    """
+    Thread-safe store of background jobs keyed by, e.g., (session, parameters), which outlives script reruns.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, **job_kwargs):
+        """
+        Starts a SimulationJob under key unless a running or finished job with this key exists.
+        Other running jobs of the same session (first element of the key) are cancelled.
+
+        :param key: Hashable job key; a tuple whose first element is the session id.
+        :param job_kwargs: Arguments of SimulationJob.
+        :return: The job.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status in ('running', 'done'):
+                return job
+            for other_key, other in self._jobs.items():
+                if other_key != key and other_key[0] == key[0] and other.running:
+                    other.cancel()
+            job = self._jobs[key] = SimulationJob(**job_kwargs)
+            return job
+
+    def get(self, key):
+        """
+        :return: The job stored under key or None.
+        """
+        with self._lock:
+            return self._jobs.get(key)
+
+    def cancel(self, key):
+        job = self.get(key)
+        if job is not None:
+            job.cancel()
+
+    def prune(self, max_age=3600):
+        """
+        Forgets stopped jobs that finished more than max_age seconds ago.
+        """
+        now = time.time()
+        with self._lock:
+            for key in [k for k, job in self._jobs.items()
+                        if job.finished is not None and now - job.finished > max_age]:
+                del self._jobs[key]
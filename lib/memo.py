@@ -0,0 +1,131 @@
+import hashlib
+import inspect
+import threading
+import functools
+import numpy as np
+from collections import OrderedDict
+
+
+DEFAULT_MAXSIZE = 256
+
+# every memoized function, so their counters can be reported and their caches cleared together
+_registry = {}
+
+
+class Unhashable(TypeError):
+    pass
+
+
+def normalize(value):
+    """
+    Turns an argument into a hashable cache key part.
+
+    Floats are rounded to 12 significant digits, so 0.1 + 0.2 and 0.3 share an entry; numpy scalars become Python
+    numbers and arrays are replaced by their shape, dtype and a hash of their contents.
+
+    :raises Unhashable: For values that must not be cached, such as random generators.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (float, np.floating)):
+        return float(f'{value:.12g}')
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise Unhashable('object arrays have no stable byte representation')
+        data = np.ascontiguousarray(value)
+        return 'ndarray', data.shape, data.dtype.str, hashlib.sha1(data.view(np.uint8)).hexdigest()
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+    if isinstance(value, np.random.SeedSequence):
+        return 'SeedSequence', normalize(value.entropy), tuple(value.spawn_key)
+    if isinstance(value, np.random.Generator):
+        raise Unhashable('a random generator changes its state between calls')
+    try:
+        hash(value)
+    except TypeError as e:
+        raise Unhashable(str(e)) from e
+    return value
+
+
+def memoize(func=None, maxsize=DEFAULT_MAXSIZE, uncached=None):
+    """
+    Bounded LRU memoization for pure functions that works with or without Streamlit.
+
+    Arguments are bound to the signature with defaults applied, so f(1, b=2) and f(1, 2) share an entry.
+    Calls with arguments that cannot be normalized are passed through uncached. Cached results are shared
+    between callers and must not be modified.
+    The wrapper gets cache_info() and cache_clear() like functools.lru_cache.
+
+    :param func: Function to wrap; memoize can also be used as @memoize(maxsize=...).
+    :param maxsize: Number of results kept; the least recently used one is evicted first.
+    :param uncached: Optional predicate on the bound arguments telling that a call must not be cached,
+    e.g. a Monte Carlo call without a seed.
+    :return: Wrapped function.
+    """
+    if func is None:
+        return functools.partial(memoize, maxsize=maxsize, uncached=uncached)
+
+    signature = inspect.signature(func)
+    entries = OrderedDict()
+    lock = threading.Lock()
+    counters = {'hits': 0, 'misses': 0, 'uncached': 0}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        try:
+            if uncached is not None and uncached(bound.arguments):
+                raise Unhashable('excluded by the uncached predicate')
+            key = tuple((name, normalize(value)) for name, value in bound.arguments.items())
+        except Unhashable:
+            with lock:
+                counters['uncached'] += 1
+            return func(*args, **kwargs)
+
+        with lock:
+            if key in entries:
+                entries.move_to_end(key)
+                counters['hits'] += 1
+                return entries[key]
+            counters['misses'] += 1
+        res = func(*args, **kwargs)
+        with lock:
+            entries[key] = res
+            entries.move_to_end(key)
+            while len(entries) > maxsize:
+                entries.popitem(last=False)
+        return res
+
+    def cache_info():
+        with lock:
+            return dict(counters, size=len(entries), maxsize=maxsize)
+
+    def cache_clear():
+        with lock:
+            entries.clear()
+            counters.update(hits=0, misses=0, uncached=0)
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    _registry[f'{func.__module__}.{func.__qualname__}'] = wrapper
+    return wrapper
+
+
+def cache_stats():
+    """
+    :return: A dictionary {function name: cache_info()} for every memoized function.
+    """
+    return {name: wrapper.cache_info() for name, wrapper in _registry.items()}
+
+
+def clear_caches():
+    """
+    Empties the caches of all memoized functions.
+    """
+    for wrapper in _registry.values():
+        wrapper.cache_clear()
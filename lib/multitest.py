@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from scipy.special import ndtr, roots_legendre
+from lib.validation import ttest_batch, ztest_batch
+
+
+CORRECTIONS = ['none', 'holm', 'bh', 'dunnett']
+
+# Gauss-Legendre nodes on [-DUNNETT_BOUND, DUNNETT_BOUND] for the integral over the shared control term
+DUNNETT_BOUND = 8.0
+DUNNETT_NODES = 128
+
+
+def holm(p_values):
+    """
+    Holm-Bonferroni adjusted p-values; controls the family-wise error rate.
+
+    :param p_values: Array of p-values of the whole family; NaN values are left out.
+    :return: Array of adjusted p-values.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    res = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    order = valid[np.argsort(p_values[valid], kind='mergesort')]
+    m = len(order)
+    res[order] = np.minimum(1, np.maximum.accumulate((m - np.arange(m)) * p_values[order]))
+    return res
+
+
+def benjamini_hochberg(p_values):
+    """
+    Benjamini-Hochberg adjusted p-values (q-values); controls the false discovery rate.
+
+    :param p_values: Array of p-values of the whole family; NaN values are left out.
+    :return: Array of adjusted p-values.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    res = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    order = valid[np.argsort(p_values[valid], kind='mergesort')]
+    m = len(order)
+    scaled = p_values[order] * m / np.arange(1, m + 1)
+    res[order] = np.minimum(1, np.minimum.accumulate(scaled[::-1])[::-1])
+    return res
+
+
+def dunnett(z_scores, loadings, alternative='two-sided'):
+    """
+    Dunnett adjusted p-values for the comparisons of several arms with one shared control.
+
+    Z_i = (X_i - X_0) / se_i share the control term, so corr(Z_i, Z_j) = l_i * l_j with
+    l_i = se(X_0) / se_i. For such a one-factor correlation the probability that all Z_i (or all |Z_i|
+    for the two-sided test) stay below c is a one-dimensional integral over the control term,
+    which is evaluated for all comparisons at once.
+
+    :param z_scores: Array of z-statistics of the arm-vs-control comparisons of one family. For one-sided tests
+    they must be oriented so that large values support the alternative.
+    :param loadings: Array of l_i, the share of the standard error that comes from the control.
+    :param alternative: 'two-sided' or 'one-sided'.
+    :return: Array of adjusted p-values.
+    """
+    if alternative not in ('two-sided', 'one-sided'):
+        raise ValueError("alternative must be 'two-sided' or 'one-sided'")
+    z_scores, loadings = np.asarray(z_scores, dtype=float), np.asarray(loadings, dtype=float)
+    if alternative == 'two-sided':
+        z_scores = np.abs(z_scores)
+    nodes, weights = roots_legendre(DUNNETT_NODES)
+    u, weights = nodes * DUNNETT_BOUND, weights * DUNNETT_BOUND * np.exp(-(nodes * DUNNETT_BOUND)**2 / 2)
+    weights = weights / np.sqrt(2 * np.pi)
+
+    # (comparison c, arm i, node)
+    c = z_scores[:, None, None]
+    shift = loadings[None, :, None] * u[None, None, :]
+    scale = np.sqrt(np.maximum(1 - loadings**2, 1e-12))[None, :, None]
+    inside = ndtr((c - shift) / scale)
+    if alternative == 'two-sided':
+        inside = inside - ndtr((-c - shift) / scale)
+    probability = (np.prod(inside, axis=1) * weights).sum(axis=1)
+    return np.clip(1 - probability, 0, 1)
+
+
+def compare_variants(summary, control='control', criteria='t-test', alpha=0.05, alternative='two-sided',
+                     correction='holm', pairwise=False, by=('metric',), variant_col='variant'):
+    """
+    Compares every arm with the control, and optionally every pair of arms, for every metric in one pass,
+    and adjusts the p-values over the whole result matrix.
+
+    :param summary: Summary table with one row per (by..., variant). For t-test it needs the columns
+    mean, std and size, for z-test the columns size and successes.
+    :param control: Name of the control variant.
+    :param criteria: 't-test' or 'z-test'.
+    :param alpha: Significance level.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :param correction: 'none', 'holm', 'bh' (Benjamini-Hochberg) or 'dunnett'. Holm and BH are applied across all
+    comparisons of all metrics; Dunnett within every metric, for arm-vs-control comparisons only. Dunnett uses
+    the normal approximation of the test statistic with the variances of the test (Welch for t-test, pooled
+    for z-test) and is one-sided for one-sided alternatives.
+    :param pairwise: Whether to add the comparisons between all pairs of non-control arms.
+    :param by: Columns identifying a metric, e.g. ('experiment', 'metric').
+    :param variant_col: Column with the variant name.
+    :return: A tidy DataFrame with one row per comparison: the by columns, control, test, the ttest result
+    columns, p_adjusted and significant.
+    """
+    if correction not in CORRECTIONS:
+        raise ValueError(f'correction must be one of {CORRECTIONS}')
+    if correction == 'dunnett' and pairwise:
+        raise ValueError('Dunnett correction covers arm-vs-control comparisons only')
+    by = list(by)
+    table = summary.set_index(by + [variant_col]).sort_index()
+
+    variants = table.index.get_level_values(variant_col).unique()
+    arms = [v for v in variants if v != control]
+    pairs = [(control, arm) for arm in arms]
+    if pairwise:
+        pairs += list(combinations(arms, 2))
+
+    frames = []
+    for first, second in pairs:
+        left = table.xs(first, level=variant_col).add_suffix('_control')
+        right = table.xs(second, level=variant_col).add_suffix('_test')
+        joined = left.join(right, how='inner')
+        joined['control'], joined['test'] = first, second
+        frames.append(joined)
+    merged = pd.concat(frames).reset_index() if frames else pd.DataFrame()
+    if merged.empty:
+        return merged
+
+    # the Dunnett statistics use the variances of the test itself and are oriented like its one-sided p-values
+    if criteria == 't-test':
+        res = ttest_batch(merged['mean_control'], merged['mean_test'], merged['std_control'], merged['std_test'],
+                          merged['size_control'], merged['size_test'], alpha, alternative)
+        var_control = merged['std_control']**2 / merged['size_control']
+        var_test = merged['std_test']**2 / merged['size_test']
+        # ttest_batch tests control - test, 'greater' meaning a larger control mean
+        difference = merged['mean_control'] - merged['mean_test']
+        orientation = -1 if alternative == 'less' else 1
+    elif criteria == 'z-test':
+        res = ztest_batch(merged['size_test'], merged['size_control'], merged['successes_test'],
+                          merged['successes_control'], alpha, alternative)
+        # pooled variance as in ztest_batch; under the null it is shared by both groups,
+        # so the loadings only depend on the sizes
+        pooled = (merged['successes_control'] + merged['successes_test']) / \
+            (merged['size_control'] + merged['size_test'])
+        var_control = pooled * (1 - pooled) / merged['size_control']
+        var_test = pooled * (1 - pooled) / merged['size_test']
+        difference = merged['successes_test'] / merged['size_test'] - \
+            merged['successes_control'] / merged['size_control']
+        # ztest_batch tests test - control and only 'smaller' selects the lower tail
+        orientation = -1 if alternative == 'smaller' else 1
+    else:
+        raise ValueError("criteria must be 't-test' or 'z-test'")
+
+    out = merged[by + ['control', 'test']].copy()
+    for name, values in res.items():
+        out[name] = values
+    p_values = out['p_value'].to_numpy(dtype=float)
+
+    if correction == 'none':
+        out['p_adjusted'] = p_values
+    elif correction == 'holm':
+        out['p_adjusted'] = holm(p_values)
+    elif correction == 'bh':
+        out['p_adjusted'] = benjamini_hochberg(p_values)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_scores = (orientation * difference / np.sqrt(var_control + var_test)).to_numpy()
+            loadings = np.sqrt(var_control / (var_control + var_test)).to_numpy()
+        sides = 'two-sided' if alternative == 'two-sided' else 'one-sided'
+        adjusted = np.full(len(out), np.nan)
+        for rows in out.groupby(by, sort=False).indices.values():
+            adjusted[rows] = dunnett(z_scores[rows], loadings[rows], sides)
+        out['p_adjusted'] = adjusted
+    out['significant'] = out['p_adjusted'] < alpha
+    return out
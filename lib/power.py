@@ -0,0 +1,196 @@
+import numpy as np
+# scipy.special instead of scipy.stats and pandas keep the cold import of this module cheap,
+# pandas is imported by power_grid_frame
+from scipy.special import ndtr, ndtri, stdtrit, nctdtr
+from lib.profiling import profiled
+
+
+# fixed number of refinement steps used to move the normal approximation to the t-distribution
+T_REFINEMENT_STEPS = 3
+
+
+def effect_size_from_lift(lift, criteria, mean, std=None):
+    """
+    Converts lifts into standardized effect sizes the same way sample_size_calc_ttest and sample_size_calc_ztest do.
+
+    :param lift: Lift or array of lifts of the test group mean over the control mean.
+    :param criteria: 't-test' or 'z-test'.
+    :param mean: Mean (or conversion rate for z-test) of the control group.
+    :param std: Standard deviation of the control group, required for t-test.
+    :return: Array of effect sizes.
+    """
+    lift = np.asarray(lift, dtype=float)
+    if criteria == 't-test':
+        return np.abs(mean * lift - mean) / std
+    elif criteria == 'z-test':
+        return 2 * np.arcsin(np.sqrt(mean * lift)) - 2 * np.arcsin(np.sqrt(mean))
+    else:
+        raise ValueError("criteria must be 't-test' or 'z-test'")
+
+
+def lift_from_effect_size(effect_size, criteria, mean, std=None):
+    """
+    Inverse of effect_size_from_lift for positive effects.
+
+    :param effect_size: Effect size or array of effect sizes.
+    :param criteria: 't-test' or 'z-test'.
+    :param mean: Mean (or conversion rate for z-test) of the control group.
+    :param std: Standard deviation of the control group, required for t-test.
+    :return: Array of lifts.
+    """
+    effect_size = np.asarray(effect_size, dtype=float)
+    if criteria == 't-test':
+        return 1 + effect_size * std / mean
+    elif criteria == 'z-test':
+        phi = np.clip(2 * np.arcsin(np.sqrt(mean)) + effect_size, 0, np.pi)
+        return np.sin(phi / 2)**2 / mean
+    else:
+        raise ValueError("criteria must be 't-test' or 'z-test'")
+
+
+def power(effect_size, nobs1, alpha, ratio=1.0, alternative='two-sided', criteria='t-test'):
+    """
+    Vectorized power of the two-sample t-test or z-test.
+
+    All array arguments are broadcast against each other, so a whole grid is evaluated at once.
+    Follows the conventions of statsmodels' tt_ind_solve_power and zt_ind_solve_power:
+    nobs2 = nobs1 * ratio and alternative is 'two-sided', 'larger' or 'smaller'.
+
+    :param effect_size: Standardized effect size(s).
+    :param nobs1: Size(s) of the test group.
+    :param alpha: Significance level(s).
+    :param ratio: Ratio of control and test samples.
+    :param alternative: 'two-sided', 'larger' or 'smaller'.
+    :param criteria: 't-test' or 'z-test'.
+    :return: Array of power values.
+    """
+    effect_size, nobs1, alpha = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (effect_size, nobs1, alpha)))
+    nobs = nobs1 * ratio / (1 + ratio)
+    noncentrality = effect_size * np.sqrt(nobs)
+
+    if criteria == 't-test':
+        df = nobs1 * (1 + ratio) - 2
+
+        def isf(p):
+            return -stdtrit(df, p)
+
+        def alt_sf(x):
+            return 1 - nctdtr(df, noncentrality, x)
+
+        def alt_cdf(x):
+            return nctdtr(df, noncentrality, x)
+    elif criteria == 'z-test':
+        def isf(p):
+            return -ndtri(p)
+
+        def alt_sf(x):
+            return ndtr(noncentrality - x)
+
+        def alt_cdf(x):
+            return ndtr(x - noncentrality)
+    else:
+        raise ValueError("criteria must be 't-test' or 'z-test'")
+
+    if alternative == 'two-sided':
+        crit = isf(alpha / 2)
+        return alt_sf(crit) + alt_cdf(-crit)
+    elif alternative == 'larger':
+        return alt_sf(isf(alpha))
+    elif alternative == 'smaller':
+        return alt_cdf(-isf(alpha))
+    else:
+        raise ValueError("alternative must be 'two-sided', 'larger' or 'smaller'")
+
+
+@profiled
+def power_grid(lifts, sizes, alphas, criteria, mean, std=None, ratio=1.0, alternative='two-sided'):
+    """
+    Calculates the lifts x sizes x alphas power surface in one array computation.
+
+    :param lifts: Lifts to evaluate.
+    :param sizes: Test group sizes to evaluate.
+    :param alphas: Significance levels to evaluate.
+    :param criteria: 't-test' or 'z-test'.
+    :param mean: Mean (or conversion rate for z-test) of the control group.
+    :param std: Standard deviation of the control group, required for t-test.
+    :param ratio: Ratio of control and test samples.
+    :param alternative: 'two-sided', 'larger' or 'smaller'.
+    :return: Array of shape (len(lifts), len(sizes), len(alphas)).
+    """
+    effect_size = effect_size_from_lift(np.atleast_1d(lifts), criteria, mean, std)
+    return power(effect_size[:, None, None], np.atleast_1d(sizes)[None, :, None],
+                 np.atleast_1d(alphas)[None, None, :], ratio, alternative, criteria)
+
+
+def power_grid_frame(lifts, sizes, alphas, criteria, mean, std=None, ratio=1.0, alternative='two-sided'):
+    """
+    Same as power_grid, returned as a long DataFrame with the columns lift, n, alpha and power.
+    """
+    import pandas as pd
+
+    lifts, sizes, alphas = np.atleast_1d(lifts), np.atleast_1d(sizes), np.atleast_1d(alphas)
+    surface = power_grid(lifts, sizes, alphas, criteria, mean, std, ratio, alternative)
+    lift, n, alpha = np.meshgrid(lifts, sizes, alphas, indexing='ij')
+    return pd.DataFrame({'lift': lift.ravel(), 'n': n.ravel(), 'alpha': alpha.ravel(), 'power': surface.ravel()})
+
+
+def _quantile_sum(alpha, power, alternative, df=None):
+    """
+    Sum of the critical value and the power quantile, the numerator of the closed-form MDE and size formulas.
+    """
+    alpha = np.asarray(alpha, dtype=float)
+    tail = alpha / 2 if alternative == 'two-sided' else alpha
+    if df is None:
+        return -ndtri(tail) + ndtri(power)
+    return -stdtrit(df, tail) + stdtrit(df, power)
+
+
+@profiled
+def mde_for_size(sizes, alpha, power, criteria, mean, std=None, ratio=1.0, alternative='two-sided'):
+    """
+    Calculates the minimal detectable lift for every test group size.
+
+    Uses the closed-form (z_alpha + z_power) / sqrt(n) relation; for t-test the normal quantiles are replaced
+    by those of the t-distribution with the degrees of freedom of every size, which are known up front,
+    so no root finder or refinement is needed.
+
+    :param sizes: Test group sizes.
+    :param alpha: Significance level.
+    :param power: Desired power.
+    :param criteria: 't-test' or 'z-test'.
+    :param mean: Mean (or conversion rate for z-test) of the control group.
+    :param std: Standard deviation of the control group, required for t-test.
+    :param ratio: Ratio of control and test samples.
+    :param alternative: 'two-sided', 'larger' or 'smaller'.
+    :return: Array of minimal detectable lifts.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    nobs = sizes * ratio / (1 + ratio)
+    df = sizes * (1 + ratio) - 2 if criteria == 't-test' else None
+    effect_size = _quantile_sum(alpha, power, alternative, df) / np.sqrt(nobs)
+    return lift_from_effect_size(effect_size, criteria, mean, std)
+
+
+@profiled
+def size_for_mde(lifts, alpha, power, criteria, mean, std=None, ratio=1.0, alternative='two-sided'):
+    """
+    Calculates the test group size needed to detect every lift.
+
+    :param lifts: Lifts to detect.
+    :param alpha: Significance level.
+    :param power: Desired power.
+    :param criteria: 't-test' or 'z-test'.
+    :param mean: Mean (or conversion rate for z-test) of the control group.
+    :param std: Standard deviation of the control group, required for t-test.
+    :param ratio: Ratio of control and test samples.
+    :param alternative: 'two-sided', 'larger' or 'smaller'.
+    :return: Array of test group sizes, rounded up like sample_size_calc_ttest and sample_size_calc_ztest.
+    """
+    effect_size = np.abs(effect_size_from_lift(lifts, criteria, mean, std))
+    with np.errstate(divide='ignore'):
+        nobs1 = (_quantile_sum(alpha, power, alternative) / effect_size)**2 * (1 + ratio) / ratio
+        if criteria == 't-test':
+            for _ in range(T_REFINEMENT_STEPS):
+                df = np.maximum(nobs1 * (1 + ratio) - 2, 1)
+                nobs1 = (_quantile_sum(alpha, power, alternative, df) / effect_size)**2 * (1 + ratio) / ratio
+    return np.ceil(nobs1)
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+
+# profiling is off unless EXPERIMENT_TOOLS_PROFILE is set or enable() is called; values: 1 (timers), memory
+_setting = os.environ.get('EXPERIMENT_TOOLS_PROFILE', '').lower()
+_enabled = _setting not in ('', '0', 'false', 'no')
+_track_memory = _setting == 'memory'
+
+_stats = {}
+_lock = threading.Lock()
+# open stages of the current thread, used to attribute memory peaks to every enclosing stage
+_local = threading.local()
+_own_tracing = False
+
+
+def _set_tracing(on):
+    # tracemalloc is only stopped here if it was started here, e.g. not while the benchmarks trace memory
+    global _own_tracing
+    if on and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _own_tracing = True
+    elif not on and _own_tracing:
+        tracemalloc.stop()
+        _own_tracing = False
+
+
+def enable(memory=False):
+    """
+    Starts recording stages in this process.
+
+    :param memory: Whether to also record peak memory with tracemalloc, which slows allocations down noticeably.
+    """
+    global _enabled, _track_memory
+    _enabled, _track_memory = True, memory
+    _set_tracing(memory)
+
+
+def disable():
+    """
+    Stops recording; the statistics collected so far are kept until reset().
+    """
+    global _enabled, _track_memory
+    _enabled, _track_memory = False, False
+    _set_tracing(False)
+
+
+if _track_memory:
+    _set_tracing(True)
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Forgets all recorded statistics.
+    """
+    with _lock:
+        _stats.clear()
+
+
+def _record(name, elapsed, peak):
+    with _lock:
+        entry = _stats.setdefault(name, {'calls': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                         'peak_memory': None})
+        entry['calls'] += 1
+        entry['total_seconds'] += elapsed
+        entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+        if peak is not None:
+            entry['peak_memory'] = max(entry['peak_memory'] or 0, peak)
+
+
+@contextmanager
+def stage(name):
+    """
+    Records the wall time, the call count and, when memory tracking is on, the peak memory of a block.
+
+    Stages may be nested. Memory peaks come from tracemalloc, which is process-wide, so concurrent threads
+    inflate each other's peaks; work done in worker processes is only visible as the time of the dispatch.
+    Does nothing while profiling is disabled.
+
+    :param name: Stage name, e.g. 'simulation.group' or 'render.power_chart'.
+    """
+    if not _enabled:
+        yield
+        return
+    memory = _track_memory and tracemalloc.is_tracing()
+    frames = _local.__dict__.setdefault('frames', [])
+    frame = None
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        # the peak reached so far belongs to the enclosing stages; the counter is then restarted for this one
+        for outer in frames:
+            outer['peak'] = max(outer['peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'start': current, 'peak': current}
+        frames.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = None
+        if frame is not None:
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            frames.pop()
+            if frames:
+                frames[-1]['peak'] = max(frames[-1]['peak'], frame['peak'])
+            peak = frame['peak'] - frame['start']
+        _record(name, elapsed, peak)
+
+
+def profiled(func=None, name=None):
+    """
+    Decorator recording every call of a function as a stage named after its module and name.
+
+    :param func: Function to wrap; profiled can also be used as @profiled(name=...).
+    :param name: Stage name. By default 'module.function' without the 'lib.' prefix.
+    :return: Wrapped function.
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    if name is None:
+        name = f'{func.__module__}.{func.__qualname__}'.removeprefix('lib.')
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def report():
+    """
+    :return: A dictionary {stage: {calls, total_seconds, mean_seconds, max_seconds, peak_memory}}, slowest first.
+    peak_memory is in bytes, or None when memory was not tracked.
+    """
+    with _lock:
+        stats = {name: dict(entry) for name, entry in _stats.items()}
+    for entry in stats.values():
+        entry['mean_seconds'] = entry['total_seconds'] / entry['calls']
+    return dict(sorted(stats.items(), key=lambda item: -item[1]['total_seconds']))
+
+
+def to_json(indent=2):
+    """
+    :return: The report as a JSON string.
+    """
+    return json.dumps(report(), indent=indent)
+
+
+def to_prometheus(prefix='experiment_tools'):
+    """
+    :return: The report in the Prometheus text exposition format, one series per stage.
+    """
+    metrics = [
+        ('stage_calls_total', 'counter', 'Number of calls of the stage.', 'calls'),
+        ('stage_seconds_total', 'counter', 'Total wall time spent in the stage.', 'total_seconds'),
+        ('stage_seconds_max', 'gauge', 'Longest single call of the stage.', 'max_seconds'),
+        ('stage_peak_memory_bytes', 'gauge', 'Peak memory traced during a call of the stage.', 'peak_memory'),
+    ]
+    stats = report()
+    lines = []
+    for metric, kind, help_text, field in metrics:
+        lines += [f'# HELP {prefix}_{metric} {help_text}', f'# TYPE {prefix}_{metric} {kind}']
+        for name, entry in stats.items():
+            if entry[field] is not None:
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{prefix}_{metric}{{stage="{label}"}} {entry[field]:.9g}')
+    return '\n'.join(lines) + '\n'
+
+
+def diagnostics_panel():
+    """
+    Renders a collapsible Streamlit panel to switch profiling on and off and inspect or download the stages
+    and the memoization counters. Meant to be called at the end of a page.
+    """
+    import streamlit as st
+    import pandas as pd
+    from lib.memo import cache_stats
+
+    with st.expander('Diagnostics'):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            on = st.checkbox('Profile', value=_enabled, key='diagnostics_profile',
+                             help='Applies to every session of this server process')
+        with col2:
+            memory = st.checkbox('Track peak memory', value=_track_memory, key='diagnostics_memory',
+                                 disabled=not on, help='tracemalloc slows allocations down')
+        with col3:
+            if st.button('Reset', key='diagnostics_reset'):
+                reset()
+        if on and (not _enabled or memory != _track_memory):
+            enable(memory)
+        elif not on and _enabled:
+            disable()
+
+        stats = report()
+        if stats:
+            st.dataframe(pd.DataFrame.from_dict(stats, orient='index')[
+                ['calls', 'total_seconds', 'mean_seconds', 'max_seconds', 'peak_memory']])
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button('JSON', to_json(), file_name='profile.json', mime='application/json',
+                                   key='diagnostics_json')
+            with col2:
+                st.download_button('Prometheus', to_prometheus(), file_name='profile.prom', mime='text/plain',
+                                   key='diagnostics_prometheus')
+        else:
+            st.write('No stages recorded yet; switch profiling on and rerun the page')
+        caches = cache_stats()
+        if caches:
+            st.write('Memoized functions')
+            st.dataframe(pd.DataFrame.from_dict(caches, orient='index'))
@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+from itertools import combinations_with_replacement
+from lib.ingest import iter_chunks
+from lib.validation import ttest_frame
+from lib.profiling import profiled
+
+
+# a metric is the ratio of the means of x and y, its CUPED covariate the ratio of the means of u and v;
+# a missing denominator is a column of ones, which turns the ratio into a plain mean
+FIELDS = ['x', 'y', 'u', 'v']
+METRIC_KEYS = ['numerator', 'denominator', 'covariate', 'covariate_denominator']
+PRODUCTS = [a + b for a, b in combinations_with_replacement(FIELDS, 2)]
+MOMENT_COLUMNS = ['count'] + FIELDS + PRODUCTS
+KEYS = ['experiment', 'variant', 'metric']
+
+
+def parse_metrics(metrics):
+    """
+    Normalizes metric definitions.
+
+    :param metrics: A dictionary {metric name: definition}. A definition is a column name for a per-user mean,
+    or a dictionary with the keys numerator, denominator, covariate and covariate_denominator,
+    e.g. {'numerator': 'revenue', 'denominator': 'sessions', 'covariate': 'revenue_pre',
+    'covariate_denominator': 'sessions_pre'}. Only numerator is required.
+    :return: A dictionary {metric name: dictionary with all METRIC_KEYS, missing ones set to None}.
+    """
+    res = {}
+    for name, definition in metrics.items():
+        if isinstance(definition, str):
+            definition = {'numerator': definition}
+        unknown = set(definition) - set(METRIC_KEYS)
+        if unknown:
+            raise ValueError(f'metric definitions must only use the keys {METRIC_KEYS}, got {sorted(unknown)}')
+        if definition.get('numerator') is None:
+            raise ValueError(f"metric '{name}' must have a numerator")
+        if definition.get('covariate') is None and definition.get('covariate_denominator') is not None:
+            raise ValueError(f"metric '{name}' must have a covariate to use a covariate_denominator")
+        res[name] = {key: definition.get(key) for key in METRIC_KEYS}
+    return res
+
+
+def metric_columns(metrics):
+    """
+    :return: The input columns used by the parsed metric definitions.
+    """
+    return sorted({column for definition in metrics.values() for column in definition.values() if column is not None})
+
+
+def empty_moments():
+    """
+    Creates an empty accumulator of sums and cross-products.
+
+    :return: A DataFrame indexed by (experiment, variant, metric) with the MOMENT_COLUMNS.
+    """
+    index = pd.MultiIndex.from_arrays([[], [], []], names=KEYS)
+    return pd.DataFrame({column: pd.Series(dtype=float) for column in MOMENT_COLUMNS}, index=index)
+
+
+def chunk_moments(chunk, metrics, experiment_col='experiment', variant_col='variant'):
+    """
+    Calculates the count, sums and cross-products of the metric fields for one chunk of per-user rows.
+
+    Rows without a numerator or denominator are skipped for that metric; a missing covariate counts as zero,
+    as for users without pre-period activity.
+
+    :param chunk: DataFrame with one row per user and one column per input.
+    :param metrics: Parsed metric definitions, see parse_metrics.
+    :param experiment_col: Column with the experiment id.
+    :param variant_col: Column with the variant name.
+    :return: Accumulator of the chunk.
+    """
+    parts = []
+    for name, definition in metrics.items():
+        ones = pd.Series(1.0, index=chunk.index)
+        zeros = pd.Series(0.0, index=chunk.index)
+        fields = pd.DataFrame({
+            'experiment': chunk[experiment_col],
+            'variant': chunk[variant_col],
+            'metric': name,
+            'x': chunk[definition['numerator']],
+            'y': chunk[definition['denominator']] if definition['denominator'] is not None else ones,
+            'u': chunk[definition['covariate']].fillna(0) if definition['covariate'] is not None else zeros,
+            'v': chunk[definition['covariate_denominator']].fillna(0)
+            if definition['covariate_denominator'] is not None else ones,
+        }).dropna(subset=['x', 'y'])
+        values = fields[FIELDS].to_numpy(dtype=float)
+        for a, b in combinations_with_replacement(range(len(FIELDS)), 2):
+            fields[FIELDS[a] + FIELDS[b]] = values[:, a] * values[:, b]
+        fields['count'] = 1.0
+        parts.append(fields)
+
+    if not parts:
+        return empty_moments()
+    moments = pd.concat(parts, ignore_index=True).groupby(KEYS, sort=False)[MOMENT_COLUMNS].sum()
+    return moments.astype(float)
+
+
+def merge_moments(left, right):
+    """
+    Merges two accumulators. Sums are added, so partial results of separate chunks, files or processes
+    can be combined in any order.
+
+    :param left: Accumulator.
+    :param right: Accumulator.
+    :return: Combined accumulator.
+    """
+    left, right = left.align(right, join='outer', fill_value=0)
+    return left + right
+
+
+@profiled
+def read_moments(path, metrics, experiment_col='experiment', variant_col='variant', chunksize=1_000_000):
+    """
+    Streams a raw per-user export once and accumulates the moments of all metrics.
+
+    :param path: Path to a .csv or .parquet file, or an open file object with such a name.
+    :param metrics: Metric definitions, see parse_metrics.
+    :param experiment_col: Column with the experiment id.
+    :param variant_col: Column with the variant name.
+    :param chunksize: Number of rows per chunk.
+    :return: Accumulator.
+    """
+    metrics = parse_metrics(metrics)
+    columns = [experiment_col, variant_col] + [c for c in metric_columns(metrics)
+                                               if c not in (experiment_col, variant_col)]
+    moments = empty_moments()
+    for chunk in iter_chunks(path, chunksize, columns):
+        moments = merge_moments(moments, chunk_moments(chunk, metrics, experiment_col, variant_col))
+    return moments
+
+
+def read_moments_parallel(paths, metrics, n_jobs=-1, **kwargs):
+    """
+    Runs read_moments for several files in parallel and merges the partial accumulators.
+
+    :param paths: Paths to .csv or .parquet files.
+    :param metrics: Metric definitions, see parse_metrics.
+    :param n_jobs: Number of joblib workers.
+    :param kwargs: Arguments passed to read_moments.
+    :return: Accumulator.
+    """
+    from joblib import Parallel, delayed
+
+    partial = Parallel(n_jobs=n_jobs)(delayed(read_moments)(path, metrics, **kwargs) for path in paths)
+    moments = empty_moments()
+    for part in partial:
+        moments = merge_moments(moments, part)
+    return moments
+
+
+def moment_estimates(moments):
+    """
+    Delta-method estimates of every group of an accumulator.
+
+    The metric f = mean(x) / mean(y) and the covariate g = mean(u) / mean(v) are linearized around the means,
+    so their per-user variances and covariance follow from the sample covariance matrix of (x, y, u, v).
+
+    :param moments: Accumulator.
+    :return: A DataFrame indexed like moments with the columns count, metric, covariate, var_metric,
+    var_covariate and cov (per-user variances; divide by count for the variance of the group estimate).
+    """
+    n = moments['count']
+    mean = {field: moments[field] / n for field in FIELDS}
+
+    def covariance(a, b):
+        column = a + b if a + b in moments else b + a
+        return (moments[column] - moments[a] * moments[b] / n) / (n - 1)
+
+    # gradients of x/y and u/v with respect to the means
+    grad_metric = {'x': 1 / mean['y'], 'y': -mean['x'] / mean['y']**2}
+    grad_covariate = {'u': 1 / mean['v'], 'v': -mean['u'] / mean['v']**2}
+
+    def quadratic(left, right):
+        return sum(left[a] * right[b] * covariance(a, b) for a in left for b in right)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'count': n,
+            'metric': mean['x'] / mean['y'],
+            'covariate': mean['u'] / mean['v'],
+            'var_metric': quadratic(grad_metric, grad_metric),
+            'var_covariate': quadratic(grad_covariate, grad_covariate),
+            'cov': quadratic(grad_metric, grad_covariate),
+        })
+
+
+@profiled
+def ratio_ttest(moments, control='control', test='test', alpha=0.05, alternative='two-sided', cuped=True):
+    """
+    Runs the t-test on delta-method ratio metrics, optionally CUPED-adjusted, for every (experiment, metric).
+
+    The CUPED coefficient theta is shared by both groups and minimizes the variance of the difference;
+    both groups are adjusted towards the pooled covariate, so the control mean keeps its scale.
+    Metrics without a covariate are left unadjusted.
+
+    :param moments: Accumulator, see read_moments.
+    :param control: Name of the control variant.
+    :param test: Name of the test variant.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :param cuped: Whether to apply the covariate adjustment.
+    :return: A DataFrame of ttest results indexed by (experiment, metric), with the coefficient theta and
+    the share of variance removed by the adjustment (variance_reduction).
+    """
+    estimates = moment_estimates(moments).unstack('variant')
+    sums = moments[['u', 'v']].unstack('variant')
+    columns = [(name, variant) for name in ('count', 'metric') for variant in (control, test)]
+    estimates = estimates.dropna(subset=columns)
+    sums = sums.reindex(estimates.index)
+
+    def group(column, variant):
+        return estimates[(column, variant)]
+
+    n_c, n_t = group('count', control), group('count', test)
+    var_c, var_t = group('var_metric', control) / n_c, group('var_metric', test) / n_t
+    cov = group('cov', control) / n_c + group('cov', test) / n_t
+    var_covariate = group('var_covariate', control) / n_c + group('var_covariate', test) / n_t
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta = (cov / var_covariate).where(var_covariate > 0, 0.0) if cuped else pd.Series(0.0, index=cov.index)
+        pooled = (sums[('u', control)] + sums[('u', test)]) / (sums[('v', control)] + sums[('v', test)])
+
+    adjusted = {}
+    for name, variant in (('control', control), ('test', test)):
+        mean = group('metric', variant) - theta * (group('covariate', variant) - pooled)
+        var = (group('var_metric', variant) - 2 * theta * group('cov', variant)
+               + theta**2 * group('var_covariate', variant))
+        adjusted[f'mean_{name}'] = mean
+        adjusted[f'std_{name}'] = np.sqrt(var.clip(lower=0))
+        adjusted[f'size_{name}'] = group('count', variant)
+
+    res = ttest_frame(pd.DataFrame(adjusted), alpha, alternative)
+    res['theta'] = theta
+    with np.errstate(divide='ignore', invalid='ignore'):
+        adjusted_var = adjusted['std_control']**2 / n_c + adjusted['std_test']**2 / n_t
+        res['variance_reduction'] = 1 - adjusted_var / (var_c + var_t)
+    return res.sort_index()
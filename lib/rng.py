@@ -0,0 +1,87 @@
+import numpy as np
+
+
+def key_entropy(key):
+    """
+    Converts a stream key (an integer, float or string) into a non-negative integer for SeedSequence.
+
+    Floats are converted through their IEEE bits, so 1.1 and 1.1000000000000001 give different streams
+    while equal floats always give the same one.
+    """
+    if isinstance(key, (float, np.floating)):
+        return int(np.float64(key).view(np.uint64))
+    if isinstance(key, str):
+        return int.from_bytes(key.encode(), 'little')
+    return int(key)
+
+
+def seed_sequence(random_state=None, *keys):
+    """
+    Derives an independent SeedSequence from a root seed and the keys of a stream, e.g. a grid cell.
+
+    The stream depends only on the seed and the keys, not on the order in which streams are created
+    or on the worker that uses them, so parallel results are identical for any number of workers.
+
+    :param random_state: Integer root seed, a SeedSequence, or None for fresh entropy.
+    :param keys: Integers, floats or strings identifying the stream.
+    :return: numpy SeedSequence.
+    """
+    if isinstance(random_state, np.random.SeedSequence):
+        if not keys:
+            return random_state
+        return np.random.SeedSequence([random_state.entropy, *random_state.spawn_key, *map(key_entropy, keys)])
+    if random_state is None:
+        return np.random.SeedSequence()
+    return np.random.SeedSequence([int(random_state), *map(key_entropy, keys)])
+
+
+def spawn(random_state, n):
+    """
+    Splits a seed into n independent child seeds, one per chunk of work.
+
+    :param random_state: Integer root seed, a SeedSequence, or None for fresh entropy.
+    :param n: Number of children.
+    :return: List of SeedSequence.
+    """
+    return seed_sequence(random_state).spawn(n)
+
+
+def make_rng(random_state=None):
+    """
+    Creates a numpy Generator. Generators are passed through, so functions may accept either.
+
+    :param random_state: Integer seed, SeedSequence, Generator or None.
+    :return: numpy Generator.
+    """
+    return np.random.default_rng(random_state)
+
+
+def uniform_into(rng, out):
+    """
+    Fills a preallocated float64 buffer with uniform [0, 1) draws without allocating a new array.
+
+    Produces the same numbers as rng.random(out.shape).
+
+    :param rng: numpy Generator.
+    :param out: C-contiguous float64 array.
+    :return: out.
+    """
+    return rng.random(out=out)
+
+
+def normal_into(rng, out, loc=0.0, scale=1.0):
+    """
+    Fills a preallocated float64 buffer with normal draws without allocating a new array.
+
+    :param rng: numpy Generator.
+    :param out: C-contiguous float64 array.
+    :param loc: Mean.
+    :param scale: Standard deviation.
+    :return: out.
+    """
+    rng.standard_normal(out=out)
+    if scale != 1.0:
+        out *= scale
+    if loc != 0.0:
+        out += loc
+    return out
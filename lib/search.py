@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from lib.executor import SimulationExecutor
+from lib.power import size_for_mde
+from lib.rng import seed_sequence
+from lib.simulation import simulate_mannwhitney, proportion_ci
+from lib.profiling import profiled
+
+
+# simulations per parallel task; a fixed split keeps the random streams independent of the number of workers
+SIMULATIONS_PER_TASK = 100
+
+
+@profiled
+def evaluate_size(n, lift, data, target, executor, alpha=0.05, confidence=0.95, batch_size=400,
+                  max_simulations=10000, random_state=None, **sampling):
+    """
+    Simulates the power at one size in batches until its confidence interval lies on one side of the target.
+
+    Every batch is split into tasks of SIMULATIONS_PER_TASK simulations with their own random streams,
+    so the result does not depend on the number of workers.
+
+    :param n: Sample size, both groups together.
+    :param lift: Lift applied to the test group.
+    :param data: Source sample.
+    :param target: Target power.
+    :param executor: lib.executor.SimulationExecutor running the batches.
+    :param alpha: Significance level of the test.
+    :param confidence: Confidence level of the power interval.
+    :param batch_size: Number of simulations between two checks.
+    :param max_simulations: Cap on the number of simulations.
+    :param random_state: Integer seed of the search.
+    :param sampling: sampling and effect arguments of simulate_mannwhitney.
+    :return: A dictionary with n, simulations, power, ci_left, ci_right and decision
+    ('above', 'below', or 'unclear' when the cap was reached first).
+    """
+    done = significant = batch = 0
+    sizes = [min(SIMULATIONS_PER_TASK, batch_size - start) for start in range(0, batch_size, SIMULATIONS_PER_TASK)]
+    while True:
+        tasks = [dict(lift=lift, n=n, simulations=size, random_state=seed_sequence(random_state, n, lift, batch, i),
+                      **sampling)
+                 for i, size in enumerate(sizes)]
+        p_values = np.concatenate(executor.map_cells(simulate_mannwhitney, tasks, data))
+        done += len(p_values)
+        significant += int((p_values < alpha).sum())
+        batch += 1
+        ci_left, ci_right = (float(v) for v in proportion_ci(significant, done, confidence))
+        if ci_right < target:
+            decision = 'below'
+        elif ci_left >= target:
+            decision = 'above'
+        elif done >= max_simulations:
+            decision = 'unclear'
+        else:
+            continue
+        return {'n': int(n), 'simulations': done, 'power': significant / done,
+                'ci_left': ci_left, 'ci_right': ci_right, 'decision': decision}
+
+
+@profiled
+def search_size(lift, data, target=0.8, alpha=0.05, min_size=4, max_size=10**7, start=None, tolerance=0.01,
+                confidence=0.95, batch_size=400, max_simulations=10000, n_jobs=-1, random_state=1,
+                executor=None, **sampling):
+    """
+    Finds the minimal total sample size at which the Mann-Whitney test reaches the target power.
+
+    Starts from the analytic t-test size, brackets the crossing point by doubling or halving the size and
+    then bisects the bracket. Each size is simulated only until its power is clearly above or below the target,
+    so most simulations are spent near the crossing point.
+
+    :param lift: Lift applied to the test group.
+    :param data: Source sample.
+    :param target: Target power.
+    :param alpha: Significance level of the test.
+    :param min_size: Smallest size considered.
+    :param max_size: Largest size considered.
+    :param start: First size to evaluate. By default the analytic t-test size for the mean and deviation of data.
+    :param tolerance: Bisection stops when the bracket is narrower than this share of its upper end.
+    :param confidence: Confidence level of the power intervals.
+    :param batch_size: Number of simulations between two checks of one size.
+    :param max_simulations: Cap on the number of simulations per size.
+    :param n_jobs: Number of workers of the temporary executor used when executor is None.
+    :param random_state: Integer seed of the search.
+    :param executor: Optional lib.executor.SimulationExecutor to run the simulations on a persistent worker pool.
+    :param sampling: sampling and effect arguments of simulate_mannwhitney.
+    :return: A dictionary with the minimal size found (size), its interpolated estimate, the interval
+    [ci_left, ci_right] of sizes where the power cannot be told apart from the target, and the log
+    of the evaluated sizes as a DataFrame.
+    """
+    if start is None:
+        mean, std = float(np.mean(data)), float(np.std(data))
+        start = 2 * size_for_mde(lift, alpha, target, 't-test', mean, std).item()
+    start = int(np.clip(start, min_size, max_size))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = SimulationExecutor(n_jobs=n_jobs)
+    log = {}
+
+    def evaluate(n):
+        if n not in log:
+            log[n] = evaluate_size(n, lift, data, target, executor, alpha, confidence, batch_size,
+                                   max_simulations, random_state, **sampling)
+        return log[n]
+
+    def reached(n):
+        res = evaluate(n)
+        return res['decision'] == 'above' or (res['decision'] == 'unclear' and res['power'] >= target)
+
+    try:
+        low, high = None, None
+        if reached(start):
+            high = start
+            while high > min_size:
+                candidate = max(min_size, high // 2)
+                if not reached(candidate):
+                    low = candidate
+                    break
+                high = candidate
+        else:
+            low = start
+            while low < max_size:
+                candidate = min(max_size, low * 2)
+                if reached(candidate):
+                    high = candidate
+                    break
+                low = candidate
+
+        if low is not None and high is not None:
+            while high - low > max(1, tolerance * high):
+                middle = (low + high) // 2
+                if reached(middle):
+                    high = middle
+                else:
+                    low = middle
+    finally:
+        if own_executor:
+            executor.close()
+
+    table = pd.DataFrame(list(log.values())).sort_values('n').reset_index(drop=True)
+    if high is None:
+        estimate = np.nan
+    elif low is None:
+        estimate = float(high)
+    else:
+        power_low, power_high = log[low]['power'], log[high]['power']
+        share = (target - power_low) / (power_high - power_low) if power_high > power_low else 1.0
+        estimate = low + float(np.clip(share, 0, 1)) * (high - low)
+
+    below = table.loc[table['decision'] == 'below', 'n']
+    above = table.loc[table['decision'] == 'above', 'n']
+    return {
+        'size': high,
+        'estimate': estimate,
+        'ci_left': int(below.max()) if len(below) else int(table['n'].min()),
+        'ci_right': int(above.min()) if len(above) else int(table['n'].max()),
+        'log': table,
+    }
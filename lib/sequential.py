@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from lib.validation import ttest_batch, ztest_batch
+
+
+GROUP_COLUMNS = ['count', 'mean', 'm2']
+SPENDING = ['obrien-fleming', 'pocock']
+
+
+def init_state(experiments, planned_size=np.nan):
+    """
+    Creates an empty sequential-testing state, one row per experiment.
+
+    The state holds only accumulated sufficient statistics and a few running values, so its size does not
+    depend on the number of looks.
+
+    :param experiments: Experiment ids (or an index, e.g. of (experiment, metric) pairs).
+    :param planned_size: Planned total size of both groups per experiment, used as the information horizon
+    of alpha spending. A scalar or one value per experiment; without it only the mSPRT is evaluated.
+    :return: A DataFrame indexed by experiment.
+    """
+    index = experiments if isinstance(experiments, pd.Index) else pd.Index(experiments, name='experiment')
+    state = pd.DataFrame(index=index)
+    for group in ('control', 'test'):
+        for column in GROUP_COLUMNS:
+            state[f'{column}_{group}'] = 0.0
+    state['planned_size'] = np.array(np.broadcast_to(np.asarray(planned_size, dtype=float), len(index)))
+    state['looks'] = 0
+    state['alpha_spent'] = 0.0
+    state['always_valid_p_value'] = 1.0
+    state['rejected'] = False
+    return state
+
+
+def conversion_increment(size_control, successes_control, size_test, successes_test, index=None):
+    """
+    Converts daily conversion counts into the count/mean/m2 layout of a state increment.
+
+    :return: A DataFrame with the columns count, mean and m2 of both groups.
+    """
+    res = pd.DataFrame(index=index)
+    for group, size, successes in (('control', size_control, successes_control),
+                                   ('test', size_test, successes_test)):
+        size, successes = np.asarray(size, dtype=float), np.asarray(successes, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(size > 0, successes / size, 0.0)
+        res[f'count_{group}'], res[f'mean_{group}'], res[f'm2_{group}'] = size, rate, size * rate * (1 - rate)
+    return res
+
+
+def stats_increment(stats, control='control', test='test'):
+    """
+    Converts an accumulator table of lib.ingest into a state increment indexed by (experiment, metric).
+
+    :param stats: Accumulator table with the columns count, mean and m2.
+    :param control: Name of the control variant.
+    :param test: Name of the test variant.
+    :return: A DataFrame with the columns count, mean and m2 of both groups.
+    """
+    wide = stats[GROUP_COLUMNS].unstack('variant')
+    res = pd.DataFrame(index=wide.index)
+    for group, variant in (('control', control), ('test', test)):
+        for column in GROUP_COLUMNS:
+            res[f'{column}_{group}'] = wide[(column, variant)]
+    return res.fillna(0.0)
+
+
+def spending_function(information, alpha, kind='obrien-fleming'):
+    """
+    Lan-DeMets alpha spending: the share of alpha that may be spent by a given information fraction.
+
+    :param information: Information fraction(s) between 0 and 1.
+    :param alpha: Overall significance level.
+    :param kind: 'obrien-fleming' or 'pocock'.
+    :return: Cumulative alpha spent.
+    """
+    information = np.clip(np.asarray(information, dtype=float), 0, 1)
+    if kind == 'obrien-fleming':
+        with np.errstate(divide='ignore'):
+            return np.where(information > 0, 2 * norm.sf(norm.isf(alpha / 2) / np.sqrt(information)), 0.0)
+    elif kind == 'pocock':
+        return alpha * np.log(1 + (np.e - 1) * information)
+    raise ValueError(f'kind must be one of {SPENDING}')
+
+
+def update_state(state, increment, alpha=0.05, criteria='t-test', alternative='two-sided',
+                 spending='obrien-fleming', effect_size=0.1):
+    """
+    Adds new aggregates to the state of many experiments at once and re-evaluates both sequential tests.
+
+    Every update merges the increment with Chan's parallel Welford formulas and computes the new look from
+    the merged statistics only, so it costs O(1) per experiment whatever the length of the history.
+
+    Group-sequential test: the nominal level of a look is the alpha spent since the previous look
+    (a conservative boundary that needs no recursion over earlier looks).
+    mSPRT: the always-valid p-value is the running minimum of 1 / Lambda, where Lambda is the normal mixture
+    likelihood ratio with mixing standard deviation effect_size * pooled standard deviation.
+
+    :param state: State returned by init_state or a previous update_state.
+    :param increment: DataFrame indexed like (a subset of) the state with the columns count, mean and m2 of
+    both groups, e.g. from stats_increment or conversion_increment.
+    :param alpha: Overall significance level.
+    :param criteria: 't-test' or 'z-test'; decides which fixed-horizon test reports the effects and p-value.
+    :param alternative: Specifies the alternative hypothesis of the fixed-horizon test.
+    :param spending: Alpha spending function, 'obrien-fleming' or 'pocock'.
+    :param effect_size: Mixing standard deviation of the mSPRT in units of the pooled standard deviation.
+    :return: A tuple (new state, DataFrame of the current look with the test result columns,
+    nominal_alpha, always_valid_p_value, rejected_gs and rejected_msprt).
+    """
+    state = state.copy()
+    increment = increment.reindex(state.index).fillna(0.0)
+    for group in ('control', 'test'):
+        count_a, mean_a, m2_a = (state[f'{c}_{group}'].to_numpy() for c in GROUP_COLUMNS)
+        count_b, mean_b, m2_b = (increment[f'{c}_{group}'].to_numpy(dtype=float) for c in GROUP_COLUMNS)
+        count = count_a + count_b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(count > 0, count_b / count, 0.0)
+        delta = mean_b - mean_a
+        state[f'count_{group}'] = count
+        state[f'mean_{group}'] = mean_a + delta * share
+        state[f'm2_{group}'] = m2_a + m2_b + delta**2 * count_a * share
+
+    count_c, mean_c, m2_c = (state[f'{c}_control'].to_numpy() for c in GROUP_COLUMNS)
+    count_t, mean_t, m2_t = (state[f'{c}_test'].to_numpy() for c in GROUP_COLUMNS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_c, var_t = m2_c / (count_c - 1), m2_t / (count_t - 1)
+    if criteria == 't-test':
+        res = ttest_batch(mean_c, mean_t, np.sqrt(var_c), np.sqrt(var_t), count_c, count_t, alpha, alternative)
+    elif criteria == 'z-test':
+        res = ztest_batch(count_t, count_c, mean_t * count_t, mean_c * count_c, alpha, alternative)
+    else:
+        raise ValueError("criteria must be 't-test' or 'z-test'")
+
+    # group-sequential boundary from the alpha spent since the previous look
+    looked = (increment[[f'count_{g}' for g in ('control', 'test')]].to_numpy(dtype=float).sum(axis=1) > 0)
+    planned = state['planned_size'].to_numpy()
+    has_plan = ~np.isnan(planned)
+    previous = state['alpha_spent'].to_numpy()
+    information = np.where(has_plan, (count_c + count_t) / np.where(has_plan, planned, 1.0), 0.0)
+    spent = np.where(has_plan, np.maximum(spending_function(information, alpha, spending), previous), previous)
+    nominal_alpha = np.where(looked & has_plan, spent - previous, np.nan)
+
+    # mSPRT with a normal mixture over the difference of means
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        variance = var_c / count_c + var_t / count_t
+        pooled = ((count_c - 1) * var_c + (count_t - 1) * var_t) / (count_c + count_t - 2)
+        tau2 = effect_size**2 * pooled
+        log_lambda = 0.5 * np.log(variance / (variance + tau2)) + \
+            tau2 * (mean_t - mean_c)**2 / (2 * variance * (variance + tau2))
+        p_msprt = np.where(np.isfinite(log_lambda), np.minimum(1.0, np.exp(-log_lambda)), 1.0)
+    always_valid = np.minimum(state['always_valid_p_value'].to_numpy(), p_msprt)
+
+    rejected_gs = looked & has_plan & (res['p_value'] < np.nan_to_num(nominal_alpha))
+    state['looks'] += looked.astype(int)
+    state['alpha_spent'] = np.where(looked, spent, previous)
+    state['always_valid_p_value'] = always_valid
+    state['rejected'] = state['rejected'] | rejected_gs | (always_valid < alpha)
+
+    look = pd.DataFrame(res, index=state.index)
+    look['nominal_alpha'] = nominal_alpha
+    look['always_valid_p_value'] = always_valid
+    look['rejected_gs'] = rejected_gs
+    look['rejected_msprt'] = always_valid < alpha
+    return state, look
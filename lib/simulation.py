@@ -0,0 +1,375 @@
+import numpy as np
+import pandas as pd
+from itertools import product
+from scipy.special import ndtr, ndtri
+from lib.cache import params_key, data_key, cell_key
+from lib.executor import SimulationExecutor
+from lib.rng import make_rng, seed_sequence, uniform_into
+from lib.profiling import profiled, stage
+
+
+# upper bound on the number of elements of one (simulations x 2n) work matrix
+MAX_CHUNK_ELEMENTS = 2**22
+
+SAMPLINGS = ['prefix', 'bootstrap']
+EFFECTS = ['multiplicative', 'additive']
+
+
+def mannwhitney_pvalues(control, test, is_control):
+    """
+    Two-sided Mann-Whitney U test p-values for many random splits of paired samples at once.
+
+    Split k takes control[i] into the first group where is_control[k, i] is True and test[i]
+    into the second group otherwise. The pooled control and test values are sorted once and the
+    rank of each chosen value inside its split is recovered with a cumulative count, so every
+    split is tested in one array operation. Uses the normal approximation with tie and
+    continuity correction, as scipy.stats.mannwhitneyu does for large samples.
+
+    :param control: Control values, 1-D array of length n.
+    :param test: Test values, 1-D array of length n.
+    :param is_control: Boolean matrix of shape (simulations, n) describing the splits.
+    :return: Array of p-values, one per split.
+    """
+    n = len(control)
+    pooled = np.concatenate([control, test])
+    order = np.argsort(pooled, kind='mergesort')
+    sorted_values = pooled[order]
+
+    # chosen[k, j] - whether the j-th smallest pooled value belongs to split k
+    chosen = np.concatenate([is_control, ~is_control], axis=1)[:, order]
+    chosen_control = chosen & (order < n)
+
+    n1 = is_control.sum(axis=1).astype(float)
+    n2 = n - n1
+
+    starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    if len(starts) == len(sorted_values):
+        ranks = np.cumsum(chosen, axis=1, dtype=np.int64)
+        rank_sum = (ranks * chosen_control).sum(axis=1, dtype=float)
+        tie_term = 0.0
+    else:
+        group_count = np.add.reduceat(chosen, starts, axis=1, dtype=np.int64)
+        group_count_control = np.add.reduceat(chosen_control, starts, axis=1, dtype=np.int64)
+        average_rank = np.cumsum(group_count, axis=1) - (group_count - 1) / 2
+        rank_sum = (average_rank * group_count_control).sum(axis=1)
+        tie_term = (group_count**3 - group_count).sum(axis=1)
+
+    u1 = rank_sum - n1 * (n1 + 1) / 2
+    u = np.maximum(u1, n1 * n2 - u1)
+    mu = n1 * n2 / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u - mu - 0.5) / s
+    p_value = np.clip(2 * ndtr(-z), 0, 1)
+    p_value[(n1 == 0) | (n2 == 0)] = np.nan
+    return p_value
+
+
+def mannwhitney_pvalues_rows(control, test):
+    """
+    Two-sided Mann-Whitney U test p-values for many independent pairs of samples, one pair per row.
+
+    Every row of the pooled matrix is sorted once; tied values get the average of the positions of their run,
+    found with running maximum/minimum over the run starts and ends. Uses the same normal approximation
+    with tie and continuity correction as mannwhitney_pvalues.
+
+    :param control: Matrix of shape (simulations, n1).
+    :param test: Matrix of shape (simulations, n2).
+    :return: Array of p-values, one per row.
+    """
+    n1, n2 = control.shape[1], test.shape[1]
+    n = n1 + n2
+    pooled = np.concatenate([control, test], axis=1)
+    order = np.argsort(pooled, axis=1, kind='mergesort')
+    sorted_values = np.take_along_axis(pooled, order, axis=1)
+
+    positions = np.broadcast_to(np.arange(n), pooled.shape)
+    new_run = np.ones(pooled.shape, dtype=bool)
+    new_run[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    end_run = np.ones(pooled.shape, dtype=bool)
+    end_run[:, :-1] = new_run[:, 1:]
+    first = np.maximum.accumulate(np.where(new_run, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(end_run, positions, n - 1)[:, ::-1], axis=1)[:, ::-1]
+    average_rank = (first + last) / 2 + 1
+    run_length = last - first + 1
+
+    rank_sum = (average_rank * (order < n1)).sum(axis=1)
+    # every member of a run of length t adds t^2 - 1, so a run adds t^3 - t
+    tie_term = (run_length.astype(float)**2 - 1).sum(axis=1)
+
+    u1 = rank_sum - n1 * (n1 + 1) / 2
+    u = np.maximum(u1, n1 * n2 - u1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - 0.5) / s
+    return np.clip(2 * ndtr(-z), 0, 1)
+
+
+def apply_effect(values, lift, effect='multiplicative', baseline=None):
+    """
+    Injects the effect into the test values.
+
+    :param values: Test values.
+    :param lift: Lift of the test group mean over the control mean.
+    :param effect: 'multiplicative' scales every value by lift; 'additive' shifts every value by
+    (lift - 1) * baseline, which moves the mean by the same amount but keeps the spread.
+    :param baseline: Mean of the source data, required for the additive effect.
+    :return: Test values with the effect.
+    """
+    if effect == 'multiplicative':
+        return values * lift
+    elif effect == 'additive':
+        return values + (lift - 1) * baseline
+    raise ValueError(f'effect must be one of {EFFECTS}')
+
+
+@profiled
+def simulate_mannwhitney(lift, n, data, simulations=1000, chunk_size=None, random_state=None,
+                         sampling='prefix', effect='multiplicative', baseline=None):
+    """
+    Simulates the Mann-Whitney test between a control sample and a test sample with an injected lift.
+
+    With sampling='prefix' the test compares data[0:n] and data[0:n] with the effect under random 50/50 splits,
+    so all simulations share the same n values. With sampling='bootstrap' every simulation draws fresh control
+    and test samples of n / 2 values each from the whole data by index, with replacement, which only reads
+    the drawn elements of a memory-mapped array.
+
+    Work is generated as a (simulations x n) matrix and processed in chunks, so memory stays bounded for large n.
+
+    :param lift: Lift applied to the test group.
+    :param n: Number of observations per simulation, both groups together.
+    :param data: Source sample, e.g. a numpy memmap of historical data.
+    :param simulations: Number of simulations.
+    :param chunk_size: Number of simulations processed at once. By default it is derived from MAX_CHUNK_ELEMENTS.
+    :param random_state: Seed or numpy Generator used to draw the splits or subsamples.
+    :param sampling: 'prefix' or 'bootstrap'.
+    :param effect: 'multiplicative' or 'additive', see apply_effect.
+    :param baseline: Mean of data for the additive effect; computed from data when None.
+    :return: Array of p-values, one per simulation.
+    """
+    if sampling not in SAMPLINGS:
+        raise ValueError(f'sampling must be one of {SAMPLINGS}')
+    rng = make_rng(random_state)
+    if effect == 'additive' and baseline is None:
+        baseline = float(np.mean(data))
+
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // (2 * max(n, 1)))
+    p_values = np.empty(simulations)
+
+    if sampling == 'bootstrap':
+        n1 = n // 2
+        for start in range(0, simulations, chunk_size):
+            stop = min(start + chunk_size, simulations)
+            index = rng.integers(0, len(data), (stop - start, n))
+            drawn = np.asarray(data[index.ravel()], dtype=float).reshape(index.shape)
+            p_values[start:stop] = mannwhitney_pvalues_rows(drawn[:, :n1],
+                                                            apply_effect(drawn[:, n1:], lift, effect, baseline))
+        return p_values
+
+    control = np.asarray(data[0:n], dtype=float)
+    test = apply_effect(control, lift, effect, baseline)
+    n = len(control)
+    # one uniform buffer is reused by all chunks
+    uniforms = np.empty((min(chunk_size, simulations), n))
+    for start in range(0, simulations, chunk_size):
+        stop = min(start + chunk_size, simulations)
+        is_control = uniform_into(rng, uniforms[:stop - start]) < 0.5
+        p_values[start:stop] = mannwhitney_pvalues(control, test, is_control)
+    return p_values
+
+
+@profiled
+def simulate_mannwhitney_adaptive(lift, n, data, alpha=0.05, tolerance=0.02, confidence=0.95,
+                                  batch_size=200, max_simulations=10000, random_state=None, **sampling):
+    """
+    Runs simulate_mannwhitney in batches until the confidence interval of the cell's power is narrower than tolerance.
+
+    Cells with power near 0 or 1 stop after a few batches, borderline cells run up to max_simulations.
+
+    :param lift: Multiplicative effect applied to the test group.
+    :param n: Number of observations taken from data.
+    :param data: Source sample.
+    :param alpha: Significance level used to count a simulation as a detection.
+    :param tolerance: Target width of the confidence interval of the power.
+    :param confidence: Confidence level of the interval.
+    :param batch_size: Number of simulations between two stopping checks.
+    :param max_simulations: Cap on the number of simulations.
+    :param random_state: Seed or numpy Generator used to draw the splits.
+    :param sampling: sampling, effect and baseline arguments of simulate_mannwhitney.
+    :return: Array of p-values; its length is the number of simulations actually run.
+    """
+    rng = make_rng(random_state)
+    p_values = []
+    done = significant = 0
+    while done < max_simulations:
+        size = min(batch_size, max_simulations - done)
+        batch = simulate_mannwhitney(lift, n, data, size, random_state=rng, **sampling)
+        p_values.append(batch)
+        done += size
+        significant += (batch < alpha).sum()
+        ci_left, ci_right = proportion_ci(significant, done, confidence)
+        if ci_right - ci_left < tolerance:
+            break
+    return np.concatenate(p_values)
+
+
+def proportion_ci(successes, total, confidence=0.95):
+    """
+    Wilson score interval of a proportion; stays inside [0, 1] and behaves well near the bounds.
+
+    :param successes: Number or array of successes.
+    :param total: Number or array of trials.
+    :param confidence: Confidence level of the interval.
+    :return: A tuple (left bound, right bound).
+    """
+    successes, total = np.asarray(successes, dtype=float), np.asarray(total, dtype=float)
+    z = ndtri(1 - (1 - confidence) / 2)
+    share = successes / total
+    center = (share + z**2 / (2 * total)) / (1 + z**2 / total)
+    margin = z / (1 + z**2 / total) * np.sqrt(share * (1 - share) / total + z**2 / (4 * total**2))
+    return center - margin, center + margin
+
+
+def cell_seed(random_state, lift, n):
+    """
+    Derives the seed of a (lift, n) cell from the grid seed and the cell itself,
+    so a cell gets the same splits whatever grid it is part of.
+
+    The cell is normalized with lib.cache.cell_key, so lifts that differ only by float noise, and therefore
+    share a cache entry, also share a random stream.
+
+    :param random_state: Integer seed of the grid, or None for fresh entropy.
+    :param lift: Lift of the cell.
+    :param n: Sample size of the cell.
+    :return: numpy SeedSequence of the cell.
+    """
+    return seed_sequence(random_state, *cell_key(lift, n))
+
+
+def simulate_grid(lifts, sizes, data, simulations=1000, n_jobs=-1, random_state=None, cache=None,
+                  tolerance=None, alpha=0.05, batch_size=200, executor=None, sampling='prefix',
+                  effect='multiplicative'):
+    """
+    Runs simulate_mannwhitney for every (lift, n) cell of the grid in parallel.
+
+    :param lifts: Lifts to simulate.
+    :param sizes: Sample sizes to simulate.
+    :param data: Source sample.
+    :param simulations: Number of simulations per cell, or the cap on it in adaptive mode.
+    :param n_jobs: Number of workers of the temporary executor used when executor is None.
+    :param random_state: Integer seed from which an independent seed for every cell is derived.
+    :param cache: Optional lib.cache.SimulationCache. Cached cells are loaded and only missing cells are simulated.
+    Ignored when random_state is None, since such results are not reproducible.
+    :param tolerance: If set, every cell runs in adaptive mode (see simulate_mannwhitney_adaptive)
+    until the confidence interval of its power is narrower than tolerance.
+    :param alpha: Significance level used by the adaptive stopping rule.
+    :param batch_size: Number of simulations between two stopping checks in adaptive mode.
+    :param executor: Optional lib.executor.SimulationExecutor to run the cells on a persistent worker pool.
+    :param sampling: 'prefix' or 'bootstrap', see simulate_mannwhitney.
+    :param effect: 'multiplicative' or 'additive', see apply_effect.
+    :return: A DataFrame with the columns lift, n and pvalue, one row per simulation.
+    """
+    results = {}
+    for finished in iter_simulate_grid(lifts, sizes, data, simulations, n_jobs, random_state, cache,
+                                       tolerance, alpha, batch_size, executor, sampling=sampling, effect=effect):
+        results.update(finished)
+    return grid_frame(list(product(lifts, sizes)), results)
+
+
+def iter_simulate_grid(lifts, sizes, data, simulations=1000, n_jobs=-1, random_state=None, cache=None,
+                       tolerance=None, alpha=0.05, batch_size=200, executor=None, group_size=None,
+                       sampling='prefix', effect='multiplicative'):
+    """
+    Same as simulate_grid, but yields the cells as they finish: first the cached ones,
+    then the simulated ones in groups of group_size cells, each group saved to the cache right away.
+
+    Stopping the iteration between two groups leaves no work running.
+
+    :param group_size: Number of cells simulated per group. None simulates all missing cells in one group.
+    Other parameters are the same as in simulate_grid.
+    :return: Iterator over dictionaries {(lift, n): p-values}.
+    """
+    cells = list(product(lifts, sizes))
+    results = {}
+    if cache is not None and random_state is not None:
+        adaptive = None if tolerance is None else (tolerance, alpha, batch_size)
+        key = params_key(data=data_key(data), test='mannwhitney', seed=random_state,
+                         simulations=simulations, adaptive=adaptive, sampling=sampling, effect=effect)
+        with stage('simulation.cache_get'):
+            results = cache.get_many(key, cells)
+    if results:
+        yield results
+
+    missing = [cell for cell in cells if cell not in results]
+    if not missing:
+        return
+    # the simulated lift is the normalized one of the cache key, so a cached cell equals a fresh run bit for bit
+    lifts_used = {cell: float(cell_key(*cell)[0]) for cell in missing}
+    # the mean of a large source sample is computed once here rather than in every cell
+    baseline = float(np.mean(data)) if effect == 'additive' else None
+    if tolerance is None:
+        func = simulate_mannwhitney
+        tasks = [dict(lift=lifts_used[lift, n], n=n, simulations=simulations,
+                      random_state=cell_seed(random_state, lift, n),
+                      sampling=sampling, effect=effect, baseline=baseline)
+                 for lift, n in missing]
+    else:
+        func = simulate_mannwhitney_adaptive
+        tasks = [dict(lift=lifts_used[lift, n], n=n, alpha=alpha, tolerance=tolerance, batch_size=batch_size,
+                      max_simulations=simulations, random_state=cell_seed(random_state, lift, n),
+                      sampling=sampling, effect=effect, baseline=baseline)
+                 for lift, n in missing]
+    costs = [n * simulations for _, n in missing]
+    group_size = len(missing) if group_size is None else max(1, group_size)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = SimulationExecutor(n_jobs=n_jobs)
+    try:
+        for start in range(0, len(missing), group_size):
+            stop = start + group_size
+            with stage('simulation.group'):
+                p_values = executor.map_cells(func, tasks[start:stop], data, costs[start:stop])
+            computed = dict(zip(missing[start:stop], p_values))
+            if cache is not None and random_state is not None:
+                with stage('simulation.cache_put'):
+                    cache.put_many(key, computed)
+            yield computed
+    finally:
+        if own_executor:
+            executor.close()
+
+
+@profiled
+def grid_frame(cells, results):
+    """
+    Builds the simulate_grid result from the p-values of the cells; cells without results are skipped.
+
+    :param cells: List of (lift, n) pairs in output order.
+    :param results: A dictionary {(lift, n): p-values}.
+    :return: A DataFrame with the columns lift, n and pvalue, one row per simulation.
+    """
+    cells = [cell for cell in cells if cell in results]
+    counts = [len(results[cell]) for cell in cells]
+    return pd.DataFrame({
+        'lift': np.repeat([lift for lift, _ in cells], counts),
+        'n': np.repeat([n for _, n in cells], counts),
+        'pvalue': np.concatenate([results[cell] for cell in cells]) if cells else np.empty(0),
+    })
+
+
+@profiled
+def calculate_tpr(sim_res, alpha=0.05, confidence=0.95):
+    """
+    Calculates the share of significant simulations for every (lift, n) cell.
+
+    :param sim_res: DataFrame returned by simulate_grid.
+    :param alpha: Significance level.
+    :param confidence: Confidence level of the interval around the share.
+    :return: A DataFrame with the columns lift, n, tpr, simulations, ci_left and ci_right.
+    """
+    significant = (sim_res['pvalue'] < alpha).groupby([sim_res['lift'], sim_res['n']])
+    res = pd.DataFrame({'tpr': significant.mean(), 'simulations': significant.size()}).reset_index()
+    res['ci_left'], res['ci_right'] = proportion_ci(res['tpr'] * res['simulations'], res['simulations'], confidence)
+    return res
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+from math import comb
+from itertools import combinations
+from functools import lru_cache
+from scipy.stats import chi2
+from scipy.special import gammaln
+
+
+# experiments with at most this many users in total are tested with the exact multinomial test
+EXACT_MAX_TOTAL = 30
+# the exact test enumerates C(total + k - 1, k - 1) outcomes; beyond this many it falls back to chi-square
+EXACT_MAX_OUTCOMES = 200_000
+
+
+def srm_pvalues(observed, weights, exact_max_total=EXACT_MAX_TOTAL):
+    """
+    Sample ratio mismatch p-values for many experiments with k variants in one pass.
+
+    Uses Pearson's chi-square goodness-of-fit test against the planned weights, and the exact multinomial
+    test for experiments with at most exact_max_total users, where the chi-square approximation is poor,
+    as long as there are at most EXACT_MAX_OUTCOMES possible outcomes to enumerate.
+
+    Variants with a planned weight of zero only count through their users: any user in such a variant
+    is a mismatch with p-value 0.
+
+    :param observed: Array of shape (experiments, k) with the number of users per variant.
+    :param weights: Planned weights of the variants, shape (k,) or (experiments, k); normalized to sum to 1.
+    :param exact_max_total: Largest total count tested exactly. 0 disables the exact test.
+    :return: Array of p-values, one per experiment.
+    """
+    observed = np.atleast_2d(np.asarray(observed, dtype=float))
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), observed.shape)
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    planned = weights > 0
+
+    total = observed.sum(axis=1)
+    expected = weights * total[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = np.where(planned, (observed - expected)**2 / expected, 0).sum(axis=1)
+    dof = planned.sum(axis=1) - 1
+    p_value = np.where(dof > 0, chi2.sf(statistic, np.maximum(dof, 1)), 1.0)
+    p_value[total == 0] = np.nan
+
+    unplanned = ((observed > 0) & ~planned).any(axis=1)
+    exact = (total > 0) & (total <= exact_max_total) & ~unplanned
+    for row in np.flatnonzero(exact):
+        if comb(int(total[row]) + int(dof[row]), int(dof[row])) <= EXACT_MAX_OUTCOMES:
+            p_value[row] = _multinomial_exact(observed[row, planned[row]].astype(int), weights[row, planned[row]])
+    p_value[unplanned] = 0.0
+    return p_value
+
+
+@lru_cache(maxsize=64)
+def _compositions(total, k):
+    """
+    All ways to put total users into k variants, as an array of shape (combinations, k).
+    """
+    bars = np.array(list(combinations(range(total + k - 1), k - 1)), dtype=int).reshape(-1, k - 1)
+    edges = np.hstack([np.full((len(bars), 1), -1), bars, np.full((len(bars), 1), total + k - 1)])
+    return np.diff(edges, axis=1) - 1
+
+
+def _multinomial_exact(observed, weights):
+    """
+    Exact multinomial test: the probability of all outcomes not more likely than the observed one.
+    """
+    outcomes = _compositions(int(observed.sum()), len(observed))
+    # variants with zero weight are left out by srm_pvalues, so every weight is positive here
+    log_weights = np.log(weights)
+    log_pmf = gammaln(outcomes.sum(axis=1) + 1) - gammaln(outcomes + 1).sum(axis=1) + \
+        np.where(outcomes > 0, outcomes * log_weights, 0).sum(axis=1)
+    log_observed = gammaln(observed.sum() + 1) - gammaln(observed + 1).sum() + \
+        np.where(observed > 0, observed * log_weights, 0).sum()
+    return min(1.0, np.exp(log_pmf[log_pmf <= log_observed + 1e-7]).sum())
+
+
+def srm_frame(counts, weights, alpha=0.001, window=None, exact_max_total=EXACT_MAX_TOTAL):
+    """
+    Checks SRM for every experiment and daily slice on cumulative (or rolling) counts.
+
+    :param counts: DataFrame indexed by (experiment, date) with one column of daily user counts per variant.
+    :param weights: Planned weights of the variants in the column order of counts.
+    :param alpha: Significance level of the check; SRM checks usually use a strict one.
+    :param window: Number of last days summed for every slice. None sums everything since the start.
+    :param exact_max_total: Largest total count tested exactly.
+    :return: A DataFrame indexed like counts with the summed counts, p_value and srm flag.
+    """
+    counts = counts.sort_index()
+    grouped = counts.groupby(level=0, sort=False)
+    if window is None:
+        summed = grouped.cumsum()
+    else:
+        summed = grouped.rolling(window, min_periods=1).sum().droplevel(0)
+    res = summed.copy()
+    res['p_value'] = srm_pvalues(summed.to_numpy(), weights, exact_max_total)
+    res['srm'] = res['p_value'] < alpha
+    return res
+
+
+def init_srm_state(experiments, variants):
+    """
+    Creates an empty incremental SRM state with cumulative counts per experiment and variant.
+
+    :param experiments: Experiment ids.
+    :param variants: Variant names.
+    :return: A DataFrame indexed by experiment.
+    """
+    state = pd.DataFrame(0.0, index=pd.Index(experiments, name='experiment'), columns=list(variants))
+    state['days'] = 0
+    state['srm'] = False
+    return state
+
+
+def update_srm_state(state, daily, weights, alpha=0.001, exact_max_total=EXACT_MAX_TOTAL):
+    """
+    Adds one day of counts to the cumulative state of many experiments and re-checks SRM.
+
+    Costs O(k) per experiment whatever the number of days seen. The srm flag stays raised once set.
+
+    :param state: State returned by init_srm_state or a previous update_srm_state.
+    :param daily: DataFrame indexed by experiment with one column of counts per variant.
+    :param weights: Planned weights of the variants in the column order of the state.
+    :param alpha: Significance level of the check.
+    :param exact_max_total: Largest total count tested exactly.
+    :return: A tuple (new state, Series of current p-values).
+    """
+    state = state.copy()
+    variants = [c for c in state.columns if c not in ('days', 'srm')]
+    daily = daily.reindex(index=state.index, columns=variants).fillna(0.0)
+    state[variants] += daily
+    state['days'] += (daily.sum(axis=1) > 0).astype(int)
+    p_value = pd.Series(srm_pvalues(state[variants].to_numpy(), weights, exact_max_total), index=state.index)
+    state['srm'] = state['srm'] | (p_value < alpha)
+    return state, p_value
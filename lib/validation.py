@@ -1,12 +1,17 @@
 import numpy as np
-import scipy as sp
-from scipy.stats import norm, beta, ttest_ind_from_stats, t
 from math import ceil
-import statsmodels.stats.api as sms
-import statsmodels.stats.power as smp
+# scipy.special is a fraction of the import cost of scipy.stats; statsmodels and pandas are imported
+# by the functions that need them
+from scipy.special import ndtr, ndtri, stdtr
+from lib.bayesian import prob_greater, expected_loss, uplift_credible_interval
+from lib.memo import memoize
+from lib.profiling import profiled
 
 
+@memoize
+@profiled
 def sample_size_calc_ttest(alpha, power, lift, ratio, alternative, mean, std):
+    import statsmodels.stats.power as smp
     mean_control = mean
     mean_test = mean_control * lift
 
@@ -28,11 +33,15 @@ def sample_size_calc_ttest(alpha, power, lift, ratio, alternative, mean, std):
     return res
 
 
+@memoize
+@profiled
 def sample_size_calc_ztest(alpha, power, lift, ratio, alternative, mean):
+    import statsmodels.stats.power as smp
+    from statsmodels.stats.proportion import proportion_effectsize
     mean_control = mean
     mean_test = mean_control * lift
 
-    effect_size = sms.proportion_effectsize(mean_test, mean_control)
+    effect_size = proportion_effectsize(mean_test, mean_control)
     nobs1 = ceil(smp.zt_ind_solve_power(effect_size=effect_size, nobs1=None,
                                         alpha=alpha, power=power, alternative=alternative))
     nobs2 = ceil(nobs1 * ratio)
@@ -70,6 +79,8 @@ def check_sample_ratio(control_fact, test_fact, ratio_plan):
     return calculate_p_value_from_z_score(z)
 
 
+@memoize
+@profiled
 def ttest(mean_control, mean_test, std_control, std_test, size_control, size_test, alpha, alternative):
     """
     Calculates the p-value, significance level, relative and absolute effects,
@@ -86,40 +97,12 @@ def ttest(mean_control, mean_test, std_control, std_test, size_control, size_tes
     :return: A dictionary containing the p-value, significance level,
     relative and absolute effects, and confidence intervals.
     """
-    var_mean_control = std_control**2 / size_control
-    var_mean_test = std_test**2 / size_test
-
-    # difference_mean = mean_test - mean_control
-    difference_mean_var = var_mean_control + var_mean_test
-    # df = size_control + size_test - 2
-
-    # t_stat = difference_mean / np.sqrt(difference_mean_var)
-    # difference_distribution = t(df=df, loc=difference_mean, scale=np.sqrt(difference_mean_var))
-
-    _, pvalue = ttest_ind_from_stats(mean1=mean_control, std1=std_control, nobs1=size_control,
-                                     mean2=mean_test, std2=std_test, nobs2=size_test,
-                                     equal_var=False, alternative=alternative)
-    p_value = round(pvalue, 4)
-
-    absolute_effect, relative_effect = calculate_effect_sizes(mean_control, mean_test,
-                                                              np.sqrt(difference_mean_var), mean_control)
-    margin_of_error = norm.ppf(1-alpha/2) * np.sqrt(difference_mean_var)
-
-    ci_left_abs, ci_right_abs = calculate_confidence_interval(absolute_effect, margin_of_error)
-    ci_left_rel, ci_right_rel = calculate_confidence_interval(relative_effect, margin_of_error / mean_control)
-
-    return {
-        'p_value': p_value,
-        'significance_level': 1-alpha,
-        'relative_effect': relative_effect,
-        'ci_left_rel': ci_left_rel,
-        'ci_right_rel': ci_right_rel,
-        'absolute_effect': absolute_effect,
-        'ci_left_abs': ci_left_abs,
-        'ci_right_abs': ci_right_abs,
-    }
+    res = ttest_batch(mean_control, mean_test, std_control, std_test, size_control, size_test, alpha, alternative)
+    return _round_result(res, mean_control, round_p_value=True)
 
 
+@memoize
+@profiled
 def ztest(z_size_test, z_size_control, success_test, success_control, alpha, alternative):
     """
     Calculates the p-value, significance level, relative and absolute effects,
@@ -134,24 +117,166 @@ def ztest(z_size_test, z_size_control, success_test, success_control, alpha, alt
     :return: A dictionary containing the p-value, significance level,
     relative and absolute effects, and confidence intervals.
     """
+    res = ztest_batch(z_size_test, z_size_control, success_test, success_control, alpha, alternative)
+    return _round_result(res, success_control / z_size_control, round_p_value=False)
+
+
+@profiled
+def ttest_batch(mean_control, mean_test, std_control, std_test, size_control, size_test,
+                alpha=0.05, alternative='two-sided'):
+    """
+    Vectorized Welch t-test over many pairs of groups given by their summary statistics.
+
+    Every argument may be a scalar or an array; arrays are broadcast against each other,
+    so one call covers thousands of experiment x metric rows. Nothing is rounded.
+
+    :param mean_control: Means of the control groups.
+    :param mean_test: Means of the test groups.
+    :param std_control: Standard deviations of the control groups.
+    :param std_test: Standard deviations of the test groups.
+    :param size_control: Sample sizes of the control groups.
+    :param size_test: Sample sizes of the test groups.
+    :param alpha: Significance level(s) for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :return: A dictionary with the same keys as ttest, each holding an array with one value per row.
+    """
+    mean_control, mean_test, std_control, std_test, size_control, size_test, alpha = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in
+          (mean_control, mean_test, std_control, std_test, size_control, size_test, alpha)))
+
+    var_mean_control = std_control**2 / size_control
+    var_mean_test = std_test**2 / size_test
+    difference_mean_var = var_mean_control + var_mean_test
+    std_dev = np.sqrt(difference_mean_var)
+
+    # Welch-Satterthwaite degrees of freedom, same as ttest_ind_from_stats(equal_var=False)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df = difference_mean_var**2 / (var_mean_control**2 / (size_control - 1) +
+                                       var_mean_test**2 / (size_test - 1))
+        t_stat = (mean_control - mean_test) / std_dev
+
+    if alternative == 'two-sided':
+        p_value = 2 * stdtr(df, -np.abs(t_stat))
+    elif alternative == 'less':
+        p_value = stdtr(df, t_stat)
+    elif alternative == 'greater':
+        p_value = stdtr(df, -t_stat)
+    else:
+        raise ValueError("alternative must be 'less', 'greater' or 'two-sided'")
+
+    return _effect_result(p_value, alpha, mean_control, mean_test, std_dev)
+
+
+@profiled
+def ztest_batch(z_size_test, z_size_control, success_test, success_control, alpha=0.05, alternative='two-sided'):
+    """
+    Vectorized z-test for proportions over many pairs of groups.
+
+    Every argument may be a scalar or an array; arrays are broadcast against each other.
+    Nothing is rounded.
+
+    :param z_size_test: Sample sizes of the test groups.
+    :param z_size_control: Sample sizes of the control groups.
+    :param success_test: Numbers of successes in the test groups.
+    :param success_control: Numbers of successes in the control groups.
+    :param alpha: Significance level(s) for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater', or 'less'.
+    :return: A dictionary with the same keys as ztest, each holding an array with one value per row.
+    """
+    z_size_test, z_size_control, success_test, success_control, alpha = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in
+          (z_size_test, z_size_control, success_test, success_control, alpha)))
 
     conv_test = success_test / z_size_test
     conv_control = success_control / z_size_control
 
-    pooled_prob = (conv_test * z_size_test + conv_control * z_size_control) / (z_size_test + z_size_control)
+    pooled_prob = (success_test + success_control) / (z_size_test + z_size_control)
     std_dev = np.sqrt(pooled_prob * (1 - pooled_prob) * (1 / z_size_test + 1 / z_size_control))
 
-    z_score = (conv_test - conv_control) / std_dev
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_score = (conv_test - conv_control) / std_dev
     p_value = calculate_p_value_from_z_score(z_score, alternative=alternative)
 
-    absolute_effect, relative_effect = calculate_effect_sizes(conv_control, conv_test, std_dev, conv_control)
-    margin_of_error = norm.ppf(1 - alpha / 2) * std_dev
+    return _effect_result(p_value, alpha, conv_control, conv_test, std_dev)
+
+
+def ttest_frame(df, alpha=0.05, alternative='two-sided'):
+    """
+    Runs ttest_batch over a DataFrame of summary statistics.
+
+    :param df: DataFrame with the columns mean_control, mean_test, std_control, std_test,
+    size_control and size_test; one row per experiment x metric.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :return: A DataFrame with the ttest result columns, indexed like df.
+    """
+    import pandas as pd
+
+    res = ttest_batch(df['mean_control'].to_numpy(), df['mean_test'].to_numpy(),
+                      df['std_control'].to_numpy(), df['std_test'].to_numpy(),
+                      df['size_control'].to_numpy(), df['size_test'].to_numpy(),
+                      alpha, alternative)
+    return pd.DataFrame(res, index=df.index)
+
+
+def ztest_frame(df, alpha=0.05, alternative='two-sided'):
+    """
+    Runs ztest_batch over a DataFrame of conversion counts.
+
+    :param df: DataFrame with the columns z_size_test, z_size_control, success_test and success_control;
+    one row per experiment x metric.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater', or 'less'.
+    :return: A DataFrame with the ztest result columns, indexed like df.
+    """
+    import pandas as pd
+
+    res = ztest_batch(df['z_size_test'].to_numpy(), df['z_size_control'].to_numpy(),
+                      df['success_test'].to_numpy(), df['success_control'].to_numpy(),
+                      alpha, alternative)
+    return pd.DataFrame(res, index=df.index)
+
+
+def _effect_result(p_value, alpha, mean_control, mean_test, std_dev):
+    """
+    Builds the unrounded columnar result shared by ttest_batch and ztest_batch.
+    """
+    absolute_effect = mean_test - mean_control
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_effect = absolute_effect / mean_control
+        margin_of_error = ndtri(1 - alpha / 2) * std_dev
+        margin_of_error_rel = margin_of_error / mean_control
 
-    ci_left_abs, ci_right_abs = calculate_confidence_interval(absolute_effect, margin_of_error)
-    ci_left_rel, ci_right_rel = calculate_confidence_interval(relative_effect, margin_of_error / conv_control)
     return {
         'p_value': p_value,
-        'significance_level': 1-alpha,
+        'significance_level': 1 - alpha,
+        'relative_effect': relative_effect,
+        'ci_left_rel': relative_effect - margin_of_error_rel,
+        'ci_right_rel': relative_effect + margin_of_error_rel,
+        'absolute_effect': absolute_effect,
+        'ci_left_abs': absolute_effect - margin_of_error,
+        'ci_right_abs': absolute_effect + margin_of_error,
+    }
+
+
+def _round_result(res, baseline, round_p_value):
+    """
+    Converts a single-row batch result into the rounded scalar dictionary returned by ttest and ztest.
+
+    :param res: Result of ttest_batch or ztest_batch for one pair of groups.
+    :param baseline: The control mean or conversion the relative effect is measured against.
+    :param round_p_value: Whether the p-value is rounded as well.
+    """
+    absolute_effect, relative_effect = calculate_effect_sizes(0, float(res['absolute_effect']), None, baseline)
+    margin_of_error = float(res['ci_right_abs'] - res['absolute_effect'])
+
+    ci_left_abs, ci_right_abs = calculate_confidence_interval(absolute_effect, margin_of_error)
+    ci_left_rel, ci_right_rel = calculate_confidence_interval(relative_effect, margin_of_error / baseline)
+    p_value = float(res['p_value'])
+
+    return {
+        'p_value': round(p_value, 4) if round_p_value else p_value,
+        'significance_level': float(res['significance_level']),
         'relative_effect': relative_effect,
         'ci_left_rel': ci_left_rel,
         'ci_right_rel': ci_right_rel,
@@ -161,18 +286,180 @@ def ztest(z_size_test, z_size_control, success_test, success_control, alpha, alt
     }
 
 
-def bayes(trials_control, successes_control, trials_test, successes_test):
-    alpha_prior = 1 + successes_control
-    beta_prior = 1 + trials_control - successes_control
-    alpha_posterior, beta_posterior = alpha_prior + successes_test, beta_prior + trials_test - successes_test
-    # mode_posterior = (alpha_posterior - 1) / (alpha_posterior + beta_posterior - 2)
+@profiled
+def mannwhitney(control, test, alpha=0.05, alternative='two-sided', edges=None):
+    """
+    Calculates the p-value of the Mann-Whitney U test on raw samples, with the effects and
+    confidence intervals of the difference in means.
+
+    Without edges the test is exact up to the normal approximation: the pooled sample is sorted once
+    (O(n log n)) and ties get average ranks with the tie correction of the variance.
+    With edges both samples are first reduced to histogram counts, see mannwhitney_histogram.
+
+    :param control: Values of the control group.
+    :param test: Values of the test group.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less';
+    'greater' means that the control values tend to be larger, as in scipy.stats.mannwhitneyu(control, test).
+    :param edges: Optional bin edges for the approximate histogram path.
+    :return: A dictionary with the same keys as ttest.
+    """
+    control, test = np.asarray(control, dtype=float), np.asarray(test, dtype=float)
+    if edges is not None:
+        return mannwhitney_histogram(edges, histogram_counts(control, edges), histogram_counts(test, edges),
+                                     alpha, alternative)
+    values, inverse = np.unique(np.concatenate([control, test]), return_inverse=True)
+    counts_control = np.bincount(inverse[:len(control)], minlength=len(values))
+    counts_test = np.bincount(inverse[len(control):], minlength=len(values))
+    return mannwhitney_counts(values, counts_control, counts_test, alpha, alternative)
+
+
+def histogram_counts(sample, edges):
+    """
+    Counts the values of a sample per histogram bin. Counts of separate chunks or files are merged by adding them.
+
+    :param sample: Values or a chunk of values of one group.
+    :param edges: Bin edges; values outside of them are put into the first or the last bin.
+    :return: Array of counts, one per bin.
+    """
+    edges = np.asarray(edges, dtype=float)
+    index = np.clip(np.searchsorted(edges, np.asarray(sample, dtype=float), side='right') - 1, 0, len(edges) - 2)
+    return np.bincount(index, minlength=len(edges) - 1)
+
+
+@profiled
+def mannwhitney_histogram(edges, counts_control, counts_test, alpha=0.05, alternative='two-sided'):
+    """
+    Approximate Mann-Whitney U test from histogram counts, in memory bounded by the number of bins.
+
+    Values inside one bin are treated as ties at the bin center, so the result approaches the exact one
+    as the bins get narrower and is exact when every bin holds a single distinct value.
+
+    :param edges: Bin edges.
+    :param counts_control: Counts of the control group per bin.
+    :param counts_test: Counts of the test group per bin.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :return: A dictionary with the same keys as ttest.
+    """
+    edges = np.asarray(edges, dtype=float)
+    return mannwhitney_counts((edges[:-1] + edges[1:]) / 2, counts_control, counts_test, alpha, alternative)
+
+
+def mannwhitney_counts(values, counts_control, counts_test, alpha=0.05, alternative='two-sided'):
+    """
+    Mann-Whitney U test from the counts of sorted distinct values in both groups.
+
+    :param values: Sorted distinct values (or bin centers).
+    :param counts_control: Number of control observations equal to every value.
+    :param counts_test: Number of test observations equal to every value.
+    :param alpha: Significance level for the test.
+    :param alternative: Specifies the alternative hypothesis. The options are 'two-sided', 'greater' or 'less'.
+    :return: A dictionary with the same keys as ttest.
+    """
+    values = np.asarray(values, dtype=float)
+    counts_control, counts_test = np.asarray(counts_control, dtype=float), np.asarray(counts_test, dtype=float)
+    counts = counts_control + counts_test
+    n1, n2 = counts_control.sum(), counts_test.sum()
+    n = n1 + n2
+
+    average_rank = np.cumsum(counts) - (counts - 1) / 2
+    u1 = (average_rank * counts_control).sum() - n1 * (n1 + 1) / 2
+    tie_term = (counts**3 - counts).sum()
+    s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    mu = n1 * n2 / 2
+
+    if alternative == 'two-sided':
+        p_value = min(1.0, 2 * ndtr(-(max(u1, n1 * n2 - u1) - mu - 0.5) / s))
+    elif alternative == 'greater':
+        p_value = ndtr(-(u1 - mu - 0.5) / s)
+    elif alternative == 'less':
+        p_value = ndtr(-(n1 * n2 - u1 - mu - 0.5) / s)
+    else:
+        raise ValueError("alternative must be 'less', 'greater' or 'two-sided'")
+
+    mean_control, mean_test = (values * counts_control).sum() / n1, (values * counts_test).sum() / n2
+    var_control = (counts_control * (values - mean_control)**2).sum() / (n1 - 1)
+    var_test = (counts_test * (values - mean_test)**2).sum() / (n2 - 1)
+    std_dev = np.sqrt(var_control / n1 + var_test / n2)
+
+    res = _effect_result(p_value, alpha, mean_control, mean_test, std_dev)
+    return _round_result(res, mean_control, round_p_value=True)
+
+
+# sampling without a seed gives a new estimate on every call, so only seeded monte-carlo calls are cached
+@memoize(uncached=lambda a: a['method'] == 'monte-carlo' and a['random_state'] is None)
+@profiled
+def bayes(trials_control, successes_control, trials_test, successes_test, method='exact', n_simulations=100000,
+          random_state=None):
+    """
+    Calculates the probability that the success rate is higher after the test.
+
+    The control data updates a uniform Beta(1, 1) prior; the test data then updates that distribution further.
+
+    :param trials_control: Number of trials in the control group.
+    :param successes_control: Number of successes in the control group.
+    :param trials_test: Number of trials in the test group.
+    :param successes_test: Number of successes in the test group.
+    :param method: 'exact' for numerical quadrature or 'monte-carlo' for sampling from both distributions.
+    :param n_simulations: Number of draws per distribution for the 'monte-carlo' method.
+    :param random_state: Seed or numpy Generator for the 'monte-carlo' method.
+    :return: Probability that the success rate is higher after the test.
+    """
+    alpha_prior, beta_prior, alpha_posterior, beta_posterior = _beta_parameters(
+        trials_control, successes_control, trials_test, successes_test)
+
+    if method == 'exact':
+        return float(prob_greater(alpha_prior, beta_prior, alpha_posterior, beta_posterior)[0])
+    elif method == 'monte-carlo':
+        from lib.rng import make_rng
+        rng = make_rng(random_state)
+        sim_before = rng.beta(alpha_prior, beta_prior, size=n_simulations)
+        sim_after = rng.beta(alpha_posterior, beta_posterior, size=n_simulations)
+        return (sim_after > sim_before).mean()
+    else:
+        raise ValueError("method must be 'exact' or 'monte-carlo'")
+
 
-    n_simulations = 100000
-    sim_before = beta.rvs(alpha_prior, beta_prior, size=n_simulations)
-    sim_after = beta.rvs(alpha_posterior, beta_posterior, size=n_simulations)
+@memoize
+@profiled
+def bayes_batch(trials_control, successes_control, trials_test, successes_test, credible_level=0.95):
+    """
+    Exact Bayesian comparison for arrays of (trials, successes) pairs, using the same model as bayes.
+
+    :param trials_control: Numbers of trials in the control groups.
+    :param successes_control: Numbers of successes in the control groups.
+    :param trials_test: Numbers of trials in the test groups.
+    :param successes_test: Numbers of successes in the test groups.
+    :param credible_level: Probability mass of the credible interval for the relative uplift.
+    :return: A dictionary of arrays with the probability that the success rate is higher after the test,
+    the expected losses of keeping the control and of switching to the test, and the credible interval
+    of the relative uplift.
+    """
+    alpha_prior, beta_prior, alpha_posterior, beta_posterior = _beta_parameters(
+        trials_control, successes_control, trials_test, successes_test)
 
-    p_after_higher = (sim_after > sim_before).mean()
-    return p_after_higher
+    loss_control, loss_test = expected_loss(alpha_prior, beta_prior, alpha_posterior, beta_posterior)
+    ci_left_rel, ci_right_rel = uplift_credible_interval(alpha_prior, beta_prior, alpha_posterior, beta_posterior,
+                                                         credible_level)
+    return {
+        'prob_test_higher': prob_greater(alpha_prior, beta_prior, alpha_posterior, beta_posterior),
+        'expected_loss_control': loss_control,
+        'expected_loss_test': loss_test,
+        'credible_level': credible_level,
+        'ci_left_rel': ci_left_rel,
+        'ci_right_rel': ci_right_rel,
+    }
+
+
+def _beta_parameters(trials_control, successes_control, trials_test, successes_test):
+    """
+    Beta parameters of the success rate before and after the test.
+    """
+    alpha_prior = 1 + np.asarray(successes_control, dtype=float)
+    beta_prior = 1 + np.asarray(trials_control, dtype=float) - successes_control
+    alpha_posterior, beta_posterior = alpha_prior + successes_test, beta_prior + trials_test - successes_test
+    return alpha_prior, beta_prior, alpha_posterior, beta_posterior
 
 
 def calculate_confidence_interval(value, margin_of_error):
@@ -210,8 +497,8 @@ def calculate_p_value_from_z_score(z_score, alternative='two-sided'):
     :return: The calculated p-value.
     """
     if alternative == 'two-sided':
-        return 2 * (1 - norm.cdf(np.abs(z_score)))
+        return 2 * (1 - ndtr(np.abs(z_score)))
     elif alternative == 'smaller':
-        return norm.cdf(z_score)
+        return ndtr(z_score)
     else:
-        return 1 - norm.cdf(z_score)
+        return 1 - ndtr(z_score)
@@ -1,16 +1,27 @@
 import streamlit as st
 import numpy as np
-from scipy.stats import ttest_ind, norm, ttest_ind_from_stats
-from statsmodels.stats.proportion import proportions_ztest
+import pandas as pd
 from collections import namedtuple
 from math import sqrt, ceil
-from lib.validation import ztest, ttest, check_sample_ratio
+from lib.validation import ztest, ttest, check_sample_ratio, mannwhitney, mannwhitney_histogram
+from lib.ingest import (iter_chunks, read_stats, ttest_stats, ztest_stats, sample_ratio_stats,
+                        value_range, read_histograms)
+from lib.multitest import compare_variants, CORRECTIONS
+from lib.ratio import read_moments, ratio_ttest
+from lib.profiling import diagnostics_panel
 from decimal import Decimal, ROUND_HALF_UP
-import matplotlib.pyplot as plt
 
 
 st.markdown('# 🤖 Validation Module')
 
+
+@st.cache_data
+def compare_variants_cached(summary, control, criteria, alpha, correction, pairwise, by):
+    # widgets that only filter the view do not invalidate this cache
+    return compare_variants(summary, control, criteria, alpha, correction=correction, pairwise=pairwise,
+                            by=by)
+
+
 st.markdown('## Sample Ratio Check')
 
 value_ = 1.0
@@ -169,10 +180,166 @@ elif criteria == 'z-test':
 
     
 elif criteria == 'mw':
-    st.write('Not released yet 😢')
+    col1, col2= st.columns(2)
+
+    with col1:
+        alpha = st.number_input(label='Alpha', min_value=0.0001, max_value=1.0,
+                                step= 0.01, value = 0.05,
+                                placeholder= '0.05 is a standart value, but you can chose any')
+        method = st.selectbox('Method', ['exact', 'histogram'],
+                              help='histogram streams the file in chunks and works for tens of millions of rows')
+    with col2:
+        alternative = st.selectbox('Alternative', ['two-sided', 'less', 'greater'])
+        bins = st.number_input(label='Number of histogram bins', min_value=10, value=10000)
+
+    st.divider()
+
+    mw_file = st.file_uploader('Per-user values with variant and value columns', type=['csv', 'parquet'],
+                               key='mw_file')
+    result = None
+    if mw_file is None:
+        st.write('The result will appear here after you upload a file ✍️')
+    else:
+        header = next(iter_chunks(mw_file, chunksize=1))
+        mw_file.seek(0)
+        col_control, col_test = st.columns(2)
+        with col_control:
+            mw_variant_col = st.selectbox('Variant column', header.columns, key='mw_variant_col')
+            mw_control = st.text_input('Control variant', value='control', key='mw_control')
+        with col_test:
+            mw_value_col = st.selectbox('Value column', header.columns, index=min(1, len(header.columns) - 1),
+                                        key='mw_value_col')
+            mw_test = st.text_input('Test variant', value='test', key='mw_test')
+
+        if method == 'exact':
+            raw = pd.concat(iter_chunks(mw_file, columns=[mw_variant_col, mw_value_col])).dropna()
+            groups = {variant: values.to_numpy() for variant, values in raw.groupby(mw_variant_col)[mw_value_col]}
+        else:
+            low, high = value_range(mw_file, mw_value_col)
+            mw_file.seek(0)
+            edges = np.linspace(low, high, int(bins) + 1)
+            groups = read_histograms(mw_file, edges, mw_variant_col, mw_value_col)
+
+        if mw_control not in groups or mw_test not in groups:
+            st.write(f'Variants found in the file: {sorted(map(str, groups))} ☝️')
+        elif method == 'exact':
+            result = mannwhitney(groups[mw_control], groups[mw_test], alpha, alternative)
+        else:
+            result = mannwhitney_histogram(edges, groups[mw_control], groups[mw_test], alpha, alternative)
+
+    if result is not None:
+        pvalue = result['p_value']
+        significance = 100 * result['significance_level']
+        rel_ci = f"{100 * result['ci_left_rel']}, {100 * result['ci_right_rel']}"
+        abs_ci = f"{result['ci_left_abs']}, {result['ci_right_abs']}"
+
+        if pvalue < alpha:
+            st.markdown('**The result is significant 👏 !**')
+        else:
+            st.write('The result is unsignificant 😢')
+        col1, col2, col3 = st.columns(3)
+        col1.metric(label="p-Value", value=pvalue)
+        col1.metric(label="Significance level", value=f"{significance}%")
+        col2.metric(label="Relative Effect", value=f"{100 * result['relative_effect']}%")
+        col2.metric(label="CI of Relative Effect", value=f"[{rel_ci}]")
+        col3.metric(label="Absolute Effect", value=f"{result['absolute_effect']}", help="difference between means")
+        col3.metric(label="CI of Absolute Effect", value=f"[{abs_ci}]")
 
 
     
 elif criteria == 'bayes':
     st.write('Not released yet 😢')
 
+
+st.markdown('## Validation from Raw Data')
+
+uploaded = st.file_uploader('Per-user export with experiment, variant and metric columns', type=['csv', 'parquet'])
+if uploaded is None:
+    st.write('The result will appear here after you upload a file ✍️')
+else:
+    header = next(iter_chunks(uploaded, chunksize=1))
+    uploaded.seek(0)
+    col1, col2 = st.columns(2)
+    with col1:
+        experiment_col = st.selectbox('Experiment column', header.columns)
+        control_name = st.text_input('Control variant', value='control')
+        raw_alpha = st.number_input(label='Alpha for raw data', min_value=0.0001, max_value=1.0,
+                                    step=0.01, value=0.05)
+    with col2:
+        variant_col = st.selectbox('Variant column', header.columns, index=min(1, len(header.columns) - 1))
+        test_name = st.text_input('Test variant', value='test')
+        raw_ratio_plan = st.number_input('Planned Ratio of test group and total for raw data', value=0.5)
+    value_cols = st.multiselect('Metric columns',
+                                [c for c in header.columns if c not in (experiment_col, variant_col)])
+
+    if value_cols:
+        stats = read_stats(uploaded, value_cols=value_cols, experiment_col=experiment_col, variant_col=variant_col)
+        variants = set(stats.index.get_level_values('variant'))
+        if control_name not in variants or test_name not in variants:
+            st.write(f'Variants found in the file: {sorted(map(str, variants))} ☝️')
+            diagnostics_panel()
+            st.stop()
+        tab1, tab2, tab3, tab4 = st.tabs(['Sample Ratio', 't-test', 'z-test', 'Ratio & CUPED'])
+        with tab1:
+            st.dataframe(sample_ratio_stats(stats, raw_ratio_plan, control_name, test_name))
+        with tab2:
+            st.dataframe(ttest_stats(stats, control_name, test_name, raw_alpha))
+        with tab3:
+            st.dataframe(ztest_stats(stats, control_name, test_name, raw_alpha))
+        with tab4:
+            others = [c for c in header.columns if c not in (experiment_col, variant_col)]
+            denominator = st.selectbox('Denominator of every metric', [None] + others,
+                                       help='e.g. sessions for revenue per session; none for per-user means')
+            suffix = st.text_input('Suffix of the pre-period covariate columns', value='_pre',
+                                   help='revenue_pre is the covariate of revenue; leave empty to skip CUPED')
+            metrics = {}
+            for column in value_cols:
+                if column == denominator:
+                    continue
+                covariate = column + suffix if suffix and column + suffix in header.columns else None
+                covariate_denominator = denominator + suffix if (covariate is not None and denominator is not None
+                                                                 and denominator + suffix in header.columns) else None
+                metrics[column] = {'numerator': column, 'denominator': denominator, 'covariate': covariate,
+                                   'covariate_denominator': covariate_denominator}
+            if not metrics:
+                st.write('Choose metric columns other than the denominator ☝️')
+            else:
+                uploaded.seek(0)
+                moments = read_moments(uploaded, metrics, experiment_col=experiment_col, variant_col=variant_col)
+                st.dataframe(ratio_ttest(moments, control_name, test_name, raw_alpha))
+
+
+st.markdown('## Multi-variant Validation')
+
+summary_file = st.file_uploader('Summary table with one row per metric and variant: variant, mean, std, size '
+                                '(t-test) or variant, size, successes (z-test)', type=['csv'], key='summary_file')
+if summary_file is None:
+    st.write('The result will appear here after you upload a file ✍️')
+else:
+    summary = pd.read_csv(summary_file)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        mv_criteria = st.selectbox('Criteria', ['t-test', 'z-test'], key='mv_criteria')
+        mv_control = st.selectbox('Control variant', summary['variant'].unique(), key='mv_control')
+    with col2:
+        mv_alpha = st.number_input(label='Alpha for all comparisons', min_value=0.0001, max_value=1.0,
+                                   step=0.01, value=0.05)
+        mv_correction = st.selectbox('Correction', CORRECTIONS, index=1)
+    with col3:
+        mv_by = st.multiselect('Metric columns', [c for c in summary.columns if summary[c].dtype == object
+                                                  and c != 'variant'],
+                               default=['metric'] if 'metric' in summary.columns else None)
+        mv_pairwise = st.checkbox('All pairwise comparisons', disabled=mv_correction == 'dunnett')
+
+    if not mv_by:
+        st.write('Choose the columns that identify a metric ☝️')
+    else:
+        result = compare_variants_cached(summary, mv_control, mv_criteria, mv_alpha, mv_correction,
+                                         mv_pairwise and mv_correction != 'dunnett', tuple(mv_by))
+        only_significant = st.checkbox('Show only significant comparisons')
+        view = result[result['significant']] if only_significant else result
+        st.dataframe(view)
+        if not view.empty:
+            st.dataframe(view.pivot_table(index=mv_by, columns=['control', 'test'], values='p_adjusted'))
+
+diagnostics_panel()
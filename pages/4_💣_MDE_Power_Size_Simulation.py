@@ -1,31 +1,49 @@
 import streamlit as st
 import numpy as np
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 
-from itertools import product
-from scipy.stats import norm, binom, mannwhitneyu
-from joblib import Parallel, delayed
+from lib.simulation import calculate_tpr, SAMPLINGS, EFFECTS
+from lib.ingest import load_sample
+from lib.power import power, effect_size_from_lift
+from lib.cache import SimulationCache, params_key
+from lib.jobs import JobRegistry
+from lib.search import search_size
+from lib.executor import SimulationExecutor, BACKENDS
+from lib.rng import make_rng
+from lib.profiling import stage, diagnostics_panel
 import time
+import uuid
 
 st.markdown('## MDE-Power-Size Simulation')
 
-np.random.seed(1)
 
-def simulate(lift, n, data):
-    results = []
-    control = data[0:n]
-    test = control * lift
-    for _ in range(simulations):
-        is_control = binom.rvs(1, 0.5, size=n)
-        _, p = mannwhitneyu(control[is_control == True], test[is_control == False])
-        results.append((lift, n, p))
-    return results
+@st.cache_resource
+def get_simulation_cache():
+    return SimulationCache()
 
 
-def calculate_tpr(df):
-    return pd.Series({"tpr": sum(df['pvalue'] < 0.05) / simulations})
+@st.cache_resource
+def get_job_registry():
+    # jobs outlive reruns, so a widget change does not discard a running simulation
+    return JobRegistry()
+
+
+@st.cache_resource
+def get_sample(path, column):
+    # the sample stays memory-mapped; only its mean and deviation are computed up front
+    sample = load_sample(path, column)
+    return sample, float(np.mean(sample)), float(np.std(sample))
+
+
+@st.cache_resource
+def get_shared_executor():
+    return SimulationExecutor()
+
+
+def get_executor(backend, n_jobs):
+    # one worker pool survives reruns; it is restarted when the settings change
+    # instead of leaving the pool of the old settings running next to a new one
+    return get_shared_executor().configure(n_jobs, backend)
+
 
 # data inputs
 col1, col2, col3 = st.columns(3)
@@ -49,6 +67,46 @@ with col3:
 
 simulations = 1000
 
+adaptive = st.checkbox('Adaptive number of simulations',
+                       help='Stops simulating a cell once the confidence interval of its power is narrow enough')
+tolerance = None
+if adaptive:
+    col1, col2 = st.columns(2)
+    with col1:
+        tolerance = st.number_input(label='Width of the power confidence interval', min_value=0.001,
+                                    max_value=1.0, step=0.01, value=0.05)
+    with col2:
+        simulations = st.number_input(label='Maximum number of simulations per cell', min_value=100,
+                                      step=100, value=5000)
+
+with st.expander('Parallel execution'):
+    col1, col2 = st.columns(2)
+    with col1:
+        backend = st.selectbox('Backend', BACKENDS)
+    with col2:
+        n_jobs = st.number_input(label='Number of workers', min_value=-1, value=-1,
+                                 help='-1 uses all cores')
+
+with st.expander('Historical data'):
+    sample_path = st.text_input('Path to a .npy or .parquet sample on the server',
+                                help='Replaces the normal distribution given by Mean and Standart deviation')
+    sample_column = st.text_input('Column of a Parquet sample')
+    col1, col2 = st.columns(2)
+    with col1:
+        sampling = st.selectbox('Sampling', SAMPLINGS, index=1 if sample_path else 0,
+                                help='bootstrap draws fresh subsamples for every simulation')
+    with col2:
+        effect = st.selectbox('Effect', EFFECTS,
+                              help='additive shifts the test values by (lift - 1) * mean instead of scaling them')
+
+sample = None
+if sample_path:
+    try:
+        sample, mu, sd = get_sample(sample_path, sample_column or None)
+        st.write(f'Historical sample: {len(sample)} values, mean {mu:.4g}, standart deviation {sd:.4g}')
+    except (OSError, ValueError, ImportError) as e:
+        st.write(f'Cannot read the sample: {e} 😕')
+
 values = [mu, sd, alpha, lift_left_bound, lift_right_bound, lift_step, size_left_bound, size_right_bound, size_step]
 st.write(values)
 has_none = any(v is None for v in values)
@@ -65,40 +123,103 @@ else:
     else:
         pass
         
-    data = norm.rvs(loc=mu, scale=sd, size=10000)
+    data = sample if sample is not None else make_rng(1).normal(loc=mu, scale=sd, size=10000)
     
-    button_result = st.button("Go!", type="primary")
+    col_go, col_clear = st.columns(2)
+    with col_go:
+        button_result = st.button("Go!", type="primary")
+    with col_clear:
+        if st.button("Clear cached simulations"):
+            get_simulation_cache().invalidate()
+            st.write('Cache is cleared 🧹')
+    job_key = (st.session_state.setdefault('session_id', uuid.uuid4().hex),
+               params_key(mu=mu, sd=sd, alpha=alpha, lifts=lifts, sizes=sizes, simulations=simulations,
+                          tolerance=tolerance, backend=backend, n_jobs=n_jobs, sample_path=sample_path,
+                          sample_column=sample_column, sampling=sampling, effect=effect))
+    registry = get_job_registry()
     if button_result:
-    
-        start_time = time.time()
-        
-        sim_results = Parallel(n_jobs=-1)(delayed(simulate)(lift, n, data) for lift, n in product(lifts, sizes))
-        sim_res=pd.DataFrame([item for sublist in sim_results for item in sublist], columns=["lift", "n", "pvalue"])
-        
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        
-        progress= f"Total runtime: {elapsed_time:.2f} seconds 🚀"
-        st.write(progress)
-        
-        res = sim_res.groupby(["lift", "n"]).apply(calculate_tpr).reset_index()
-
-        tab1, tab2 = st.tabs(["Chart", "Table"])
-
-        with tab1:
-            
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.lineplot(data=res, x='n', y='tpr', hue='lift', marker='o', ax=ax)
-            ax.set_xlabel('Size')
-            ax.set_ylabel('Power')
-            ax.legend(title='Lift')
-            st.pyplot(fig)
-        with tab2:
-            
-            st.table(data=res)
-        
-
+        registry.prune()
+        registry.submit(job_key, lifts=lifts, sizes=sizes, data=data, simulations=simulations, random_state=1,
+                        cache=get_simulation_cache(), tolerance=tolerance, alpha=alpha,
+                        executor=get_executor(backend, int(n_jobs)), sampling=sampling, effect=effect)
+    job = registry.get(job_key)
+
+    if job is not None:
+        if job.running:
+            eta = job.eta()
+            st.progress(job.progress(), text='Simulating... ' + ('' if eta is None else f'about {eta:.0f} s left ⏳'))
+            if st.button('Cancel'):
+                job.cancel()
+        elif job.status == 'failed':
+            st.write(f'The simulation failed: {job.error} 😕')
+        else:
+            elapsed_time = job.finished - job.started
+            note = ' (cancelled)' if job.status == 'cancelled' else ''
+            st.write(f"Total runtime: {elapsed_time:.2f} seconds{note} 🚀")
+
+        sim_res = job.frame()
+        if len(sim_res):
+            st.write(f'{len(sim_res)} simulations')
+            res = calculate_tpr(sim_res, alpha)
+            res['precision'] = (res['ci_right'] - res['ci_left']) / 2
+            # each simulated split puts about n/2 observations in every group
+            res['tpr_analytic'] = power(effect_size_from_lift(res['lift'], 't-test', mu, sd), res['n'] / 2, alpha)
+
+            tab1, tab2 = st.tabs(["Chart", "Table"])
+
+            with tab1:
+                # the plotting stack is loaded on the first rendered chart
+                import seaborn as sns
+                import matplotlib.pyplot as plt
+
+                with stage('render.power_chart'):
+                    fig, ax = plt.subplots(figsize=(10, 6))
+                    sns.lineplot(data=res, x='n', y='tpr', hue='lift', marker='o', ax=ax)
+                    sns.lineplot(data=res, x='n', y='tpr_analytic', hue='lift', linestyle='--', legend=False, ax=ax)
+                    ax.set_xlabel('Size')
+                    ax.set_ylabel('Power')
+                    ax.legend(title='Lift')
+                    ax.set_title('Simulated TPR (solid) and analytic t-test power (dashed)')
+                    st.pyplot(fig)
+            with tab2:
+
+                st.table(data=res)
+
+        if job.running:
+            # poll the background job and redraw with the cells finished meanwhile;
+            # the rerun ends the script here, so the diagnostics are drawn first
+            diagnostics_panel()
+            time.sleep(1)
+            st.rerun()
+
+
+st.markdown('## Size for a Target Power')
+
+col1, col2 = st.columns(2)
+with col1:
+    target_power = st.number_input(label='Target power', min_value=0.01, max_value=0.99, step=0.05, value=0.8)
+with col2:
+    search_lift = st.number_input(label='Lift to detect', min_value=1.0001, value=None)
+
+if search_lift is None or (sample is None and (mu is None or sd is None)):
+    st.write('The search will start after you specify the lift and the data (Mean and Standart deviation '
+             'or a historical sample)')
+elif st.button('Search'):
+    search_data = sample if sample is not None else make_rng(1).normal(loc=mu, scale=sd, size=10000)
+    search_sampling = sampling
+    if sample is None and sampling == 'prefix':
+        # the prefix of a 10000 values sample cannot be larger than the sample itself
+        search_sampling = 'bootstrap'
+    with st.spinner('Searching... ⏳'):
+        found = search_size(search_lift, search_data, target_power, alpha, random_state=1,
+                            executor=get_executor(backend, int(n_jobs)), sampling=search_sampling, effect=effect)
+    if found['size'] is None:
+        st.write('The target power is not reached within the largest size 😢')
     else:
-        pass
-    
-    
+        col1, col2, col3 = st.columns(3)
+        col1.metric(label='Minimal size', value=found['size'], help='both groups together')
+        col2.metric(label='Interpolated size', value=f"{found['estimate']:.0f}")
+        col3.metric(label='Uncertainty interval', value=f"[{found['ci_left']}, {found['ci_right']}]")
+    st.table(found['log'])
+
+diagnostics_panel()
@@ -0,0 +1,102 @@
+import streamlit as st
+import numpy as np
+import time
+
+from lib.bandit import simulate_bandits, bandit_frames, POLICIES
+from lib.executor import SimulationExecutor, BACKENDS
+from lib.profiling import stage, diagnostics_panel
+
+st.markdown('# 🎰 Bandit Simulation')
+st.write('Compares adaptive allocation (Thompson sampling, epsilon-greedy) with a fixed split '
+         'on simulated Beta-Bernoulli experiments.')
+
+
+@st.cache_resource
+def get_shared_executor():
+    return SimulationExecutor()
+
+
+def get_executor(backend, n_jobs):
+    # one worker pool survives reruns; it is restarted when the settings change
+    # instead of leaving the pool of the old settings running next to a new one
+    return get_shared_executor().configure(n_jobs, backend)
+
+
+@st.cache_data
+def run_bandits(rates, policies, trajectories, rounds, batch_size, epsilon, threshold, backend, n_jobs):
+    results = simulate_bandits(list(rates), policies, trajectories, rounds, batch_size, epsilon,
+                               threshold=threshold, random_state=1, executor=get_executor(backend, n_jobs))
+    return bandit_frames(results, rates, batch_size)
+
+
+rates_text = st.text_input('True conversion rates of the arms', value='0.10, 0.11, 0.12',
+                           help='Comma-separated, one per arm; the first arm is the current version')
+col1, col2, col3 = st.columns(3)
+with col1:
+    trajectories = st.number_input(label='Simulated experiments', min_value=10, step=100, value=1000)
+    batch_size = st.number_input(label='Users per round', min_value=1, step=100, value=100)
+with col2:
+    rounds = st.number_input(label='Rounds', min_value=1, step=10, value=50)
+    epsilon = st.number_input(label='Exploration share of epsilon-greedy', min_value=0.0, max_value=1.0,
+                              step=0.05, value=0.1)
+with col3:
+    threshold = st.number_input(label='Decision threshold of P(best arm)', min_value=0.5, max_value=0.9999,
+                                step=0.01, value=0.95)
+    policies = st.multiselect('Policies', POLICIES, default=POLICIES)
+
+with st.expander('Parallel execution'):
+    col1, col2 = st.columns(2)
+    with col1:
+        backend = st.selectbox('Backend', BACKENDS)
+    with col2:
+        n_jobs = st.number_input(label='Number of workers', min_value=-1, value=-1,
+                                 help='-1 uses all cores')
+
+try:
+    rates = tuple(float(v) for v in rates_text.split(',') if v.strip())
+except ValueError:
+    rates = ()
+
+if len(rates) < 2 or any(not 0 <= r <= 1 for r in rates):
+    st.write('Enter at least two conversion rates between 0 and 1 ✍️')
+elif not policies:
+    st.write('Choose at least one policy ☝️')
+elif st.button('Simulate', type='primary'):
+    start_time = time.time()
+    over_time, decisions = run_bandits(rates, tuple(policies), int(trajectories), int(rounds), int(batch_size),
+                                       epsilon, threshold, backend, int(n_jobs))
+    st.write(f'Total runtime: {time.time() - start_time:.2f} seconds 🚀')
+    st.dataframe(decisions)
+
+    # the plotting stack is loaded on the first rendered chart
+    import plotly.graph_objects as go
+
+    with stage('render.bandit_charts'):
+        tab1, tab2, tab3, tab4 = st.tabs(['Regret', 'P(best arm)', 'Decisions', 'Table'])
+        with tab1:
+            fig = go.Figure()
+            for policy, frame in over_time.groupby('policy', sort=False):
+                fig.add_trace(go.Scatter(x=frame['users'], y=frame['regret'], mode='lines', name=policy))
+            fig.update_layout(xaxis_title='Users per experiment',
+                              yaxis_title='Expected cumulative regret (conversions)')
+            st.plotly_chart(fig, theme='streamlit', use_container_width=True)
+        with tab2:
+            fig = go.Figure()
+            for policy, frame in over_time.groupby('policy', sort=False):
+                fig.add_trace(go.Scatter(x=frame['users'], y=frame['prob_best_q50'], mode='lines',
+                                         name=f'{policy} median'))
+                fig.add_trace(go.Scatter(x=np.concatenate([frame['users'], frame['users'][::-1]]),
+                                         y=np.concatenate([frame['prob_best_q5'], frame['prob_best_q95'][::-1]]),
+                                         fill='toself', opacity=0.2, line_width=0, name=f'{policy} 5-95%'))
+            fig.update_layout(xaxis_title='Users per experiment', yaxis_title='P(best arm is the best)')
+            st.plotly_chart(fig, theme='streamlit', use_container_width=True)
+        with tab3:
+            fig = go.Figure()
+            for policy, frame in over_time.groupby('policy', sort=False):
+                fig.add_trace(go.Scatter(x=frame['users'], y=frame['decided'], mode='lines', name=policy))
+            fig.update_layout(xaxis_title='Users per experiment', yaxis_title='Share of decided experiments')
+            st.plotly_chart(fig, theme='streamlit', use_container_width=True)
+    with tab4:
+        st.dataframe(over_time)
+
+diagnostics_panel()
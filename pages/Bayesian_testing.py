@@ -1,8 +1,7 @@
 import streamlit as st
-from lib.validation import bayes
-import plotly.graph_objects as go
-import numpy as np
-from scipy.stats import beta
+from lib.validation import bayes_batch
+from lib.bayesian import beta_curve
+from lib.profiling import stage, diagnostics_panel
 
 
 st.markdown('# 🤖 Bayesian Testing')
@@ -27,45 +26,55 @@ has_none = any(v is None for v in values)
 if has_none:
     st.write('The result will appear here after you specify all parameters ✍️')
 else:
-    result = bayes(trials_control, successes_control, trials_test, successes_test)
-    st.write(f"Probability that success rate is higher after the test: {result:.2%}")
+    result = bayes_batch(trials_control, successes_control, trials_test, successes_test)
+    st.write(f"Probability that success rate is higher after the test: {result['prob_test_higher'][0]:.2%}")
+    col1, col2, col3 = st.columns(3)
+    col1.metric(label="Expected loss of keeping control", value=f"{result['expected_loss_control'][0]:.4%}")
+    col2.metric(label="Expected loss of switching to test", value=f"{result['expected_loss_test'][0]:.4%}")
+    col3.metric(label=f"{result['credible_level']:.0%} credible interval of uplift",
+                value=f"[{result['ci_left_rel'][0]:.2%}, {result['ci_right_rel'][0]:.2%}]")
+
+    # plotting; plotly is only loaded once there is something to plot
+    import plotly.graph_objects as go
 
-    # plotting
-    x = np.linspace(0, 1, 1000)
     alpha_prior, beta_prior = 1 + successes_control, 1 + trials_control - successes_control
     alpha_posterior, beta_posterior = alpha_prior + successes_test, beta_prior + trials_test - successes_test
     mode_posterior = (alpha_posterior - 1) / (alpha_posterior + beta_posterior - 2)
-    fig = go.Figure()
-
-    fig.add_trace(go.Scatter(x=x, y=beta.pdf(x, alpha_prior, beta_prior),
-                             mode='lines', name='Prior Distribution'))
+    # the curves are memoized, so reruns that keep the inputs do not recompute them
+    x, pdf_prior = beta_curve(alpha_prior, beta_prior)
+    _, pdf_posterior = beta_curve(alpha_posterior, beta_posterior)
+    with stage('render.posterior_chart'):
+        fig = go.Figure()
 
-    fig.add_trace(go.Scatter(x=x, y=beta.pdf(x, alpha_posterior, beta_posterior),
-                             mode='lines', name='Posterior Distribution'))
+        fig.add_trace(go.Scatter(x=x, y=pdf_prior,
+                                 mode='lines', name='Prior Distribution'))
 
-    fig.add_vline(x=mode_posterior, line_width=1, line_dash="dash", line_color="red")
+        fig.add_trace(go.Scatter(x=x, y=pdf_posterior,
+                                 mode='lines', name='Posterior Distribution'))
 
-    fig.add_annotation(x=mode_posterior, y=0,
-                       text=f'Most Probable Success Rate: {mode_posterior:.2%}',
-                       showarrow=False, yshift=10)
+        fig.add_vline(x=mode_posterior, line_width=1, line_dash="dash", line_color="red")
 
-    fig.update_layout(
-        # title='Bayesian Update of Success Probability',
-        xaxis_title='Probability of Success',
-        yaxis_title='Probability Density',
-        # legend_title='Distributions',
-        annotations=[
-            dict(
-                x=0.6,
-                y=max(beta.pdf(x, alpha_posterior, beta_posterior)),
-                xref="paper",
-                yref="y",
-                # text="Higher density indicates higher likelihood for the success probability",
-                showarrow=False,
-                align="center"
-            )
-        ]
-    )
-    st.plotly_chart(fig, theme="streamlit", use_container_width=True)
+        fig.add_annotation(x=mode_posterior, y=0,
+                           text=f'Most Probable Success Rate: {mode_posterior:.2%}',
+                           showarrow=False, yshift=10)
 
+        fig.update_layout(
+            # title='Bayesian Update of Success Probability',
+            xaxis_title='Probability of Success',
+            yaxis_title='Probability Density',
+            # legend_title='Distributions',
+            annotations=[
+                dict(
+                    x=0.6,
+                    y=pdf_posterior.max(),
+                    xref="paper",
+                    yref="y",
+                    # text="Higher density indicates higher likelihood for the success probability",
+                    showarrow=False,
+                    align="center"
+                )
+            ]
+        )
+        st.plotly_chart(fig, theme="streamlit", use_container_width=True)
 
+diagnostics_panel()
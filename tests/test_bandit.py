@@ -0,0 +1,20 @@
+import numpy as np
+
+from lib.bandit import simulate_bandits
+from lib.executor import SimulationExecutor
+
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    results = []
+    for n_jobs in (1, 4):
+        executor = SimulationExecutor(n_jobs=n_jobs, backend='threading')
+        try:
+            results.append(simulate_bandits([0.1, 0.12, 0.15], trajectories=250, rounds=5, batch_size=50,
+                                            prob_draws=64, random_state=3, executor=executor))
+        finally:
+            executor.close()
+
+    single, parallel = results
+    for policy in single:
+        for key in single[policy]:
+            np.testing.assert_array_equal(single[policy][key], parallel[policy][key])
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from scipy import integrate, special
+
+from lib import bayesian
+from lib.bayesian import prob_greater, expected_loss, uplift_credible_interval
+
+# (alpha_a, beta_a, alpha_b, beta_b); the narrow distribution is A in some rows and B in others
+PARAMS = np.array([[101, 901, 121, 881], [2, 3, 1, 1], [500, 4500, 30, 250], [7, 40, 900, 5100]], dtype=float)
+DRAWS = 1_000_000
+
+
+def monte_carlo(alpha_a, beta_a, alpha_b, beta_b):
+    rng = np.random.default_rng(0)
+    return rng.beta(alpha_a, beta_a, DRAWS), rng.beta(alpha_b, beta_b, DRAWS)
+
+
+def test_quadrature_matches_monte_carlo():
+    prob = prob_greater(*PARAMS.T)
+    loss_a, loss_b = expected_loss(*PARAMS.T)
+    left, right = uplift_credible_interval(*PARAMS.T, credible_level=0.9)
+
+    for i, row in enumerate(PARAMS):
+        a, b = monte_carlo(*row)
+        scale = np.mean(a)
+        assert abs(prob[i] - np.mean(b > a)) < 3e-3
+        assert abs(loss_a[i] - np.mean(np.maximum(b - a, 0))) < 3e-3 * scale
+        assert abs(loss_b[i] - np.mean(np.maximum(a - b, 0))) < 3e-3 * scale
+        # the interval bounds are checked through the coverage of the simulated uplift
+        assert abs(np.mean(b / a - 1 < left[i]) - 0.05) < 2e-3
+        assert abs(np.mean(b / a - 1 > right[i]) - 0.05) < 2e-3
+
+
+# zero successes (alpha = 1) and highly skewed posteriors of low-conversion experiments
+SKEWED = np.array([[1, 11, 11, 11], [1, 101, 1, 101], [2, 50, 1, 60], [1, 1001, 3, 999], [1, 20001, 5, 19997],
+                   [40, 30000, 1, 30000], [1, 1, 1, 1]], dtype=float)
+
+
+def quad_expectation(func, alpha, beta):
+    # E[func(X)] over the quantiles of X, which leaves no density peak for quad to miss
+    return integrate.quad(lambda u: func(special.betaincinv(alpha, beta, u)), 0, 1, limit=500,
+                          epsabs=1e-13, epsrel=1e-11)[0]
+
+
+def test_skewed_posteriors_match_adaptive_quadrature():
+    prob = prob_greater(*SKEWED.T)
+    left, right = uplift_credible_interval(*SKEWED.T)
+
+    for i, (alpha_a, beta_a, alpha_b, beta_b) in enumerate(SKEWED):
+        def sf_a(x):
+            return special.betainc(beta_a, alpha_a, 1 - min(x, 1))
+
+        expected = quad_expectation(lambda a: special.betainc(beta_b, alpha_b, 1 - a), alpha_a, beta_a)
+        assert prob[i] == pytest.approx(expected, abs=1e-8)
+        # P(B / A <= r) = E[P(A >= B / r)]
+        for bound, tail in ((left[i], 0.025), (right[i], 0.975)):
+            cdf = quad_expectation(lambda b: sf_a(b / (1 + bound)), alpha_b, beta_b)
+            assert cdf == pytest.approx(tail, abs=1e-6)
+
+
+def test_credible_interval_warns_without_convergence(monkeypatch):
+    monkeypatch.setattr(bayesian, 'CI_MAX_ITERATIONS', 1)
+    with pytest.warns(RuntimeWarning, match='did not converge'):
+        uplift_credible_interval(*SKEWED.T)
@@ -0,0 +1,47 @@
+import hashlib
+import types
+
+import numpy as np
+
+from lib import cache
+from lib.executor import SimulationExecutor
+
+
+def _sum(data, start):
+    return float(data[start:].sum())
+
+
+def test_configure_replaces_the_pool_only_when_settings_change():
+    data = np.arange(100.0)
+    executor = SimulationExecutor(backend='sequential')
+    try:
+        parallel = executor._parallel
+        assert executor.configure(backend='sequential') is executor
+        assert executor._parallel is parallel
+
+        executor.configure(n_jobs=2, backend='threading')
+        assert executor._parallel is not parallel
+        assert executor.n_workers() == 2
+        assert executor.map_cells(_sum, [dict(start=0), dict(start=90)], data) == [4950.0, 945.0]
+    finally:
+        executor.close()
+
+
+def test_share_hashes_an_array_once(monkeypatch):
+    calls = []
+
+    def sha1(*args):
+        calls.append(args)
+        return hashlib.sha1(*args)
+
+    monkeypatch.setattr(cache, 'hashlib', types.SimpleNamespace(sha1=sha1))
+    data = np.random.default_rng(0).random(1000)
+    # share() writes files for process backends only; one loky worker runs in-process
+    executor = SimulationExecutor(n_jobs=1, backend='loky')
+    try:
+        first = executor.share(data)
+        assert executor.share(data) == first
+        assert len(calls) == 1
+        np.testing.assert_array_equal(np.load(first), data)
+    finally:
+        executor.close()
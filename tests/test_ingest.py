@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from lib.ingest import empty_stats, chunk_stats, merge_stats
+
+
+def test_merged_chunks_match_whole_frame():
+    rng = np.random.default_rng(0)
+    rows = 5000
+    frame = pd.DataFrame({
+        'experiment': rng.choice(['e1', 'e2'], rows),
+        'variant': rng.choice(['control', 'test'], rows),
+        'revenue': rng.lognormal(3, 1, rows) * (rng.random(rows) < 0.3),
+        'orders': rng.poisson(1.5, rows).astype(float),
+    })
+    frame.loc[rng.random(rows) < 0.05, 'orders'] = np.nan
+
+    stats = empty_stats()
+    # uneven chunks, one of them a single row
+    bounds = [0, 1, 700, 2500, 2600, rows]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        stats = merge_stats(stats, chunk_stats(frame.iloc[start:stop], ['revenue', 'orders']))
+
+    long = frame.melt(id_vars=['experiment', 'variant'], var_name='metric').dropna()
+    grouped = long.groupby(['experiment', 'variant', 'metric'])['value']
+    expected = pd.DataFrame({'count': grouped.count().astype(float), 'mean': grouped.mean(),
+                             'm2': grouped.var() * (grouped.count() - 1),
+                             'successes': grouped.apply(lambda v: (v > 0).sum()).astype(float)})
+
+    pd.testing.assert_frame_equal(stats.sort_index()[expected.columns], expected, check_exact=False, rtol=1e-10)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from lib.executor import SimulationExecutor
+from lib.jobs import SimulationJob
+
+
+def test_finish_time_is_set_once_the_job_stops():
+    data = np.random.default_rng(0).lognormal(0, 1, 500)
+    executor = SimulationExecutor(backend='sequential')
+    try:
+        for _ in range(20):
+            job = SimulationJob([1.0, 1.1], [20, 40], data, simulations=20, random_state=1, executor=executor)
+            while job.running:
+                pass
+            assert job.status == 'done'
+            assert job.finished >= job.started
+            assert len(job.frame()) == 4 * 20
+    finally:
+        executor.close()
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+
+from lib.multitest import holm, benjamini_hochberg, dunnett, compare_variants
+
+
+@pytest.mark.parametrize('func, method', [(holm, 'holm'), (benjamini_hochberg, 'fdr_bh')])
+def test_adjustment_matches_statsmodels(func, method):
+    rng = np.random.default_rng(0)
+    # ties and values close to one included
+    p_values = np.concatenate([rng.uniform(0, 0.05, 10), rng.uniform(0, 1, 30), [0.01, 0.01, 0.99]])
+    rng.shuffle(p_values)
+
+    np.testing.assert_allclose(func(p_values), multipletests(p_values, method=method)[1], rtol=1e-12)
+
+
+@pytest.mark.parametrize('func, method', [(holm, 'holm'), (benjamini_hochberg, 'fdr_bh')])
+def test_adjustment_leaves_nan_out(func, method):
+    p_values = np.array([0.04, np.nan, 0.01, 0.3, np.nan, 0.02])
+    valid = ~np.isnan(p_values)
+
+    res = func(p_values)
+    assert np.isnan(res[~valid]).all()
+    np.testing.assert_allclose(res[valid], multipletests(p_values[valid], method=method)[1], rtol=1e-12)
+
+
+@pytest.mark.parametrize('alternative', ['two-sided', 'one-sided'])
+def test_dunnett_matches_multivariate_normal(alternative):
+    z_scores, loadings = np.array([2.1, -1.3, 2.6]), np.array([0.6, 0.7, 0.5])
+    correlation = np.outer(loadings, loadings)
+    np.fill_diagonal(correlation, 1)
+
+    expected = []
+    for z in z_scores:
+        c = abs(z) if alternative == 'two-sided' else z
+        lower = -np.full(3, c) if alternative == 'two-sided' else None
+        expected.append(1 - stats.multivariate_normal.cdf(np.full(3, c), np.zeros(3), correlation, abseps=1e-8,
+                                                          releps=1e-8, lower_limit=lower))
+    np.testing.assert_allclose(dunnett(z_scores, loadings, alternative), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('criteria, alternative', [('t-test', 'greater'), ('t-test', 'less'),
+                                                   ('z-test', 'greater'), ('z-test', 'smaller')])
+def test_one_sided_dunnett_with_one_arm_keeps_the_direction_of_the_test(criteria, alternative):
+    summary = pd.DataFrame({'metric': 'm', 'variant': ['control', 'b'], 'mean': [10.0, 10.04], 'std': [2.0, 2.5],
+                            'size': [20000, 18000], 'successes': [2000, 1880]})
+
+    res = compare_variants(summary, criteria=criteria, alternative=alternative, correction='dunnett')
+    # one comparison has nothing to adjust for, up to the normal approximation of the t-test
+    assert res['p_adjusted'].iloc[0] == pytest.approx(res['p_value'].iloc[0], rel=1e-3)
+    assert res['p_adjusted'].iloc[0] != pytest.approx(1 - res['p_value'].iloc[0], rel=1e-3)
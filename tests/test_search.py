@@ -0,0 +1,18 @@
+import numpy as np
+
+from lib.executor import SimulationExecutor
+from lib.search import evaluate_size
+
+
+def test_evaluate_size_does_not_depend_on_the_number_of_workers():
+    data = np.random.default_rng(0).lognormal(0, 1, 3000)
+    results = []
+    for n_jobs in (1, 4):
+        executor = SimulationExecutor(n_jobs=n_jobs, backend='threading')
+        try:
+            results.append(evaluate_size(400, 1.2, data, 0.8, executor, batch_size=250, max_simulations=1000,
+                                         random_state=5))
+        finally:
+            executor.close()
+
+    assert results[0] == results[1]
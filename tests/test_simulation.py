@@ -0,0 +1,53 @@
+import numpy as np
+from scipy import stats
+
+from lib.cache import SimulationCache
+from lib.executor import SimulationExecutor
+from lib.simulation import mannwhitney_pvalues, mannwhitney_pvalues_rows, simulate_grid
+
+
+def scipy_pvalue(control, test):
+    return stats.mannwhitneyu(control, test, alternative='two-sided', method='asymptotic').pvalue
+
+
+def test_mannwhitney_pvalues_rows_matches_scipy_with_ties():
+    rng = np.random.default_rng(0)
+    # integer values give many ties
+    control = rng.integers(0, 20, (30, 40)).astype(float)
+    test = rng.integers(1, 21, (30, 55)).astype(float)
+
+    res = mannwhitney_pvalues_rows(control, test)
+    np.testing.assert_allclose(res, [scipy_pvalue(c, t) for c, t in zip(control, test)], rtol=1e-9)
+
+
+def test_mannwhitney_pvalues_matches_scipy_on_splits():
+    rng = np.random.default_rng(1)
+    for control, test in [(rng.normal(0, 1, 60), rng.normal(0.3, 1, 60)),
+                          (rng.integers(0, 5, 60).astype(float), rng.integers(0, 6, 60).astype(float))]:
+        is_control = rng.random((25, 60)) < 0.5
+        res = mannwhitney_pvalues(control, test, is_control)
+        expected = [scipy_pvalue(control[mask], test[~mask]) for mask in is_control]
+        np.testing.assert_allclose(res, expected, rtol=1e-9)
+
+
+def test_cached_cells_are_bit_identical_to_fresh_ones(tmp_path):
+    rng = np.random.default_rng(3)
+    np.save(tmp_path / 'sample.npy', rng.lognormal(0, 1, 2000))
+    data = np.load(tmp_path / 'sample.npy', mmap_mode='r')
+    cache = SimulationCache(tmp_path / 'cache')
+    executor = SimulationExecutor(backend='sequential')
+    # np.arange accumulates float noise: its last value is 1.2000000000000002
+    noisy_lifts, lifts, sizes = np.arange(1.0, 1.25, 0.1), [1.0, 1.1, 1.2], [50, 120]
+    assert noisy_lifts[-1] != lifts[-1]
+
+    def run(lifts, cache):
+        return simulate_grid(lifts, sizes, data, simulations=200, random_state=7, cache=cache, executor=executor)
+
+    fresh = run(lifts, None)
+    stored = run(noisy_lifts, cache)
+    cached = run(lifts, cache)
+
+    for res in (stored, cached):
+        np.testing.assert_array_equal(res['pvalue'].to_numpy(), fresh['pvalue'].to_numpy())
+        np.testing.assert_array_equal(res['n'].to_numpy(), fresh['n'].to_numpy())
+    executor.close()
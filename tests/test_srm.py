@@ -0,0 +1,57 @@
+import itertools
+import warnings
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from lib.srm import srm_pvalues
+
+
+def test_chi_square_matches_scipy():
+    rng = np.random.default_rng(0)
+    weights = np.array([0.5, 0.3, 0.2])
+    observed = rng.multinomial(5000, [0.49, 0.31, 0.2], size=20)
+
+    res = srm_pvalues(observed, weights)
+    expected = [stats.chisquare(row, weights * row.sum()).pvalue for row in observed]
+    np.testing.assert_allclose(res, expected, rtol=1e-9)
+
+
+def brute_force_exact(observed, weights):
+    total = sum(observed)
+    observed_pmf = stats.multinomial.pmf(observed, total, weights)
+    outcomes = [c for c in itertools.product(range(total + 1), repeat=len(weights)) if sum(c) == total]
+    pmf = stats.multinomial.pmf(outcomes, total, weights)
+    return pmf[pmf <= observed_pmf * (1 + 1e-7)].sum()
+
+
+def test_exact_test_matches_enumeration():
+    weights = np.array([0.5, 0.25, 0.25])
+    observed = np.array([[3, 5, 2], [10, 1, 1], [0, 4, 0], [7, 7, 7]])
+
+    res = srm_pvalues(observed, weights)
+    expected = [brute_force_exact(row, weights) for row in observed]
+    np.testing.assert_allclose(res, expected, rtol=1e-9)
+    # with the exact test disabled the same counts get the chi-square approximation
+    assert not np.allclose(srm_pvalues(observed, weights, exact_max_total=0), expected)
+
+
+def test_many_variants_fall_back_to_chi_square():
+    weights = np.full(10, 0.1)
+    observed = np.array([[3, 2, 4, 1, 3, 2, 5, 4, 3, 3]])
+
+    res = srm_pvalues(observed, weights)
+    np.testing.assert_allclose(res, srm_pvalues(observed, weights, exact_max_total=0), rtol=1e-12)
+
+
+def test_zero_weights_are_left_out_without_warnings():
+    weights = np.array([0.5, 0.5, 0.0])
+    observed = np.array([[4, 6, 0], [400, 600, 0], [4, 6, 1]])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        res = srm_pvalues(observed, weights)
+    assert res[0] == pytest.approx(brute_force_exact([4, 6], [0.5, 0.5]), rel=1e-9)
+    assert res[1] == pytest.approx(stats.chisquare([400, 600]).pvalue, rel=1e-9)
+    assert res[2] == 0
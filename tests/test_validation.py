@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from scipy import stats
+from statsmodels.stats.proportion import proportions_ztest
+
+from lib.validation import ttest_batch, ztest_batch, mannwhitney
+
+
+@pytest.mark.parametrize('alternative', ['two-sided', 'less', 'greater'])
+def test_ttest_batch_matches_scipy_welch(alternative):
+    rng = np.random.default_rng(0)
+    rows = 50
+    mean_control, mean_test = rng.normal(10, 1, rows), rng.normal(10, 1, rows)
+    std_control, std_test = rng.uniform(1, 3, rows), rng.uniform(1, 3, rows)
+    size_control, size_test = rng.integers(5, 500, rows), rng.integers(5, 500, rows)
+
+    res = ttest_batch(mean_control, mean_test, std_control, std_test, size_control, size_test,
+                      alternative=alternative)
+    expected = stats.ttest_ind_from_stats(mean_control, std_control, size_control, mean_test, std_test, size_test,
+                                          equal_var=False, alternative=alternative).pvalue
+    np.testing.assert_allclose(res['p_value'], expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize('alternative, statsmodels_alternative', [('two-sided', 'two-sided'), ('greater', 'larger')])
+def test_ztest_batch_matches_statsmodels(alternative, statsmodels_alternative):
+    rng = np.random.default_rng(1)
+    rows = 20
+    size_test, size_control = rng.integers(100, 5000, rows), rng.integers(100, 5000, rows)
+    success_test, success_control = rng.binomial(size_test, 0.1), rng.binomial(size_control, 0.1)
+
+    res = ztest_batch(size_test, size_control, success_test, success_control, alternative=alternative)
+    expected = [proportions_ztest([st, sc], [nt, nc], alternative=statsmodels_alternative)[1]
+                for st, sc, nt, nc in zip(success_test, success_control, size_test, size_control)]
+    np.testing.assert_allclose(res['p_value'], expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize('alternative', ['two-sided', 'less', 'greater'])
+def test_mannwhitney_matches_scipy(alternative):
+    rng = np.random.default_rng(2)
+    control = rng.integers(0, 30, 400).astype(float)
+    test = rng.integers(2, 32, 300).astype(float)
+
+    res = mannwhitney(control, test, alternative=alternative)
+    expected = stats.mannwhitneyu(control, test, alternative=alternative, method='asymptotic').pvalue
+    # the result is rounded to four decimals
+    assert res['p_value'] == pytest.approx(expected, abs=1e-4)